@@ -1,57 +1,83 @@
 #D:\cailu\cailutebao\app.py   路径必须保留
 from flask_migrate import Migrate
-from flask import Flask, jsonify, request, send_from_directory
-from flask_login import LoginManager, current_user
-from utils import today_str, perm, format_date, format_datetime, validate_id_card, get_gender_from_id_card, get_birthday_from_id_card, get_unreturned_assets, register_module_permissions
-from config import Config, SECRET_KEY, DATABASE_PATH, UPLOAD_FOLDER, SALARY_MODES, POSITIONS, POSTS
+from flask import Flask, Response, g, jsonify, request, send_from_directory, render_template, redirect, url_for, flash
+from flask_login import LoginManager, current_user, login_required
+from utils import today_str, perm, format_date, format_datetime, validate_id_card, get_gender_from_id_card, get_birthday_from_id_card, get_unreturned_assets, register_module_permissions, get_unread_notice_count, rebuild_notification_counters, install_sqlite_profile, install_sqlite_savepoint_support, benchmark_storage_profile, get_backup_status, install_sql_profiler, begin_request_profile, finish_request_profile, get_perf_summary, get_slow_query_groups, reset_perf_stats, end_request_profile, record_cache_access, render_metrics, register_waitress_server, get_inflight_requests, start_request_watchdog, JsonLogFormatter, RequestContextFilter, ensure_incremental_auto_vacuum
+from config import Config, SECRET_KEY, DATABASE_PATH, UPLOAD_FOLDER, SALARY_MODES, POSITIONS, POSTS, STORAGE_PROFILES, DB_CHECKPOINT_INTERVAL, DB_OPTIMIZE_INTERVAL, UPLOAD_BASE_DIR, METRICS_TOKEN, WATCHDOG_THRESHOLD, WATCHDOG_INTERVAL, WAITRESS_HOST, WAITRESS_PORT, WAITRESS_THREADS, WAITRESS_CONNECTION_LIMIT, RETENTION_POLICIES
 from models import db, Asset, User, Permission, ChatMessage  # 如需彻底清理可删除 ChatMessage
 from routes import register_blueprints
 import json, os
+import hmac
 import time
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import queue
+import atexit
 import traceback
 from sqlalchemy import func
 from datetime import datetime, date, timedelta
 import threading
+import click
 
 # ==================== 核心优化1：日志增强（定位崩溃原因） ====================
 LOG_DIR = os.getenv('CAILU_LOG_DIR', 'D:/cailu/log')
+LOG_FORMAT = os.getenv('CAILU_LOG_FORMAT', 'text')   # text：传统单行文本；json：每行一个 JSON（带请求ID/用户/端点/耗时）
 os.makedirs(LOG_DIR, exist_ok=True)
 
 app_log_path = os.path.join(LOG_DIR, 'app.log')
 error_log_path = os.path.join(LOG_DIR, 'error.log')
 log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
+def _log_formatter():
+    return JsonLogFormatter() if LOG_FORMAT == 'json' else logging.Formatter(log_format)
+
+def _rotating_handler(path, formatter):
+    handler = RotatingFileHandler(
+        path,
+        maxBytes=10 * 1024 * 1024,
+        backupCount=5,
+        encoding='utf-8'
+    )
+    handler.setFormatter(formatter)
+    return handler
+
+def _attach_log_queue(logger, *handlers):
+    """
+    请求线程只把日志记录放入队列，由 QueueListener 后台线程负责格式化、写盘与轮转，
+    磁盘 I/O 与轮转锁不再出现在 waitress 工作线程上。请求上下文在入队前补齐。
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 进程退出时把队列中剩余日志写完
+    atexit.register(listener.stop)
+    return listener
+
 root_logger = logging.getLogger()
 root_logger.setLevel(logging.INFO)
 root_logger.handlers.clear()
-
-app_file_handler = RotatingFileHandler(
-    app_log_path,
-    maxBytes=10 * 1024 * 1024,
-    backupCount=5,
-    encoding='utf-8'
-)
-app_file_handler.setFormatter(logging.Formatter(log_format))
-root_logger.addHandler(app_file_handler)
-
+app_file_handler = _rotating_handler(app_log_path, _log_formatter())
 console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter(log_format))
-root_logger.addHandler(console_handler)
+console_handler.setFormatter(_log_formatter())
+_attach_log_queue(root_logger, app_file_handler, console_handler)
 
 # 错误日志单独记录
 error_logger = logging.getLogger('error')
 error_logger.setLevel(logging.ERROR)
 error_logger.handlers.clear()
-error_file_handler = RotatingFileHandler(
-    error_log_path,
-    maxBytes=10 * 1024 * 1024,
-    backupCount=5,
-    encoding='utf-8'
-)
-error_file_handler.setFormatter(logging.Formatter(log_format))
-error_logger.addHandler(error_file_handler)
+error_file_handler = _rotating_handler(error_log_path, _log_formatter())
+_attach_log_queue(error_logger, error_file_handler)
+
+# 慢查询单独记录（每行一个 JSON：语句、脱敏参数、端点、耗时、EXPLAIN QUERY PLAN）
+slow_query_logger = logging.getLogger('slow_query')
+slow_query_logger.setLevel(logging.WARNING)
+slow_query_logger.propagate = False
+slow_query_logger.handlers.clear()
+slow_query_file_handler = _rotating_handler(os.path.join(LOG_DIR, 'slow_query.log'), logging.Formatter('%(message)s'))
+_attach_log_queue(slow_query_logger, slow_query_file_handler)
 # ==================== 应用初始化 ====================
 app = Flask(__name__)
 app.config.update(
@@ -60,38 +86,59 @@ app.config.update(
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
     UPLOAD_FOLDER=UPLOAD_FOLDER,
     MAX_CONTENT_LENGTH=50 * 1024 * 1024,
-    # 核心优化2：数据库连接池配置（防止连接耗尽）
+    # 核心优化2：数据库连接池配置。SQLite 本地文件连接不会失效，无需 recycle/pre_ping；
+    # 池大小覆盖 waitress 24 个工作线程 + 后台线程，避免线程排队等连接
     SQLALCHEMY_ENGINE_OPTIONS={
-        'pool_size': 10,        # 连接池大小
-        'max_overflow': 20,     # 最大溢出连接数
-        'pool_recycle': 300,    # 5分钟回收连接，防止失效
-        'pool_pre_ping': True   # 每次请求前检查连接是否有效
+        'pool_size': 30,
+        'max_overflow': 10,
+        'pool_timeout': 30,
     }
 )
 
 # ==================== 扩展初始化 ====================
 db.init_app(app)
+with app.app_context():
+    # 每个新连接应用 SQLite 存储配置（WAL、busy_timeout 等，见 config.STORAGE_PROFILES）
+    install_sqlite_profile(db.engine)
+    # 由引擎显式 BEGIN，使 SAVEPOINT（审计写入）始终嵌套在调用方事务内
+    install_sqlite_savepoint_support(db.engine)
+    # 每条 SQL 计时，按请求汇总查询数 / SQL 总耗时 / 最慢语句
+    install_sql_profiler(db.engine)
 register_blueprints(app)
 migrate = Migrate(app, db, render_as_batch=True)
 
 @app.before_request
 def mark_request_start():
     request._start_time = datetime.now()
+    begin_request_profile()
 
 @app.after_request
 def log_request_result(response):
     start_time = getattr(request, '_start_time', None)
     if start_time:
         duration_ms = (datetime.now() - start_time).total_seconds() * 1000
+        sql = finish_request_profile(request.endpoint or 'unknown', duration_ms, request.blueprint)
         logging.info(
-            "request %s %s status=%s cost=%.2fms",
+            "request %s %s status=%s cost=%.2fms queries=%d db=%.2fms slowest=%.2fms",
             request.method,
             request.path,
             response.status_code,
-            duration_ms
+            duration_ms,
+            sql['count'],
+            sql['time'],
+            sql['slowest_ms'],
+            extra={'duration_ms': round(duration_ms, 2), 'status': response.status_code}
         )
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
     return response
 
+@app.teardown_request
+def mark_request_end(exc):
+    # 放在 teardown 中：视图抛异常时 after_request 不执行，也要扣减在途请求数
+    end_request_profile()
+
 # Flask-Login 初始化
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -194,12 +241,14 @@ def inject_global_data():
         user_id = current_user.id
         now = datetime.now().timestamp()
         
-        # 检查缓存是否过期
-        if user_id in _notice_cache and now - _notice_cache[user_id]['time'] < _cache_expire:
-            data = _notice_cache[user_id]['data']
+        # 检查缓存是否过期（只缓存全局待审核数；未读数走计数表，主键读取无需缓存）
+        cache_hit = user_id in _notice_cache and now - _notice_cache[user_id]['time'] < _cache_expire
+        record_cache_access('global_pending', cache_hit)
+        if cache_hit:
+            data = dict(_notice_cache[user_id]['data'])
         else:
             try:
-                from models import EmploymentCycle, Notification, EmployeeDocument
+                from models import EmploymentCycle, EmployeeDocument
                 # 全局获取待审核人数
                 p_count = EmploymentCycle.query.filter(
                     db.or_(
@@ -209,14 +258,18 @@ def inject_global_data():
                 ).count()
                 # 全局获取证件待审批数量
                 doc_pending_count = EmployeeDocument.query.filter_by(pending_status='pending').count()
-                # 全局获取未读通知数
-                n_count = Notification.query.filter_by(user_id=user_id, is_read=False).count()
-                data = dict(pending_count=p_count, doc_pending_count=doc_pending_count, unread_notice_count=n_count)
+                data = dict(pending_count=p_count, doc_pending_count=doc_pending_count)
                 # 更新缓存
-                _notice_cache[user_id] = {'time': now, 'data': data}
+                _notice_cache[user_id] = {'time': now, 'data': dict(data)}
             except Exception as e:
                 logging.error(f"获取全局数据失败: {e}")
-                data = dict(pending_count=0, doc_pending_count=0, unread_notice_count=0)
+                data = dict(pending_count=0, doc_pending_count=0)
+        try:
+            # 全局获取未读通知数
+            data['unread_notice_count'] = get_unread_notice_count(user_id)
+        except Exception as e:
+            logging.error(f"获取未读通知数失败: {e}")
+            data['unread_notice_count'] = 0
         return data
     return dict(pending_count=0, doc_pending_count=0, unread_notice_count=0)
 
@@ -251,61 +304,34 @@ def is_within_hour(date_str):
         logging.error(f"时间判断逻辑出错 -> {e}")
         return False
 
-# ==================== 装备查询相关（优化：添加异常处理） ====================
+# ==================== 装备查询相关（读取 asset_holdings 物化表） ====================
 @app.context_processor
 def inject_equipped_assets():
     def get_equipped_assets(cycle_id):
-        """查询该员工当前领用的装备（净领用数量 > 0）"""
+        """查询该员工领用的装备；离职自动归还的部分仍展示（详情页以"已归还"遮罩显示）"""
         try:
-            from models import AssetHistory, Asset
-            
-            # 统计发放和归还数量
-            issued = db.session.query(
-                AssetHistory.asset_id,
-                func.sum(AssetHistory.quantity).label('issued_qty'),
-                func.max(AssetHistory.action_date).label('latest_date'),
-                func.max(AssetHistory.operator_id).label('operator_id'),
-                func.max(AssetHistory.note).label('note')
-            ).filter(
-                AssetHistory.user_id == cycle_id,
-                AssetHistory.action == '发放'
-            ).group_by(AssetHistory.asset_id).subquery()
-            
-            returned = db.session.query(
-                AssetHistory.asset_id,
-                func.sum(AssetHistory.quantity).label('returned_qty')
-            ).filter(
-                AssetHistory.user_id == cycle_id,
-                AssetHistory.action == '归还'
-            ).group_by(AssetHistory.asset_id).subquery()
+            from models import AssetHolding, Asset
             
+            shown_qty = AssetHolding.quantity + AssetHolding.departure_quantity
             query = db.session.query(
-                Asset,
-                (issued.c.issued_qty - func.coalesce(returned.c.returned_qty, 0)).label('net_qty'),
-                issued.c.latest_date,
-                issued.c.operator_id,
-                issued.c.note
+                Asset, shown_qty, AssetHolding.last_issue_date, User.name, AssetHolding.last_note
             ).join(
-                issued, Asset.id == issued.c.asset_id
+                AssetHolding, Asset.id == AssetHolding.asset_id
             ).outerjoin(
-                returned, Asset.id == returned.c.asset_id
+                User, User.id == AssetHolding.last_operator_id
             ).filter(
+                AssetHolding.cycle_id == cycle_id,
                 Asset.type.in_(['装备', '服饰']),
-                (issued.c.issued_qty - func.coalesce(returned.c.returned_qty, 0)) > 0
-            )
+                shown_qty > 0
+            ).order_by(Asset.id)
             
-            results = []
-            for asset, net_qty, issue_date, operator_id, note in query.all():
-                operator = db.session.get(User, operator_id)
-                results.append({
-                    'asset': asset,
-                    'quantity': net_qty,
-                    'issue_date': issue_date,
-                    'issued_by': operator.name if operator else '未知',
-                    'note': note or ''
-                })
-            
-            return results
+            return [{
+                'asset': asset,
+                'quantity': qty,
+                'issue_date': issue_date,
+                'issued_by': operator_name or '未知',
+                'note': note or ''
+            } for asset, qty, issue_date, operator_name, note in query.all()]
         except Exception as e:
             logging.error(f"查询领用装备失败: {e}")
             return []
@@ -315,34 +341,14 @@ def inject_equipped_assets():
 @app.context_processor
 def inject_unreturned_assets():
     def get_unreturned_assets(cycle_id):
-        """查询该员工当前领用的装备（净领用数量 > 0） - 与员工详情页保持一致"""
+        """查询该员工当前仍持有的资产（净持有数量 > 0） - 与员工详情页保持一致"""
         try:
-            from models import AssetHistory, Asset
-            
-            issued = db.session.query(
-                AssetHistory.asset_id,
-                func.sum(AssetHistory.quantity).label('issued_qty')
-            ).filter(
-                AssetHistory.user_id == cycle_id,
-                AssetHistory.action == '发放'
-            ).group_by(AssetHistory.asset_id).subquery()
-            
-            returned = db.session.query(
-                AssetHistory.asset_id,
-                func.sum(AssetHistory.quantity).label('returned_qty')
-            ).filter(
-                AssetHistory.user_id == cycle_id,
-                AssetHistory.action == '归还'
-            ).group_by(AssetHistory.asset_id).subquery()
+            from models import AssetHolding, Asset
             
-            query = db.session.query(Asset)\
-                .join(issued, Asset.id == issued.c.asset_id)\
-                .outerjoin(returned, Asset.id == returned.c.asset_id)\
-                .filter(
-                    (issued.c.issued_qty - func.coalesce(returned.c.returned_qty, 0)) > 0
-                )
-            
-            return query.all()
+            return db.session.query(Asset)\
+                .join(AssetHolding, Asset.id == AssetHolding.asset_id)\
+                .filter(AssetHolding.cycle_id == cycle_id, AssetHolding.quantity > 0)\
+                .order_by(Asset.id).all()
         except Exception as e:
             logging.error(f"查询未归还装备失败: {e}")
             return []
@@ -388,7 +394,7 @@ def inject_keys():
 @app.route('/uploads/<path:filename>')
 def serve_uploads(filename):
     try:
-        return send_from_directory(r"D:\cailu\uploads", filename)
+        return send_from_directory(os.path.join(UPLOAD_BASE_DIR, 'uploads'), filename)
     except Exception as e:
         logging.error(f"上传文件访问失败: {e}")
         return jsonify({'code': 404, 'msg': '文件不存在'}), 404
@@ -409,21 +415,66 @@ def healthz():
             'status': 'ok',
             'time': datetime.now().isoformat(timespec='seconds'),
             'pid': os.getpid(),
-            'threads': threading.active_count()
+            'threads': threading.active_count(),
+            'backup': get_backup_status()
         }), 200
     except Exception as e:
         logging.error(f"健康检查失败: {e}")
         return jsonify({'status': 'degraded', 'error': str(e)}), 500
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文本格式指标；配置了 CAILU_METRICS_TOKEN 时需携带 ?token= 或 Bearer 令牌，未配置时仅系统管理员可访问"""
+    if METRICS_TOKEN:
+        supplied = request.args.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        allowed = hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode())
+    else:
+        # 未配置令牌时不对匿名请求开放（指标中含用户数、队列深度等内部信息）
+        allowed = current_user.is_authenticated and current_user.role == 'admin'
+    if not allowed:
+        return Response('forbidden\n', status=403, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/debug/perf', methods=['GET', 'POST'])
+@login_required
+def debug_perf():
+    """各端点耗时分位数与 SQL 统计（仅系统管理员）；POST 清空统计，?format=json 返回原始数据"""
+    if current_user.role != 'admin':
+        flash('权限不足，仅系统管理员可查看性能统计', 'danger')
+        return redirect(url_for('main.index'))
+    if request.method == 'POST':
+        reset_perf_stats()
+        return redirect(url_for('debug_perf'))
+    rows = get_perf_summary()
+    slow_groups = get_slow_query_groups()
+    if request.args.get('format') == 'json':
+        return jsonify({'endpoints': rows, 'slow_queries': slow_groups})
+    return render_template('debug/perf.html', rows=rows, slow_groups=slow_groups)
+
+@app.route('/debug/inflight')
+@login_required
+def debug_inflight():
+    """在途请求及其线程当前调用栈（仅系统管理员），用于定位占满工作线程的端点"""
+    if current_user.role != 'admin':
+        return jsonify({'code': 403, 'msg': '权限不足'}), 403
+    rows = [r for r in get_inflight_requests() if r['thread_id'] != threading.get_ident()]
+    return jsonify({'time': datetime.now().isoformat(timespec='seconds'), 'count': len(rows), 'requests': rows})
+
 # ==================== 核心优化3：定时任务独立线程运行 ====================
 def start_background_tasks():
     """启动后台定时任务（独立线程）"""
     try:
-        from utils import start_backup_scheduler, start_notification_cleanup_scheduler
+        from utils import start_backup_scheduler, start_file_cleanup_scheduler, start_retention_scheduler, start_sqlite_maintenance_scheduler, start_notification_outbox_worker
+        # 启动通知发件箱投递（审计通知异步展开写入）
+        start_notification_outbox_worker(interval=5)
         # 启动备份任务
         start_backup_scheduler(interval=86400)
-        # 启动通知清理任务
-        start_notification_cleanup_scheduler(weekday=0, hour=3, minute=33, retention_days=30)
+        # 启动孤立文件清理（与备份错开，每周日凌晨）
+        start_file_cleanup_scheduler(weekday=6, hour=4, minute=17)
+        # 启动数据库例行维护（WAL checkpoint / PRAGMA optimize）
+        start_sqlite_maintenance_scheduler(DB_CHECKPOINT_INTERVAL, DB_OPTIMIZE_INTERVAL)
+        # 启动数据保留任务（通知/操作日志/聊天记录分批清理与归档）
+        start_retention_scheduler(weekday=0, hour=3, minute=33)
         logging.info("后台定时任务启动成功")
     except Exception as e:
         logging.error(f"后台任务启动失败: {e}")
@@ -439,12 +490,114 @@ def start_heartbeat_logger(interval=60):
 
     threading.Thread(target=heartbeat_task, daemon=True).start()
 
+# ==================== 命令行工具 ====================
+@app.cli.command('storage-bench')
+@click.option('--profile', 'profiles', multiple=True, help='要测试的存储配置，可多次指定；默认全部')
+@click.option('--readers', default=24, show_default=True, help='并发读线程数')
+@click.option('--seconds', default=5.0, show_default=True, help='每个配置的持续时间')
+def storage_bench_command(profiles, readers, seconds):
+    """SQLite 存储配置并发基准（flask storage-bench [--profile wal --profile legacy]）"""
+    for name in profiles or STORAGE_PROFILES:
+        result = benchmark_storage_profile(name, readers=readers, seconds=seconds)
+        click.echo(json.dumps(result, ensure_ascii=False))
+
+@app.cli.command('synth-seed')
+@click.option('--people', default=1500, show_default=True, help='人数（约两成会有多段入职周期）')
+@click.option('--years', default=2, show_default=True, help='排班、流水、日志覆盖的年数')
+@click.option('--seed', default=42, show_default=True, help='随机种子，相同参数生成相同数据')
+def synth_seed_command(people, years, seed):
+    """向临时库写入合成数据（需设置 CAILU_DATABASE_PATH，拒绝写入业务库）"""
+    from synthetic import is_scratch_database, generate_synthetic_data
+    if not is_scratch_database():
+        raise click.ClickException('请先设置 CAILU_DATABASE_PATH 指向一个临时库文件')
+    setup_database()
+    started = time.time()
+    with app.app_context():
+        counts = generate_synthetic_data(people=people, years=years, seed=seed)
+    click.echo(json.dumps(counts, ensure_ascii=False))
+    click.echo(f'用时 {time.time() - started:.1f}s，数据库: {DATABASE_PATH}')
+
+@app.cli.command('load-test')
+@click.option('--db', 'source_db', required=True, help='已用 synth-seed 生成数据的源库（每轮压测复制一份，不修改源库）')
+@click.option('--threads', multiple=True, type=int, default=(24,), show_default=True, help='waitress 线程数，可重复指定做对比')
+@click.option('--profile', multiple=True, default=('wal',), show_default=True, help='存储配置（见 config.STORAGE_PROFILES），可重复指定')
+@click.option('--duration', default=60, show_default=True, help='每轮持续秒数')
+@click.option('--tabs', default=40, show_default=True, help='轮询通知的标签页数')
+@click.option('--sse-tabs', default=0, show_default=True, help='保持 SSE 长连接的标签页数')
+@click.option('--leaders', default=3, show_default=True, help='编辑排班矩阵的班长数')
+@click.option('--hr', 'hr_users', default=2, show_default=True, help='浏览花名册的人事数')
+@click.option('--import/--no-import', 'importer', default=True, show_default=True, help='是否同时循环执行花名册导入')
+@click.option('--poll-interval', default=5.0, show_default=True, help='标签页轮询间隔（秒）')
+@click.option('--output', default=None, help='把全部结果写入 JSON 文件')
+def load_test_command(source_db, threads, profile, duration, tabs, sse_tabs, leaders, hr_users, importer, poll_interval, output):
+    """本地压测：按 线程数 × 存储配置 逐轮启动服务并回放值班室流量，输出吞吐、延迟分位与锁错误数"""
+    from loadtest import run_load_test
+    from config import STORAGE_PROFILES
+    unknown = [p for p in profile if p not in STORAGE_PROFILES]
+    if unknown:
+        raise click.ClickException(f"未知存储配置: {', '.join(unknown)}")
+    reports = []
+    for p in profile:
+        for t in threads:
+            click.echo(f'>>> threads={t} profile={p} duration={duration}s ...')
+            r = run_load_test(source_db, threads=t, profile=p, duration=duration, tabs=tabs, sse_tabs=sse_tabs,
+                              leaders=leaders, hr_users=hr_users, importer=importer, poll_interval=poll_interval)
+            reports.append(r)
+            o = r['overall']
+            click.echo(f"    总计 {o['requests']} 次 {o['rps']}/s  p50={o['p50_ms']} p95={o['p95_ms']} p99={o['p99_ms']} "
+                       f"错误率={o['error_rate']:.2%}  日志锁错误={r['locked_in_logs']}")
+            click.echo(f"    {'请求':<24}{'次数':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'错误':>6}{'锁':>6}")
+            for name, s in r['by_request'].items():
+                click.echo(f"    {name:<24}{s['requests']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}"
+                           f"{s['errors']:>6}{s['locked_responses']:>6}")
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        click.echo(f'结果已写入: {output}')
+
+@app.cli.command('retention')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(list(RETENTION_POLICIES)), help='只处理指定表，可重复；默认全部')
+@click.option('--dry-run', is_flag=True, help='只统计待清理行数')
+@click.option('--batch', default=None, type=int, help='每批行数（默认 config.RETENTION_BATCH）')
+@click.option('--enable-incremental-vacuum', is_flag=True, help='先把数据库切换为 auto_vacuum=INCREMENTAL（执行完整 VACUUM，需停机）')
+def retention_command(tables, dry_run, batch, enable_incremental_vacuum):
+    """按保留策略分批清理/归档通知、操作日志、聊天记录与发件箱死信（flask retention [--dry-run]）"""
+    from utils import run_retention, enable_incremental_vacuum as switch_auto_vacuum
+    if enable_incremental_vacuum:
+        click.echo(f'auto_vacuum = {switch_auto_vacuum()}')
+    click.echo(json.dumps(run_retention(tables or None, batch=batch, dry_run=dry_run), ensure_ascii=False, indent=2))
+
+@app.cli.command('gc-uploads')
+@click.option('--full', is_flag=True, help='全量检查（默认增量：只检查上次运行后有变化的目录）')
+@click.option('--dry-run', is_flag=True, help='只统计不移动文件')
+def gc_uploads_command(full, dry_run):
+    """孤立上传文件清理（flask gc-uploads [--full] [--dry-run]）"""
+    from utils import cleanup_isolated_files
+    click.echo(json.dumps(cleanup_isolated_files(full=full, dry_run=dry_run), ensure_ascii=False))
+
+@app.cli.command('rebuild-file-refs')
+def rebuild_file_refs_command():
+    """从业务表回填上传文件登记（flask rebuild-file-refs）"""
+    from utils import rebuild_file_references
+    click.echo(f'新增登记 {rebuild_file_references()} 条')
+
 # ==================== 初始化函数 ====================
-def init_app():
-    """应用初始化（封装核心逻辑）"""
+def setup_database():
+    """建表、迁移、权限注册、管理员账号与派生表校准；不启动后台线程（命令行工具、测试只调用这一部分）"""
     with app.app_context():
-        # 创建所有表（如果不存在）
+        # 新建库先启用增量 auto_vacuum（数据保留清理后可归还空间），再创建所有表（如果不存在）
+        ensure_incremental_auto_vacuum()
         db.create_all()
+
+        # 旧库补建排班唯一索引（先合并重复记录）
+        from routes.scheduling import migrate_shift_schedule_unique
+        migrate_shift_schedule_unique()
+        # 旧库补建通知表 (user_id, is_read, created_at) 索引
+        from routes.notification import migrate_notification_index
+        migrate_notification_index()
+        # 旧库发件箱补加死信列
+        from utils import migrate_notification_outbox
+        migrate_notification_outbox()
         
         # 动态注册权限
         try:
@@ -479,34 +632,53 @@ def init_app():
             db.session.add(admin_user)
             db.session.commit()
             logging.info("创建系统管理员账号成功")
-        
-        # 启动后台定时任务（独立线程）
-        threading.Thread(target=start_background_tasks, daemon=True).start()
-        start_heartbeat_logger(interval=60)
-        logging.info("数据库初始化完成，应用启动准备就绪")
+
+        # 旧版导入遗留的占位密码补算为真实哈希（占位值本身无法登录）
+        from routes.hr.import_export import hash_legacy_initial_passwords
+        hash_legacy_initial_passwords()
+
+        # 校准未读通知计数（计数表为新增表或历史数据未同步时）
+        rebuild_notification_counters()
+
+        # 资产持有表为新增表时，从资产历史重建
+        from routes.asset.core import ensure_asset_holdings
+        ensure_asset_holdings()
+        logging.info("数据库初始化完成")
+
+def init_app():
+    """应用初始化：数据库准备 + 启动后台任务（备份、清理、发件箱、心跳、看门狗）"""
+    setup_database()
+    # 启动后台定时任务（独立线程）
+    threading.Thread(target=start_background_tasks, daemon=True).start()
+    start_heartbeat_logger(interval=60)
+    start_request_watchdog(WATCHDOG_THRESHOLD, WATCHDOG_INTERVAL)
+    logging.info("应用启动准备就绪")
 
 # ==================== 主函数 ====================
 if __name__ == '__main__':
     init_app()
     
-    host = '127.0.0.1' 
-    port = 8001
+    host = WAITRESS_HOST
+    port = WAITRESS_PORT
     
     try:
-        from waitress import serve
+        from waitress import create_server
         
         logging.info(f"✅ 后端服务启动成功，监听本地端口：http://{host}:{port}")
         logging.info(f"🚀 请通过 Nginx 代理地址访问：https://cailutebao.top:8000")
         
-        serve(
+        server = create_server(
             app,
             host=host,
             port=port,
-            threads=24,           
-            connection_limit=1024,
+            threads=WAITRESS_THREADS,
+            connection_limit=WAITRESS_CONNECTION_LIMIT,
             channel_timeout=120,
             cleanup_interval=30
         )
+        # 保留服务实例，/metrics 从中读取任务队列深度
+        register_waitress_server(server)
+        server.run()
     
     except Exception as e:
         logging.error(f"❌ Waitress 启动失败: {e}")
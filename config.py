@@ -21,8 +21,90 @@ class Config:
 # 项目根目录绝对路径（用于文件上传、数据库定位）
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
-# SQLite 数据库路径（会自动在 data 文件夹生成 database.db）
-DATABASE_PATH = os.path.join(BASE_DIR, 'data', 'database.db')
+# SQLite 数据库路径（会自动在 data 文件夹生成 database.db）；
+# 基准/压测时用 CAILU_DATABASE_PATH 指向临时库，不碰业务数据
+DATABASE_PATH = os.getenv('CAILU_DATABASE_PATH') or os.path.join(BASE_DIR, 'data', 'database.db')
+
+# SQLite 存储配置（每个连接建立时执行的 PRAGMA），通过环境变量 CAILU_DB_PROFILE 选择
+#   wal    : 默认。WAL 模式读写互不阻塞，synchronous=NORMAL（断电最多丢最后几个事务，不会损坏库）
+#   safe   : WAL + synchronous=FULL，每次提交都落盘，写入稍慢
+#   legacy : 原回滚日志模式，仅用于不支持 WAL 的环境（如网络盘）
+STORAGE_PROFILES = {
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,          # 毫秒，遇到写锁时等待而不是立即报 database is locked
+        'cache_size': -65536,          # 负数单位为 KiB，即 64MB 页缓存
+        'mmap_size': 268435456,        # 256MB 内存映射读
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,    # 页
+    },
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 10000,
+        'cache_size': -16384,
+        'mmap_size': 0,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,
+    },
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+}
+STORAGE_PROFILE = os.getenv('CAILU_DB_PROFILE', 'wal')
+# 例行维护：被动 checkpoint 与 PRAGMA optimize 的间隔（秒）
+DB_CHECKPOINT_INTERVAL = int(os.getenv('CAILU_DB_CHECKPOINT_INTERVAL', '300'))
+DB_OPTIMIZE_INTERVAL = int(os.getenv('CAILU_DB_OPTIMIZE_INTERVAL', str(6 * 3600)))
+
+# 慢查询日志：超过阈值（毫秒）的语句写入 slow_query.log 并附 EXPLAIN QUERY PLAN；
+# 对以下大表出现全表 SCAN 的语句按指纹分组计数，显示在 /debug/perf
+SLOW_QUERY_MS = float(os.getenv('CAILU_SLOW_QUERY_MS', '200'))
+SLOW_QUERY_WATCH_TABLES = ('asset_history', 'notifications', 'operation_logs', 'shift_schedules')
+
+# 请求看门狗：请求运行超过阈值（秒）时把所在线程调用栈写入 error.log
+WATCHDOG_THRESHOLD = float(os.getenv('CAILU_WATCHDOG_SECONDS', '30'))
+WATCHDOG_INTERVAL = float(os.getenv('CAILU_WATCHDOG_INTERVAL', '5'))
+
+# waitress 服务参数（压测 flask load-test 据此对比不同线程数）
+WAITRESS_HOST = os.getenv('CAILU_HOST', '127.0.0.1')
+WAITRESS_PORT = int(os.getenv('CAILU_PORT', '8001'))
+WAITRESS_THREADS = int(os.getenv('CAILU_THREADS', '24'))
+WAITRESS_CONNECTION_LIMIT = int(os.getenv('CAILU_CONNECTION_LIMIT', '1024'))
+
+# /metrics 访问令牌（供 Prometheus 抓取；为空时仅已登录的系统管理员可访问）
+METRICS_TOKEN = os.getenv('CAILU_METRICS_TOKEN', '')
+
+# 数据库备份：在线备份（sqlite3 backup API 一次复制完整快照）+ 完整性校验 + gzip 压缩
+BACKUP_DIR = os.getenv('CAILU_BACKUP_DIR', r"D:\cailu\backups")
+# 保留策略：最近 N 天每天一份、最近 N 周每周一份、最近 N 月每月一份（各取该周期内最新的一份）
+BACKUP_RETENTION = {
+    'daily': int(os.getenv('CAILU_BACKUP_KEEP_DAILY', '7')),
+    'weekly': int(os.getenv('CAILU_BACKUP_KEEP_WEEKLY', '4')),
+    'monthly': int(os.getenv('CAILU_BACKUP_KEEP_MONTHLY', '6')),
+}
+
+# 数据保留：每张表保留天数，archive 为真时删除前先转存到 ARCHIVE_DIR 下按月分文件的 SQLite 库
+RETENTION_POLICIES = {
+    'notifications': {'days': int(os.getenv('CAILU_KEEP_NOTIFICATION_DAYS', '30')), 'archive': False},
+    'operation_logs': {'days': int(os.getenv('CAILU_KEEP_OPERATION_LOG_DAYS', '365')), 'archive': True},
+    'chat_messages': {'days': int(os.getenv('CAILU_KEEP_CHAT_DAYS', '180')), 'archive': True},
+    'notification_outbox': {'days': int(os.getenv('CAILU_KEEP_OUTBOX_DEAD_DAYS', '30')), 'archive': False},  # 死信事件
+}
+RETENTION_BATCH = int(os.getenv('CAILU_RETENTION_BATCH', '500'))          # 每个事务删除的行数
+RETENTION_PAUSE = float(os.getenv('CAILU_RETENTION_PAUSE', '0.2'))        # 批次之间让出写锁的秒数
+ARCHIVE_DIR = os.getenv('CAILU_ARCHIVE_DIR', r"D:\cailu\archive")
+
+# 上传文件物理根目录（其下 uploads/ 存放业务附件，recycle_bin/ 存放清理出的文件）
+UPLOAD_BASE_DIR = os.getenv('CAILU_UPLOAD_BASE', r"D:\cailu")
+# 孤立文件清理：新文件的保护期（秒），以及目录清单缓存文件
+UPLOAD_GC_GRACE = int(os.getenv('CAILU_UPLOAD_GC_GRACE', '7200'))
+UPLOAD_GC_INDEX = os.path.join(UPLOAD_BASE_DIR, 'recycle_bin', 'upload_gc_index.json')
 
 # 文件上传相关配置
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
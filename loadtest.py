@@ -0,0 +1,297 @@
+#D:\cailu\cailutebao\loadtest.py
+# 本地压测：子进程启动 waitress（合成数据库副本 + 指定线程数/存储配置），按值班室真实流量并发回放
+import glob
+import http.cookiejar
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date
+import numpy as np
+import pandas as pd
+from config import BASE_DIR
+from synthetic import _id_card, SURNAMES, GIVEN_CHARS
+
+LOCKED_MARKER = 'database is locked'
+
+# ==================== HTTP 客户端（每个虚拟用户一个会话） ====================
+class _Session:
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, form=None, json_body=None, files=None, stream=False):
+        """返回 (状态码, 耗时ms, 响应体或流式响应对象)；网络异常时状态码为 0"""
+        headers, body = {}, None
+        if files:
+            boundary = f'----cailu{random.getrandbits(64):x}'
+            buf = io.BytesIO()
+            for k, v in (form or {}).items():
+                buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+            for k, (filename, content) in files.items():
+                buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"; filename="{filename}"\r\n'
+                          f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+                buf.write(content)
+                buf.write(b'\r\n')
+            buf.write(f'--{boundary}--\r\n'.encode())
+            body, headers['Content-Type'] = buf.getvalue(), f'multipart/form-data; boundary={boundary}'
+        elif json_body is not None:
+            body, headers['Content-Type'] = json.dumps(json_body).encode(), 'application/json'
+        elif form is not None:
+            body, headers['Content-Type'] = urllib.parse.urlencode(form).encode(), 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            resp = self.opener.open(req, timeout=self.timeout)
+            if stream:
+                return resp.status, (time.perf_counter() - started) * 1000, resp
+            data = resp.read()
+            if not path.startswith('/login') and urllib.parse.urlparse(resp.geturl()).path.startswith('/login'):
+                return 401, (time.perf_counter() - started) * 1000, data   # 会话失效被重定向到登录页
+            return resp.status, (time.perf_counter() - started) * 1000, data
+        except urllib.error.HTTPError as e:
+            return e.code, (time.perf_counter() - started) * 1000, e.read()
+        except (urllib.error.URLError, OSError) as e:
+            return 0, (time.perf_counter() - started) * 1000, str(e).encode()
+
+    def login(self, username, password):
+        status, _, _ = self.request('POST', '/login', form={'username': username, 'password': password})
+        return status in (200, 302)
+
+# ==================== 场景 ====================
+class _Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []   # (场景, 标签, 状态码, 耗时ms, 响应中是否含锁错误)
+
+    def add(self, scenario, label, status, elapsed_ms, body=b''):
+        locked = isinstance(body, (bytes, bytearray)) and LOCKED_MARKER.encode() in body
+        with self.lock:
+            self.samples.append((scenario, label, status, elapsed_ms, locked))
+
+def _roster_xlsx(rng, rows):
+    """生成一份新人员花名册（身份证不与库中重复的概率极低）"""
+    used, records = set(), []
+    for _ in range(rows):
+        id_card, _, gender = _id_card(rng, used)
+        records.append({'姓名': rng.choice(SURNAMES) + rng.choice(GIVEN_CHARS), '身份证号码': id_card,
+                        '手机号': f'13{rng.randrange(10 ** 9):09d}', '入职日期': date.today().isoformat(), '性别': gender})
+    buf = io.BytesIO()
+    pd.DataFrame(records).to_excel(buf, index=False)
+    return buf.getvalue()
+
+def _tab_poller(ctx, account, rec, stop):
+    s = _Session(ctx['base_url'])
+    if not s.login(*account):
+        rec.add('tab', 'login', 0, 0.0)
+        return
+    rng = random.Random()
+    time.sleep(rng.uniform(0, ctx['poll_interval']))   # 错开各标签页的轮询相位
+    while not stop.is_set():
+        status, ms, body = s.request('GET', '/notification/has_new_notice')
+        rec.add('tab', 'has_new_notice', status, ms, body)
+        stop.wait(ctx['poll_interval'])
+
+def _tab_stream(ctx, account, rec, stop):
+    """保持 SSE 长连接（每个连接占用一个 waitress 线程），用于观察线程池被占满时的影响"""
+    s = _Session(ctx['base_url'], timeout=5)
+    if not s.login(*account):
+        rec.add('sse', 'login', 0, 0.0)
+        return
+    while not stop.is_set():
+        status, ms, resp = s.request('GET', '/notification/stream', stream=True)
+        rec.add('sse', 'stream_open', status, ms)
+        if status != 200 or not hasattr(resp, 'readline'):
+            stop.wait(5)
+            continue
+        try:
+            while not stop.is_set() and resp.readline():
+                pass
+        except OSError:
+            pass
+        finally:
+            resp.close()
+
+def _team_leader(ctx, rec, stop):
+    s = _Session(ctx['base_url'])
+    s.login(*ctx['admin'])
+    rng = random.Random()
+    month = date.today().strftime('%Y-%m')
+    days = [date.today().replace(day=d).isoformat() for d in range(1, 29)]
+    while not stop.is_set():
+        status, ms, body = s.request('GET', f'/scheduling/api/get_matrix_data?month={month}')
+        rec.add('leader', 'get_matrix_data', status, ms, body)
+        stop.wait(rng.uniform(1, 3))
+        ops = []
+        for _ in range(rng.randrange(5, 30)):
+            op = {'user_id': rng.choice(ctx['employee_ids']), 'date': rng.choice(days)}
+            if rng.random() < 0.8:
+                op.update(op='set_shift', post_id=rng.choice(ctx['post_ids']), shift_type=rng.choice(('白', '夜')))
+            else:
+                op.update(op='delete')
+            ops.append(op)
+        status, ms, body = s.request('POST', '/scheduling/api/batch', json_body={'ops': ops})
+        rec.add('leader', 'batch', status, ms, body)
+        stop.wait(rng.uniform(1, 3))
+
+def _hr_browser(ctx, rec, stop):
+    s = _Session(ctx['base_url'])
+    s.login(*ctx['admin'])
+    rng = random.Random()
+    while not stop.is_set():
+        for label, path in (('hr_list', '/hr/list'),
+                            ('hr_search', '/hr/list?search=' + urllib.parse.quote(rng.choice(SURNAMES))),
+                            ('hr_detail', f"/hr/detail/{rng.choice(ctx['id_cards'])}")):
+            status, ms, body = s.request('GET', path)
+            rec.add('hr', label, status, ms, body)
+            if stop.wait(rng.uniform(1, 2)):
+                break
+
+def _importer(ctx, rec, stop):
+    s = _Session(ctx['base_url'], timeout=300)
+    s.login(*ctx['admin'])
+    rng = random.Random()
+    while not stop.is_set():
+        content = _roster_xlsx(rng, ctx['import_rows'])
+        status, ms, body = s.request('POST', '/hr/import', form={}, files={'file': ('roster.xlsx', content)})
+        rec.add('import', 'hr_import', status, ms, body)
+        stop.wait(5)
+
+# ==================== 服务进程 ====================
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _copy_database(source, target):
+    """用 backup API 复制（源库处于 WAL 模式也能得到一致副本），每轮压测都从同一份数据开始"""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+def _start_server(workdir, db_path, threads, profile, port):
+    env = dict(os.environ,
+               CAILU_DATABASE_PATH=db_path, CAILU_DB_PROFILE=profile, CAILU_THREADS=str(threads),
+               CAILU_HOST='127.0.0.1', CAILU_PORT=str(port), CAILU_LOG_DIR=os.path.join(workdir, 'log'),
+               CAILU_BACKUP_DIR=os.path.join(workdir, 'backups'), CAILU_UPLOAD_BASE=workdir)
+    proc = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'app.py')], cwd=BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'服务进程启动失败，退出码 {proc.returncode}，日志见 {env["CAILU_LOG_DIR"]}')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/healthz', timeout=2) as resp:
+                if resp.status == 200:
+                    return proc
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError('等待服务启动超时')
+
+def _count_locked_errors(log_dir):
+    count = 0
+    for path in glob.glob(os.path.join(log_dir, '*.log*')):
+        if os.path.basename(path).startswith('error'):
+            continue   # error.log 的内容同时写入 app.log，只统计一次
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            count += sum(line.count(LOCKED_MARKER) for line in f)
+    return count
+
+def _load_fixtures(db_path, tabs):
+    conn = sqlite3.connect(db_path)
+    try:
+        members = [r[0] for r in conn.execute("SELECT username FROM users WHERE role = 'member' ORDER BY id LIMIT ?", (max(tabs, 1),))]
+        active = conn.execute("SELECT id, id_card FROM employment_cycles WHERE status = '在职'").fetchall()
+        post_ids = [r[0] for r in conn.execute('SELECT id FROM shift_posts')]
+    finally:
+        conn.close()
+    if not active or not post_ids or not members:
+        raise RuntimeError('数据库缺少在职员工/岗位/普通账号，请先用 flask synth-seed 生成合成数据')
+    # 合成账号的初始密码为身份证后 6 位
+    return {'accounts': [(u, u[-6:]) for u in members], 'employee_ids': [r[0] for r in active],
+            'id_cards': [r[1] for r in active], 'post_ids': post_ids}
+
+def _summarize(samples, duration):
+    def stats(rows):
+        lat = np.array([r[3] for r in rows], dtype=float)
+        errors = sum(1 for r in rows if r[2] == 0 or r[2] >= 400)
+        return {'requests': len(rows), 'rps': round(len(rows) / duration, 2), 'errors': errors,
+                'error_rate': round(errors / len(rows), 4) if rows else 0.0,
+                'locked_responses': sum(1 for r in rows if r[4]),
+                'p50_ms': round(float(np.percentile(lat, 50)), 1) if rows else None,
+                'p95_ms': round(float(np.percentile(lat, 95)), 1) if rows else None,
+                'p99_ms': round(float(np.percentile(lat, 99)), 1) if rows else None,
+                'max_ms': round(float(lat.max()), 1) if rows else None}
+    # SSE 长连接的建立时间不计入吞吐与延迟
+    timed = [r for r in samples if r[0] != 'sse']
+    by_label = {}
+    for r in timed:
+        by_label.setdefault(f'{r[0]}:{r[1]}', []).append(r)
+    return {'overall': stats(timed), 'by_request': {k: stats(v) for k, v in sorted(by_label.items())}}
+
+def run_load_test(source_db, threads=24, profile='wal', duration=60, tabs=40, sse_tabs=0, leaders=3,
+                  hr_users=2, importer=True, poll_interval=5.0, import_rows=200,
+                  admin=('admin', 'admin'), keep_workdir=False):
+    """
+    一轮压测：复制合成库 → 启动 waitress 子进程（threads / profile）→ 并发回放 duration 秒 → 汇总。
+    场景：tabs 个标签页轮询通知、sse_tabs 个 SSE 长连接、leaders 个班长编辑排班矩阵、
+    hr_users 个人事浏览花名册、importer 为真时一个导入任务循环执行。
+    """
+    workdir = tempfile.mkdtemp(prefix='cailu_load_')
+    db_path = os.path.join(workdir, 'database.db')
+    _copy_database(source_db, db_path)
+    fixtures = _load_fixtures(db_path, tabs + sse_tabs)
+    port = _free_port()
+    proc = _start_server(workdir, db_path, threads, profile, port)
+    ctx = dict(fixtures, base_url=f'http://127.0.0.1:{port}', admin=admin,
+               poll_interval=poll_interval, import_rows=import_rows)
+    rec, stop, workers = _Recorder(), threading.Event(), []
+    accounts = ctx['accounts']
+    try:
+        for i in range(tabs):
+            workers.append(threading.Thread(target=_tab_poller, args=(ctx, accounts[i % len(accounts)], rec, stop)))
+        for i in range(sse_tabs):
+            workers.append(threading.Thread(target=_tab_stream, args=(ctx, accounts[(tabs + i) % len(accounts)], rec, stop)))
+        workers += [threading.Thread(target=_team_leader, args=(ctx, rec, stop)) for _ in range(leaders)]
+        workers += [threading.Thread(target=_hr_browser, args=(ctx, rec, stop)) for _ in range(hr_users)]
+        if importer:
+            workers.append(threading.Thread(target=_importer, args=(ctx, rec, stop)))
+        for w in workers:
+            w.daemon = True
+            w.start()
+        time.sleep(duration)
+        stop.set()
+        for w in workers:
+            w.join(timeout=30)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    time.sleep(0.5)   # 等日志监听线程把队列写完
+    report = {'threads': threads, 'profile': profile, 'duration': duration,
+              'clients': {'tabs': tabs, 'sse_tabs': sse_tabs, 'leaders': leaders, 'hr': hr_users, 'importer': importer},
+              **_summarize(rec.samples, duration),
+              'locked_in_logs': _count_locked_errors(os.path.join(workdir, 'log'))}
+    if keep_workdir:
+        report['workdir'] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
@@ -16,6 +16,8 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), default='member', nullable=False)   # 用户角色标识
     created_at = db.Column(db.DateTime, default=datetime.utcnow)   # 用户创建时间
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # 创建者ID，关联到同一表的ID
+    # 旧版批量导入写入的占位值（非哈希，无法登录）；启动时由 hash_legacy_initial_passwords 补算
+    INITIAL_PASSWORD_MARK = 'initial:id_card_last6'
     def set_password(self, password):  # 设置密码
         self.password_hash = generate_password_hash(password)
     def check_password(self, password):   # 验证密码
@@ -161,6 +163,18 @@ class AssetHistory(db.Model):
     action_date = db.Column(db.DateTime, default=datetime.now)  # 操作发生时间
     note = db.Column(db.Text)  # 操作备注
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 记录创建时间
+# ==================== 员工持有资产（由 AssetHistory 物化） ====================
+class AssetHolding(db.Model):
+    __tablename__ = 'asset_holdings'  # 数据库表名
+    cycle_id = db.Column(db.Integer, db.ForeignKey('employment_cycles.id'), primary_key=True)  # 持有人入职周期ID（主键兼外键）
+    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id'), primary_key=True)  # 资产ID（主键兼外键）
+    quantity = db.Column(db.Integer, nullable=False, default=0)  # 当前净持有数量
+    departure_quantity = db.Column(db.Integer, nullable=False, default=0)  # 离职时自动归还的数量
+    last_issue_date = db.Column(db.DateTime)  # 最近发放时间
+    last_operator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # 最近发放操作人ID
+    last_note = db.Column(db.Text)  # 最近发放备注
+    asset = db.relationship('Asset')  # 建立与 Asset 模型的关联关系
+    last_operator = db.relationship('User', foreign_keys=[last_operator_id])  # 建立与 User 模型的关联关系
 # ==================== 资金模块 ====================
 class FundsRecord(db.Model):
     __tablename__ = 'funds_records'  # 数据库表名
@@ -219,6 +233,9 @@ class ShiftSchedule(db.Model):
     hours = db.Column(db.Float, nullable=True, default=None)  # 加班时长
     employee = db.relationship('EmploymentCycle', backref='schedules')  # 建立与 EmploymentCycle 模型的关联关系
     post = db.relationship('ShiftPost', backref='schedules')  # 建立与 ShiftPost 模型的关联关系
+
+# 每名员工每天只允许一条排班记录（旧库由 routes.scheduling.migrate_shift_schedule_unique 去重后补建）
+SHIFT_UNIQUE_INDEX = db.Index('uq_shift_schedules_employee_date', ShiftSchedule.employee_id, ShiftSchedule.date, unique=True)
 # ==================== 通知相关模型 ====================
 class Notification(db.Model):
     __tablename__ = 'notifications'  # 数据库表名
@@ -231,6 +248,15 @@ class Notification(db.Model):
     related_id = db.Column(db.Integer)  # 关联业务ID
     created_at = db.Column(db.DateTime, default=datetime.now)  # 通知创建时间
     user = db.relationship('User', backref=db.backref('notifications', cascade='all, delete-orphan'))  # 建立与 User 模型的关联关系
+
+# 通知列表、未读计数与一键已读都按 (user_id, is_read, created_at) 查询（旧库由 routes.notification.migrate_notification_index 补建）
+NOTIFICATION_USER_INDEX = db.Index('ix_notifications_user_read_created', Notification.user_id, Notification.is_read, Notification.created_at)
+
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counters'  # 数据库表名
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)  # 用户ID（主键兼外键）
+    unread_count = db.Column(db.Integer, nullable=False, default=0)  # 未读通知数（随通知写入/已读同步维护）
+    user = db.relationship('User', backref=db.backref('notification_counter', uselist=False, cascade='all, delete-orphan'))  # 建立与 User 模型的关联关系
 # ==================== 出差管理模型 ====================
 trip_participants = db.Table('trip_participants',
     db.Column('trip_id', db.Integer, db.ForeignKey('business_trips.id'), primary_key=True),
@@ -291,4 +317,20 @@ class ChatMessage(db.Model):
     content = db.Column(db.Text, nullable=False) # 消息内容
     timestamp = db.Column(db.DateTime, default=datetime.now) # 消息发送时间戳
     is_group = db.Column(db.Boolean, default=False) # 是否为群聊消息
-    sender = db.relationship('User', foreign_keys=[sender_id]) # 建立与 User 模型的关联关系（发送人）
\ No newline at end of file
+    sender = db.relationship('User', foreign_keys=[sender_id]) # 建立与 User 模型的关联关系（发送人）
+# ==================== 通知发件箱 ====================
+class NotificationOutbox(db.Model):
+    __tablename__ = 'notification_outbox'  # 数据库表名
+    id = db.Column(db.Integer, primary_key=True)  # 主键ID（投递顺序）
+    kind = db.Column(db.String(20), nullable=False)  # 事件类型：audit(审计通知) / notice(直接通知)
+    payload = db.Column(db.JSON, nullable=False)  # 事件内容，由后台线程展开为每个接收人一条通知
+    created_at = db.Column(db.DateTime, default=datetime.now)  # 入队时间（计算投递延迟）
+    attempts = db.Column(db.Integer, default=0, nullable=False)  # 投递失败次数
+    last_error = db.Column(db.Text)  # 最近一次失败原因
+    dead_at = db.Column(db.DateTime)  # 失败次数达到上限、转入死信的时间（不再投递，由数据保留清理）
+# ==================== 上传文件登记 ====================
+class FileReference(db.Model):
+    __tablename__ = 'file_references'  # 数据库表名
+    path = db.Column(db.String(300), primary_key=True)  # 规范化的相对路径（小写、/ 分隔，如 uploads/leave/2025/01/x.jpg）
+    module = db.Column(db.String(50))  # 上传所属模块
+    created_at = db.Column(db.DateTime, default=datetime.now)  # 登记时间
@@ -1,8 +1,9 @@
 #D:\cailu\cailutebao\routes\asset\core.py
 import os
+import logging
 from datetime import datetime
 from flask import current_app
-from models import db, Asset, AssetInstance
+from models import db, Asset, AssetInstance, AssetHistory, AssetHolding
 
 # 导入工具函数（保持原有导入路径）
 from utils import save_uploaded_file, parse_date
@@ -91,4 +92,75 @@ ASSET_PERMISSIONS = [
     ('inventory', '资产盘点', '进行资产盘点操作'),
     ('import', '批量导入资产', '从Excel导入资产'),
     ('export', '批量导出资产', '导出资产清单'),
-]
\ No newline at end of file
+]
+# ==================== 员工持有资产（物化表维护） ====================
+# 影响持有数量的历史动作：动作 -> (持有数量变化方向, 是否离职归还, 是否算作发放)
+HOLDING_ACTIONS = {
+    '发放': (1, False, True),
+    '更换(发放)': (1, False, True),
+    '归还': (-1, False, False),
+    '更换(回收)': (-1, False, False),
+    '归还（离职自动）': (-1, True, False),
+}
+
+def _apply_holding_rule(holding, action, quantity, operator_id, action_date, note):
+    sign, on_departure, is_issue = HOLDING_ACTIONS[action]
+    quantity = quantity or 0
+    holding.quantity = (holding.quantity or 0) + sign * quantity
+    if on_departure:
+        holding.departure_quantity = (holding.departure_quantity or 0) + quantity
+    if is_issue:
+        holding.last_issue_date = action_date
+        holding.last_operator_id = operator_id
+        holding.last_note = note
+
+def apply_asset_holding(history):
+    """
+    新增 AssetHistory 后调用，在同一事务内更新 asset_holdings。
+    不提交，随调用方事务一起提交。
+    """
+    if history.action not in HOLDING_ACTIONS or not history.user_id:
+        return None
+    cycle_id, asset_id = int(history.user_id), int(history.asset_id)
+    holding = AssetHolding.query.filter_by(cycle_id=cycle_id, asset_id=asset_id).first()
+    if holding is None:
+        holding = AssetHolding(cycle_id=cycle_id, asset_id=asset_id, quantity=0, departure_quantity=0)
+        db.session.add(holding)
+    _apply_holding_rule(holding, history.action, history.quantity if history.quantity is not None else 1,
+                        history.operator_id, history.action_date or datetime.now(), history.note)
+    return holding
+
+def rebuild_asset_holdings():
+    """按时间顺序重放 AssetHistory，重建 asset_holdings 全表"""
+    rows = db.session.query(
+        AssetHistory.user_id, AssetHistory.asset_id, AssetHistory.action, AssetHistory.quantity,
+        AssetHistory.operator_id, AssetHistory.action_date, AssetHistory.note
+    ).filter(
+        AssetHistory.action.in_(list(HOLDING_ACTIONS)),
+        AssetHistory.user_id.isnot(None)
+    ).order_by(AssetHistory.action_date, AssetHistory.id).all()
+
+    holdings = {}
+    for cycle_id, asset_id, action, quantity, operator_id, action_date, note in rows:
+        holding = holdings.get((cycle_id, asset_id))
+        if holding is None:
+            holding = holdings[(cycle_id, asset_id)] = AssetHolding(
+                cycle_id=cycle_id, asset_id=asset_id, quantity=0, departure_quantity=0)
+        _apply_holding_rule(holding, action, quantity if quantity is not None else 1, operator_id, action_date, note)
+
+    AssetHolding.query.delete(synchronize_session=False)
+    if holdings:
+        db.session.execute(AssetHolding.__table__.insert(), [{
+            'cycle_id': h.cycle_id, 'asset_id': h.asset_id, 'quantity': h.quantity,
+            'departure_quantity': h.departure_quantity, 'last_issue_date': h.last_issue_date,
+            'last_operator_id': h.last_operator_id, 'last_note': h.last_note
+        } for h in holdings.values()])
+    db.session.commit()
+    logging.info(f"资产持有表重建完成：{len(rows)} 条历史，{len(holdings)} 条持有记录")
+    return len(holdings)
+
+def ensure_asset_holdings():
+    """启动时调用：持有表为空而历史记录存在（新建表/旧库升级）时自动重建"""
+    if AssetHolding.query.first() is None and \
+            AssetHistory.query.filter(AssetHistory.action.in_(list(HOLDING_ACTIONS))).first() is not None:
+        rebuild_asset_holdings()
@@ -1,9 +1,11 @@
 #D:\cailu\cailutebao\routes\asset\operations.py
+import click
 from datetime import datetime
 from flask import flash, redirect, url_for, request
 from flask_login import login_required, current_user
 from models import db, Asset, AssetAllocation, AssetHistory, AssetInstance, EmploymentCycle, FundsRecord
 from utils import log_action, perm
+from .core import apply_asset_holding, rebuild_asset_holdings
 
 # 导入蓝图
 from . import asset_bp
@@ -51,6 +53,7 @@ def asset_issue(asset_id):
         note=request.form.get('note', '')
     )
     db.session.add(history)
+    apply_asset_holding(history)
     
     # 审计日志
     log_action(
@@ -124,22 +127,26 @@ def asset_exchange(asset_id):
         db.session.add(new_alloc)
 
         # 记录历史
-        db.session.add(AssetHistory(
-            asset_id=asset_id, 
-            action='更换(回收)', 
-            user_id=user_id,
-            operator_id=current_user.id, 
-            quantity=quantity, 
-            note=f"回收报废: {reason}"
-        ))
-        db.session.add(AssetHistory(
-            asset_id=asset_id, 
-            action='更换(发放)', 
-            user_id=user_id,
-            operator_id=current_user.id, 
-            quantity=quantity, 
-            note=f"发放新物: "
-        ))
+        for history in (
+            AssetHistory(
+                asset_id=asset_id, 
+                action='更换(回收)', 
+                user_id=user_id,
+                operator_id=current_user.id, 
+                quantity=quantity, 
+                note=f"回收报废: {reason}"
+            ),
+            AssetHistory(
+                asset_id=asset_id, 
+                action='更换(发放)', 
+                user_id=user_id,
+                operator_id=current_user.id, 
+                quantity=quantity, 
+                note=f"发放新物: "
+            )
+        ):
+            db.session.add(history)
+            apply_asset_holding(history)
 
         # 审计日志
         log_action(
@@ -215,6 +222,7 @@ def asset_return(asset_id):
         action_date=datetime.now(), note=request.form.get('note', '')
     )
     db.session.add(history)
+    apply_asset_holding(history)
     
     # 审计日志
     log_action(
@@ -281,6 +289,7 @@ def asset_issue_from_hr():
                 note=f"入职发放: {note}"
             )
             db.session.add(history)
+            apply_asset_holding(history)
             
             issued_items.append(f"{asset.name} x{qty}")
 
@@ -648,4 +657,10 @@ def asset_complete_repair_sub():
     
     db.session.commit()
     flash(f'子资产 {instance.sn_number} 维修完成，已恢复正常状态', 'success')
-    return redirect(url_for('asset.asset_detail', asset_id=instance.asset_id))
\ No newline at end of file
+    return redirect(url_for('asset.asset_detail', asset_id=instance.asset_id))
+
+@asset_bp.cli.command('rebuild-holdings')
+def rebuild_holdings_command():
+    """重放资产历史，重建员工持有资产表（flask asset rebuild-holdings）"""
+    count = rebuild_asset_holdings()
+    click.echo(f"重建完成，共 {count} 条持有记录")
@@ -1,6 +1,7 @@
 #D:\cailu\cailutebao\routes\asset\views.py
 from flask import render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_required,current_user
+from sqlalchemy.orm import joinedload
 from models import db, Asset, EmploymentCycle
 from utils import log_action, today_str, delete_physical_file,parse_date,save_uploaded_file
 from config import ASSET_STATUS, ASSET_TYPES
@@ -199,9 +200,10 @@ def asset_delete(asset_id):
         photo_path = asset.photo_path
     
         # 强制清理：先删除所有关联的分配记录，再删除资产
-        from models import AssetAllocation, AssetHistory
+        from models import AssetAllocation, AssetHistory, AssetHolding
         AssetAllocation.query.filter_by(asset_id=asset_id).delete()
         AssetHistory.query.filter_by(asset_id=asset_id).delete()
+        AssetHolding.query.filter_by(asset_id=asset_id).delete()
     
         db.session.delete(asset)
         db.session.commit()
@@ -209,6 +211,7 @@ def asset_delete(asset_id):
         # 数据库删除成功后，清理物理文件
         if photo_path:
             delete_physical_file(photo_path)
+            db.session.commit()
 
         flash('资产已删除', 'success')
     except Exception as e:
@@ -226,7 +229,9 @@ def asset_detail(asset_id):
     in_service_employees = EmploymentCycle.query.filter_by(status='在职').order_by(EmploymentCycle.name).all()
     allocations = AssetHistory.query.filter_by(asset_id=asset_id, action='发放').all()
     page = request.args.get('page', 1, type=int)
-    pagination = AssetHistory.query.filter_by(asset_id=asset_id)\
+    # 历史列表显示被操作人、操作人：随分页查询一并加载（离职员工/非在职操作人不在会话中，否则每行各查一次）
+    pagination = AssetHistory.query.options(joinedload(AssetHistory.user), joinedload(AssetHistory.operator))\
+        .filter_by(asset_id=asset_id)\
         .order_by(AssetHistory.action_date.desc())\
         .paginate(page=page, per_page=10, error_out=False)
     history_items = pagination.items
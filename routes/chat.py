@@ -1,5 +1,6 @@
 #D:\cailu\cailutebao\routes\chat.py
 #暂时弃用
+import logging
 from flask import Blueprint, jsonify
 from flask_login import login_required, current_user
 from models import db, User, EmploymentCycle, ChatMessage
@@ -62,7 +63,7 @@ def get_history(target_id):
             'is_group': m.is_group
         } for m in msgs])
     except Exception as e:
-        print(f"获取历史记录失败: {str(e)}")
+        logging.error(f"获取历史记录失败: {str(e)}")
         return jsonify([])
     
 CHAT_PERMISSIONS = [
@@ -1,4 +1,5 @@
 #D:\cailu\cailutebao\routes\dorm.py
+import logging
 from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required, current_user
 from models import db, Room, EmploymentCycle, AssetInstance, Asset, OperationLog
@@ -272,9 +273,9 @@ def get_available_beds(room_id):
     ).all()
 
     # 调试：打印所有匹配的资产（方便定位）
-    print(f"房间{room_id}的床位资产数量：{len(assets)}")
+    logging.debug(f"房间{room_id}的床位资产数量：{len(assets)}")
     for inst in assets:
-        print(f"资产名称：{inst.asset_info.name}，容量：{inst.asset_info.bed_capacity}，房间ID：{inst.room_id}")
+        logging.debug(f"资产名称：{inst.asset_info.name}，容量：{inst.asset_info.bed_capacity}，房间ID：{inst.room_id}")
 
     beds = []
     for inst in assets:
@@ -301,7 +302,7 @@ def get_available_beds(room_id):
             })
 
     # 调试：打印最终返回的床位数据
-    print(f"最终返回的床位数据：{beds}")
+    logging.debug(f"最终返回的床位数据：{beds}")
     return jsonify(beds)
 # ========================================================
 # 4. 房间定位保存路由
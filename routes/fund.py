@@ -9,27 +9,106 @@ from models import db, FundsRecord, Asset, User
 from utils import parse_date, format_date, perm, log_action, today_str, save_uploaded_file
 from datetime import datetime
 from io import BytesIO
+import sqlite3
+import click
 import pandas as pd
+from sqlalchemy import func, text, bindparam
 from werkzeug.utils import secure_filename
 
 fund_bp = Blueprint('fund', __name__, url_prefix='/fund')
 
 # ==================== 核心余额重算函数 ====================
-def recalculate_balances():
+# 余额 = 按 (日期, ID) 排序的金额前缀和
+_BALANCE_UPDATE_SQL = text("""
+    UPDATE funds_records
+    SET balance = :base + r.running
+    FROM (
+        SELECT id, SUM(amount) OVER (
+            ORDER BY date, id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+        ) AS running
+        FROM funds_records
+        WHERE date >= :from_date
+    ) AS r
+    WHERE funds_records.id = r.id
+""").bindparams(bindparam('from_date', type_=db.DateTime))
+
+def recalculate_balances(from_date=None):
     """
-    按日期顺序重新计算所有余额，确保数据一致性。
-    在新增、导入、编辑、删除记录后调用。
+    重算余额，确保数据一致性。在新增、导入、编辑、删除记录后调用。
+    from_date：受影响的最早日期，只重写该日期及之后的记录；为空时全量重算。
     """
-    # 按日期升序、ID升序获取所有记录
-    records = FundsRecord.query.order_by(FundsRecord.date.asc(), FundsRecord.id.asc()).all()
-    
-    running_balance = 0.0
-    for record in records:
-        running_balance += record.amount
-        record.balance = running_balance
-    
     db.session.flush()
-    return running_balance  # 返回最终余额
+    if from_date is None:
+        from_date = db.session.query(func.min(FundsRecord.date)).scalar()
+        if from_date is None:
+            return 0.0
+    elif not isinstance(from_date, datetime):
+        from_date = datetime.combine(from_date, datetime.min.time())
+
+    # 起点之前的累计余额
+    base = db.session.query(func.coalesce(func.sum(FundsRecord.amount), 0.0))\
+        .filter(FundsRecord.date < from_date).scalar()
+
+    if sqlite3.sqlite_version_info >= (3, 33, 0):
+        # 单条 UPDATE ... FROM + 窗口函数，集合式重写
+        db.session.execute(_BALANCE_UPDATE_SQL, {'base': base, 'from_date': from_date})
+    else:
+        # 旧版 SQLite 不支持 UPDATE FROM：只遍历受影响的记录
+        running_balance = base
+        rows = db.session.query(FundsRecord.id, FundsRecord.amount)\
+            .filter(FundsRecord.date >= from_date)\
+            .order_by(FundsRecord.date.asc(), FundsRecord.id.asc()).all()
+        for record_id, amount in rows:
+            running_balance += amount
+            db.session.execute(
+                FundsRecord.__table__.update().where(FundsRecord.id == record_id).values(balance=running_balance)
+            )
+
+    # 原生 UPDATE 不会同步会话中的对象，让其下次访问时重新加载
+    for obj in db.session.identity_map.values():
+        if isinstance(obj, FundsRecord):
+            db.session.expire(obj, ['balance'])
+
+    return db.session.query(func.coalesce(func.sum(FundsRecord.amount), 0.0)).scalar()  # 返回最终余额
+
+def verify_balances(repair=False, tolerance=0.005):
+    """
+    校验已存余额与重新计算的前缀和是否一致。
+    repair=True 时从第一条不一致的记录起重算并提交。
+    """
+    rows = db.session.query(FundsRecord.id, FundsRecord.date, FundsRecord.amount, FundsRecord.balance)\
+        .order_by(FundsRecord.date.asc(), FundsRecord.id.asc()).all()
+    running_balance = 0.0
+    mismatches = []
+    for record_id, record_date, amount, balance in rows:
+        running_balance += amount
+        if balance is None or abs(balance - running_balance) > tolerance:
+            mismatches.append((record_id, record_date, balance, running_balance))
+
+    result = {
+        'total': len(rows),
+        'mismatched': len(mismatches),
+        'first_mismatch': mismatches[0] if mismatches else None,
+        'final_balance': running_balance,
+        'repaired': False
+    }
+    if repair and mismatches:
+        recalculate_balances(from_date=mismatches[0][1])
+        db.session.commit()
+        result['repaired'] = True
+    return result
+
+@fund_bp.cli.command('verify-balances')
+@click.option('--repair', is_flag=True, help='从第一条不一致的记录开始重算余额')
+def verify_balances_command(repair):
+    """校验资金流水余额（flask fund verify-balances [--repair]）"""
+    result = verify_balances(repair=repair)
+    click.echo(f"共 {result['total']} 条记录，余额不一致 {result['mismatched']} 条，正确余额 {result['final_balance']:.2f}")
+    if result['first_mismatch']:
+        record_id, record_date, stored, expected = result['first_mismatch']
+        click.echo(f"首条不一致：ID={record_id} 日期={record_date} 存储余额={stored} 应为={expected:.2f}")
+    if result['repaired']:
+        click.echo("已完成修复")
 
 # ==================== 资金收支列表 ====================
 @fund_bp.route('/list')
@@ -146,8 +225,8 @@ def perform_fund_save(form_data, operator_id, files=None):
     db.session.add(record)
     db.session.flush()
     
-    # 6. 重新计算所有余额（确保一致性）
-    recalculate_balances()
+    # 6. 重算该日期及之后的余额
+    recalculate_balances(from_date=record.date)
     
     return record
 
@@ -201,6 +280,7 @@ def fund_edit(record_id):
     
     if request.method == 'POST':
         try:
+            old_date = record.date
             # 更新字段
             record.date = datetime.combine(parse_date(request.form.get('date')), datetime.now().time())
             record.payer = request.form.get('payer')
@@ -220,8 +300,8 @@ def fund_edit(record_id):
                             else:
                                 record.attachment = [path]
             
-            # 重新计算所有余额
-            recalculate_balances()
+            # 从新旧日期中较早者开始重算余额
+            recalculate_balances(from_date=min(old_date, record.date))
             
             log_action(
                 action_type="财务编辑",
@@ -255,10 +335,11 @@ def fund_delete(record_id):
             description=f"删除记录 {record.item} 金额 {record.amount}"
         )
         
+        deleted_date = record.date
         db.session.delete(record)
         
-        # 删除后重新计算所有余额
-        recalculate_balances()
+        # 删除后重算该日期之后的余额
+        recalculate_balances(from_date=deleted_date)
         
         db.session.commit()
         flash('财务记录已删除', 'success')
@@ -292,6 +373,7 @@ def fund_import():
                 return redirect(request.url)
             
             imported_count = 0
+            earliest_date = None
             for idx, row in df.iterrows():
                 # 处理操作人
                 op_name = str(row.get('操作人', '')).strip()
@@ -316,9 +398,11 @@ def fund_import():
                 )
                 db.session.add(record)
                 imported_count += 1
+                if earliest_date is None or record.date < earliest_date:
+                    earliest_date = record.date
             
-            # 导入完成后，统一重算所有余额
-            final_balance = recalculate_balances()
+            # 导入完成后，从最早导入日期起统一重算余额
+            final_balance = recalculate_balances(from_date=earliest_date) if earliest_date else recalculate_balances()
             
             db.session.commit()
             flash(f'成功导入 {imported_count} 条记录，当前余额：{final_balance:.2f} 元', 'success')
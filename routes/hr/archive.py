@@ -1,6 +1,7 @@
 #D:\cailu\cailutebao\routes\hr\archive.py
 import json
 import os
+import logging
 from datetime import datetime, timedelta
 from flask import request, redirect, url_for, flash
 from flask_login import login_required, current_user
@@ -109,7 +110,7 @@ def is_within_hour(date_str):
                 continue
         
         if not record_time:
-            print(f"DEBUG: 无法解析日期字符串 -> {date_str}")
+            logging.warning(f"无法解析日期字符串 -> {date_str}")
             return False
         
         # 计算时间差
@@ -117,7 +118,7 @@ def is_within_hour(date_str):
         return diff < timedelta(hours=1)
         
     except Exception as e:
-        print(f"DEBUG: 时间判断逻辑出错 -> {e}")
+        logging.error(f"时间判断逻辑出错 -> {e}")
         return False
 
 # ==================== 编辑档案记录（适配多文件） ====================
@@ -9,7 +9,7 @@ from models import EmploymentCycle, User, db
 from utils import (
     validate_id_card, validate_phone, get_gender_from_id_card, get_birthday_from_id_card,
     save_uploaded_file, get_ethnic_options, get_politics_options, get_education_options,
-    parse_date, format_date, today_str, perm, log_action
+    parse_date, format_date, today_str, perm, log_action, notice_hub
 )
 from config import SALARY_MODES, POSITIONS, POSTS
 
@@ -481,6 +481,7 @@ def edit_cycle(cycle_id):
                     cycle.pending_changes = json.dumps(pending_data, ensure_ascii=False)
                     cycle.pending_status = 'pending'
                     cycle.pending_updated_at = datetime.now()
+                    notice_hub.publish_on_commit()
                     
                     db.session.commit()
                     flash('信息变更已提交，等待管理员审批', 'info')
@@ -574,6 +575,7 @@ def approve_change(cycle_id):
         cycle.pending_status = 'approved'
         cycle.pending_approved_by = current_user.id
         cycle.pending_approved_at = datetime.now()
+        notice_hub.publish_on_commit()
         
         # 记录审计日志
         submitter_name = pending_data.get('submitter_name', '未知')
@@ -632,6 +634,7 @@ def reject_change(cycle_id):
         cycle.pending_status = 'rejected'
         cycle.pending_approved_by = current_user.id
         cycle.pending_approved_at = datetime.now()
+        notice_hub.publish_on_commit()
         
         # 记录审计日志
         pending_data = json.loads(cycle.pending_changes)
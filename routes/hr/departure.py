@@ -9,6 +9,7 @@ from models import (
     AssetInstance, ShiftSchedule,db
 )
 from utils import parse_date, log_action,perm
+from routes.asset.core import apply_asset_holding
 
 # ==================== 办理离职 ====================
 @hr_bp.route('/departure/<int:cycle_id>', methods=['POST'])
@@ -68,6 +69,7 @@ def departure(cycle_id):
             note=f'{cycle.name}离职自动归还'
         )
         db.session.add(history)
+        apply_asset_holding(history)
     
     # 2. 床位占用释放
     room_id = cycle.room_id
@@ -7,7 +7,7 @@ from flask_login import login_required, current_user
 
 from . import hr_bp
 from models import EmployeeDocument, EmploymentCycle, db
-from utils import save_uploaded_file, perm, log_action, format_date, parse_date
+from utils import save_uploaded_file, perm, log_action, format_date, parse_date, notice_hub
 
 DOC_TYPES = ['身份证', '保安员证', '消防证', '驾驶证', '上岗证', '健康证', '其他']
 
@@ -136,7 +136,7 @@ def document_add(cycle_id):
             document.pending_status = 'none'
             db.session.add(document)
             try:
-                db.session.commit()
+                db.session.flush()   # 生成 document.id 供审计记录使用
                 log_action(
                     action_type='添加证件',
                     target_type='EmployeeDocument',
@@ -144,6 +144,7 @@ def document_add(cycle_id):
                     cycle_id=cycle.id,
                     description=f"为队员【{cycle.name}】添加了{doc_type}"
                 )
+                db.session.commit()
                 flash(f'{doc_type}添加成功', 'success')
             except Exception as e:
                 db.session.rollback()
@@ -156,8 +157,9 @@ def document_add(cycle_id):
             # 普通队员：新增的证件标记为待审批
             document.pending_status = 'pending'
             db.session.add(document)
+            notice_hub.publish_on_commit()
             try:
-                db.session.commit()
+                db.session.flush()
                 log_action(
                     action_type='申请添加证件',
                     target_type='EmployeeDocument',
@@ -165,6 +167,7 @@ def document_add(cycle_id):
                     cycle_id=cycle.id,
                     description=f"队员【{cycle.name}】申请添加{doc_type}，等待审批"
                 )
+                db.session.commit()
                 flash(f'{doc_type}已提交，等待管理员审批', 'info')
             except Exception as e:
                 db.session.rollback()
@@ -225,7 +228,6 @@ def document_edit(doc_id):
                         break
 
             try:
-                db.session.commit()
                 log_action(
                     action_type='编辑证件',
                     target_type='EmployeeDocument',
@@ -233,6 +235,7 @@ def document_edit(doc_id):
                     cycle_id=cycle.id,
                     description=f"修改了队员【{cycle.name}】的{document.doc_type}"
                 )
+                db.session.commit()
                 flash('证件信息已更新', 'success')
             except Exception as e:
                 db.session.rollback()
@@ -295,9 +298,9 @@ def document_edit(doc_id):
             }
             document.pending_changes = json.dumps(pending_data, ensure_ascii=False)
             document.pending_status = 'pending'
+            notice_hub.publish_on_commit()
 
             try:
-                db.session.commit()
                 log_action(
                     action_type='申请修改证件',
                     target_type='EmployeeDocument',
@@ -305,6 +308,7 @@ def document_edit(doc_id):
                     cycle_id=cycle.id,
                     description=f"队员【{cycle.name}】申请修改{document.doc_type}，等待审批"
                 )
+                db.session.commit()
                 flash('证件变更已提交，等待管理员审批', 'info')
             except Exception as e:
                 db.session.rollback()
@@ -405,8 +409,8 @@ def document_approve(doc_id):
             except:
                 pass
         document.pending_changes = None
+        notice_hub.publish_on_commit()
 
-        db.session.commit()
         log_action(
             action_type='审批证件',
             target_type='EmployeeDocument',
@@ -414,6 +418,7 @@ def document_approve(doc_id):
             cycle_id=cycle.id,
             description=f"批准了队员【{cycle.name}】的{document.doc_type}变更"
         )
+        db.session.commit()
         flash(f'已批准 {cycle.name} 的{document.doc_type}', 'success')
     except Exception as e:
         db.session.rollback()
@@ -460,8 +465,8 @@ def document_reject(doc_id):
 
         document.pending_approved_by = current_user.id
         document.pending_approved_at = datetime.now()
+        notice_hub.publish_on_commit()
 
-        db.session.commit()
         log_action(
             action_type='拒绝证件',
             target_type='EmployeeDocument',
@@ -469,6 +474,7 @@ def document_reject(doc_id):
             cycle_id=cycle.id,
             description=f"拒绝了队员【{cycle.name}】的证件变更"
         )
+        db.session.commit()
         flash(f'已拒绝 {cycle.name} 的证件变更', 'success')
     except Exception as e:
         db.session.rollback()
@@ -495,8 +501,6 @@ def document_delete(doc_id):
             os.remove(document.back_image)
 
         db.session.delete(document)
-        db.session.commit()
-
         log_action(
             action_type='删除证件',
             target_type='EmployeeDocument',
@@ -504,6 +508,7 @@ def document_delete(doc_id):
             cycle_id=cycle.id,
             description=f"删除了队员【{cycle.name}】的{doc_type}"
         )
+        db.session.commit()
         flash('证件已删除', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1,16 +1,20 @@
 #D:\cailu\cailutebao\routes\hr\import_export.py
 import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO
+import numpy as np
 import pandas as pd
 from flask import request, redirect, url_for, flash, send_file,render_template
 from flask_login import login_required
+from werkzeug.security import generate_password_hash
 
 from . import hr_bp
 from models import EmploymentCycle, User, db
 from utils import (
-    validate_id_card, get_gender_from_id_card, get_birthday_from_id_card,
-    parse_date, format_date, perm
+    validate_id_cards, parse_dates, format_date, perm
 )
 
 # ==================== 导出员工花名册 ====================
@@ -151,6 +155,154 @@ def hr_export():
     )
 
 # ==================== 导入员工花名册 ====================
+# 文本字段：模型字段 -> 候选列名（按顺序取第一个存在的列）
+ROSTER_TEXT_FIELDS = {
+    'ethnic': ['民族'], 'politics': ['政治面貌'], 'education': ['学历'],
+    'household_province': ['户籍省份', '户籍省'], 'household_city': ['户籍城市', '户籍市'],
+    'household_district': ['户籍区县', '户籍区'], 'household_town': ['户籍乡镇', '户籍镇'],
+    'household_detail': ['户籍详细地址'],
+    'residence_province': ['居住省份', '居住省'], 'residence_city': ['居住城市', '居住市'],
+    'residence_district': ['居住区县', '居住区'], 'residence_town': ['居住乡镇', '居住镇'],
+    'residence_detail': ['居住详细地址'],
+    'unit_number': ['部队番号'], 'branch': ['兵种'], 'license_type': ['准驾车型'],
+    'security_license_number': ['保安员证'], 'salary_mode': ['薪资模式'],
+    'position': ['职务'], 'post': ['岗位'],
+    'emergency_name': ['紧急联系人姓名'], 'emergency_relation': ['紧急联系人关系'],
+    'emergency_phone': ['紧急联系人电话'],
+    'hat_size': ['帽码'], 'short_sleeve': ['短袖尺码'], 'long_sleeve': ['长袖尺码'],
+    'winter_uniform': ['冬装尺码'], 'shoe_size': ['鞋码'],
+}
+ROSTER_DATE_FIELDS = {
+    'enlistment_date': '入伍日期', 'discharge_date': '退伍日期', 'license_date': '驾驶证初领日期',
+    'license_expiry': '驾驶证有效期', 'security_license_date': '保安员证发证日期',
+}
+ROSTER_BOOL_FIELDS = {
+    'military_service': '兵役情况', 'has_license': '是否持有驾驶证', 'has_security_license': '是否持有保安员证',
+}
+DEFAULT_AVATAR = 'uploads/default-avatar.png'
+PRELOAD_CHUNK = 500  # IN 查询分批，避免超出 SQLite 参数上限
+HASH_WORKERS = min(8, os.cpu_count() or 1)  # scrypt 计算时释放 GIL，多核下并行补算初始密码哈希
+
+def _text_col(df, names):
+    """取第一个存在的列并清洗为去空格字符串，空值/nan 统一为空串"""
+    for name in names:
+        if name in df.columns:
+            col = df[name].astype(object).where(df[name].notna(), '')
+            col = col.astype(str).str.strip()
+            return col.mask(col.str.lower().isin(['nan', 'none', 'null']), '')
+    return pd.Series('', index=df.index)
+
+def _chunks(items, size=PRELOAD_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _prepare_roster(df):
+    """
+    整列校验与转换。返回 (待写入的入职记录 DataFrame, 行级错误列表)。
+    错误项：{'row': Excel 行号, 'name': 姓名, 'error': 原因}
+    """
+    id_card = _text_col(df, ['身份证号码']).str.upper()
+    name = _text_col(df, ['姓名'])
+    status = _text_col(df, ['状态'])
+    status = status.where(status.isin(['在职', '离职']), '在职')
+    hire_date = parse_dates(df['入职日期']) if '入职日期' in df.columns else pd.Series(None, index=df.index, dtype=object)
+
+    # 已存在的 (身份证, 入职日期) 周期：按文件中出现的身份证一次性预加载
+    existing = set()
+    for chunk in _chunks(id_card.unique()):
+        existing.update(db.session.query(EmploymentCycle.id_card, EmploymentCycle.hire_date)
+                        .filter(EmploymentCycle.id_card.in_(chunk)).all())
+    existing = {tuple(k) for k in existing}
+    keys = pd.Series(list(zip(id_card, hire_date)), index=df.index)
+    duplicated = keys.map(existing.__contains__).astype(bool) | keys.duplicated()
+
+    # 与逐行导入一致的判定顺序：入职日期 -> 周期重复 -> 身份证
+    bad_hire = hire_date.isna().to_numpy()
+    bad_id = ~validate_id_cards(id_card)
+    raw_hire = df['入职日期'] if '入职日期' in df.columns else pd.Series(None, index=df.index)
+    errors = []
+    error_mask = bad_hire | duplicated.to_numpy() | bad_id
+    for idx in df.index[error_mask]:
+        if hire_date[idx] is None:
+            reason = f"入职日期无效 (原始值: {raw_hire[idx]})"
+        elif duplicated[idx]:
+            reason = "该周期已存在"
+        else:
+            reason = "身份证无效"
+        errors.append({'row': int(idx) + 2, 'name': name[idx], 'error': reason})
+
+    ok = ~error_mask
+    out = pd.DataFrame({
+        'id_card': id_card[ok], 'name': name[ok], 'phone': _text_col(df, ['手机号'])[ok],
+        'hire_date': hire_date[ok], 'status': status[ok],
+    })
+    # 从身份证提取性别、生日
+    out['gender'] = np.where(out['id_card'].str[16].astype(int) % 2 == 1, '男', '女')
+    birthday = pd.to_datetime(out['id_card'].str[6:14], format='%Y%m%d', errors='coerce')
+    out['birthday'] = birthday.dt.date.astype(object).where(birthday.notna(), None)
+    departure = parse_dates(df.loc[ok, '离职日期']) if '离职日期' in df.columns else None
+    out['departure_date'] = departure.where(out['status'] == '离职', None) if departure is not None else None
+
+    for field, names in ROSTER_TEXT_FIELDS.items():
+        out[field] = _text_col(df, names)[ok]
+    for field, col in ROSTER_DATE_FIELDS.items():
+        out[field] = parse_dates(df.loc[ok, col]) if col in df.columns else None
+    for field, col in ROSTER_BOOL_FIELDS.items():
+        out[field] = _text_col(df, [col])[ok].str.lower() == '是'
+    photo = _text_col(df, ['头像路径'])[ok]
+    out['photo_path'] = photo.where(photo != '', DEFAULT_AVATAR)
+
+    # 档案信息
+    other_cert = _text_col(df, ['其他证书'])[ok] != ''
+    archive_rec = _text_col(df, ['档案记录'])[ok] != ''
+    reason = _text_col(df, ['离职原因'])[ok]
+    archives = []
+    for has_cert, has_rec, dep_reason in zip(other_cert, archive_rec, reason):
+        item = {}
+        if has_cert:
+            item['other_certificates'] = []
+        if has_rec:
+            item['archive_records'] = []
+        if dep_reason:
+            item['departure_reason'] = dep_reason
+        archives.append(json.dumps(item, ensure_ascii=False) if item else '')
+    out['archives'] = archives
+    return out, errors
+
+def _roster_accounts(cycles):
+    """
+    在职人员自动建账号（用户名为身份证，初始密码为身份证后6位），跳过已有账号。
+    密码哈希每个约百毫秒：在导入任务内整批并行计算，不在逐行循环里算。
+    """
+    candidates = cycles[cycles['status'] == '在职'].drop_duplicates('id_card')
+    existing = set()
+    for chunk in _chunks(candidates['id_card']):
+        existing.update(u for (u,) in db.session.query(User.username).filter(User.username.in_(chunk)))
+    candidates = candidates[~candidates['id_card'].isin(existing)]
+    now = datetime.utcnow()
+    hashes = _initial_password_hashes(candidates['id_card'])
+    return [{'username': uid, 'name': uname, 'role': 'member', 'password_hash': pw_hash, 'created_at': now}
+            for uid, uname, pw_hash in zip(candidates['id_card'], candidates['name'], hashes)]
+
+def _initial_password_hashes(usernames):
+    """初始密码（身份证后6位）的哈希，按输入顺序返回"""
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        return list(pool.map(lambda username: generate_password_hash(username[-6:]), usernames))
+
+def hash_legacy_initial_passwords():
+    """启动时调用：旧版导入写入 INITIAL_PASSWORD_MARK 后未补算哈希的账号，补算为初始密码（身份证后6位）的哈希"""
+    usernames = [u for (u,) in db.session.query(User.username).filter(User.password_hash == User.INITIAL_PASSWORD_MARK)]
+    if not usernames:
+        return 0
+    for chunk in _chunks(usernames):
+        hashes = dict(zip(chunk, _initial_password_hashes(chunk)))
+        for user in User.query.filter(User.username.in_(chunk), User.password_hash == User.INITIAL_PASSWORD_MARK):
+            user.password_hash = hashes[user.username]
+        db.session.commit()
+    logging.warning(f"已为 {len(usernames)} 个旧导入账号补算初始密码哈希")
+    return len(usernames)
+
 @hr_bp.route('/import', methods=['GET', 'POST'])
 @login_required
 @perm.require('hr.import')
@@ -167,9 +319,10 @@ def hr_import():
             return redirect(request.url)
         
         if file and file.filename.endswith('.xlsx'):
+            dry_run = bool(request.form.get('dry_run'))
             try:
-                # 读取Excel文件
-                df = pd.read_excel(file, dtype={'手机号': str})
+                # 读取Excel文件（身份证、手机号按文本读取，避免丢失末位X和前导0）
+                df = pd.read_excel(file, dtype={'手机号': str, '身份证号码': str})
                 
                 # 必填列校验
                 required = ['姓名', '身份证号码', '手机号']
@@ -178,146 +331,35 @@ def hr_import():
                     flash(f'缺少必填列：{", ".join(missing)}', 'danger')
                     return redirect(request.url)
                 
-                success = 0
-                errors = []
-                
-                # 逐行处理
-                for idx, row in df.iterrows():
-                    try:
-                        id_card = str(row['身份证号码']).strip()
-                        name = str(row['姓名']).strip()
-                        phone = str(row['手机号']).strip()
-                        
-                        # 处理状态
-                        status = str(row.get('状态', '在职')).strip()
-                        if status not in ['在职', '离职']:
-                            status = '在职'
-                        
-                        # 处理入职日期
-                        hire_date_raw = row.get('入职日期')
-                        hire_date = parse_date(hire_date_raw)
-                        if not hire_date:
-                            errors.append(f"行{idx+2}: {name} 入职日期无效 (原始值: {hire_date_raw})")
-                            continue
-                        
-                        # 重复周期校验
-                        if EmploymentCycle.query.filter_by(id_card=id_card, hire_date=hire_date).first():
-                            errors.append(f"行{idx+2}: {name} 该周期已存在")
-                            continue
-                        
-                        # 身份证校验
-                        if not validate_id_card(id_card):
-                            errors.append(f"行{idx+2}: {name} 身份证无效")
-                            continue
-                        
-                        # 处理头像路径
-                        raw_photo = row.get('头像路径')
-                        if pd.isna(raw_photo) or raw_photo is None:
-                            photo_path = 'uploads/default-avatar.png'
-                        else:
-                            p_str = str(raw_photo).strip()
-                            if p_str == "" or p_str.lower() in ['nan', 'none', 'null']:
-                                photo_path = 'uploads/default-avatar.png'
-                            else:
-                                photo_path = p_str
+                cycles, errors = _prepare_roster(df)
+                accounts = _roster_accounts(cycles) if not dry_run else []
 
-                        # 从身份证提取信息
-                        gender = get_gender_from_id_card(id_card)
-                        birthday = get_birthday_from_id_card(id_card)
-                        
-                        # 处理离职日期
-                        departure_date = parse_date(row.get('离职日期')) if status == '离职' else None
-                        
-                        # 创建入职记录
-                        cycle = EmploymentCycle(
-                            id_card=id_card,
-                            name=name,
-                            phone=phone,
-                            gender=gender,
-                            birthday=birthday,
-                            hire_date=hire_date,
-                            departure_date=departure_date,
-                            status=status,
-                            ethnic=str(row.get('民族', '')),
-                            politics=str(row.get('政治面貌', '')),
-                            education=str(row.get('学历', '')),
-                            household_province=str(row.get('户籍省份', row.get('户籍省', ''))),
-                            household_city=str(row.get('户籍城市', row.get('户籍市', ''))),
-                            household_district=str(row.get('户籍区县', row.get('户籍区', ''))),
-                            household_town=str(row.get('户籍乡镇', row.get('户籍镇', ''))),
-                            household_detail=str(row.get('户籍详细地址', '')),
-                            residence_province=str(row.get('居住省份', row.get('居住省', ''))),
-                            residence_city=str(row.get('居住城市', row.get('居住市', ''))),
-                            residence_district=str(row.get('居住区县', row.get('居住区', ''))),
-                            residence_town=str(row.get('居住乡镇', row.get('居住镇', ''))),
-                            residence_detail=str(row.get('居住详细地址', '')),
-                            military_service=str(row.get('兵役情况', '')).strip().lower() == '是',
-                            enlistment_date=parse_date(row.get('入伍日期')),
-                            unit_number=str(row.get('部队番号', '')),
-                            branch=str(row.get('兵种', '')),
-                            discharge_date=parse_date(row.get('退伍日期')),
-                            has_license=str(row.get('是否持有驾驶证', '')).strip().lower() == '是',
-                            license_date=parse_date(row.get('驾驶证初领日期')),
-                            license_type=str(row.get('准驾车型', '')),
-                            license_expiry=parse_date(row.get('驾驶证有效期')),
-                            has_security_license=str(row.get('是否持有保安员证', '')).strip().lower() == '是',
-                            security_license_number=str(row.get('保安员证', '')),
-                            security_license_date=parse_date(row.get('保安员证发证日期')),
-                            salary_mode=str(row.get('薪资模式', '')),
-                            position=str(row.get('职务', '')),
-                            post=str(row.get('岗位', '')),
-                            emergency_name=str(row.get('紧急联系人姓名', '')),
-                            emergency_relation=str(row.get('紧急联系人关系', '')),
-                            emergency_phone=str(row.get('紧急联系人电话', '')),
-                            hat_size=str(row.get('帽码', '')),
-                            short_sleeve=str(row.get('短袖尺码', '')),
-                            long_sleeve=str(row.get('长袖尺码', '')),
-                            winter_uniform=str(row.get('冬装尺码', '')),
-                            shoe_size=str(row.get('鞋码', '')),
-                            photo_path=photo_path,
-                        )
-                        
-                        # 处理档案信息
-                        archives = {}
-                        if row.get('其他证书'):
-                            archives['other_certificates'] = []
-                        if row.get('档案记录'):
-                            archives['archive_records'] = []
-                        if row.get('离职原因'):
-                            archives['departure_reason'] = str(row['离职原因'])
-                        cycle.archives = json.dumps(archives, ensure_ascii=False) if archives else ''
-                        
-                        db.session.add(cycle)
-                        
-                        # 自动创建账号（仅在职）
-                        if status == '在职' and not User.query.filter_by(username=id_card).first():
-                            default_password = id_card[-6:]
-                            new_user = User(
-                                username=id_card,
-                                name=name,
-                                role='member'
-                            )
-                            new_user.set_password(default_password)
-                            db.session.add(new_user)
-                        
-                        success += 1
-                    except Exception as e:
-                        errors.append(f"行{idx+2}: {str(e)}")
-                
-                # 提交批量导入
+                if dry_run:
+                    # 预检：只校验不写库，返回行级错误报告
+                    return render_template('hr/import.html', report={
+                        'total': len(df), 'valid': len(cycles), 'errors': errors
+                    })
+
+                # 批量写入入职记录与账号
+                if not cycles.empty:
+                    records = cycles.astype(object).where(cycles.notna(), None).to_dict('records')
+                    db.session.execute(EmploymentCycle.__table__.insert(), records)
+                if accounts:
+                    db.session.execute(User.__table__.insert(), accounts)
                 db.session.commit()
                 
                 # 返回结果
-                msg = f'导入完成：成功 {success} 条'
+                msg = f'导入完成：成功 {len(cycles)} 条，新建账号 {len(accounts)} 个'
                 if errors:
                     msg += f'，失败 {len(errors)} 条'
                     flash(msg, 'warning')
-                    flash('<br>'.join(errors[:30]), 'danger')
+                    flash('<br>'.join(f"行{e['row']}: {e['name']} {e['error']}" for e in errors[:30]), 'danger')
                 else:
                     flash(msg, 'success')
                 
                 return redirect(url_for('hr.hr_list'))
             except Exception as e:
+                db.session.rollback()
                 flash(f'文件读取失败：{str(e)}', 'danger')
     
     # GET请求返回导入页面
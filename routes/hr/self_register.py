@@ -5,11 +5,11 @@ from flask import render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 
 from . import hr_bp
-from models import EmploymentCycle, User, db
+from models import EmploymentCycle, User, AssetHolding, db
 from utils import (
     validate_id_card, get_gender_from_id_card, get_birthday_from_id_card,
     save_uploaded_file, get_ethnic_options, get_politics_options, get_education_options,
-    parse_date, today_str, perm, log_action
+    parse_date, today_str, perm, log_action, notice_hub
 )
 from config import SALARY_MODES, POSITIONS, POSTS
 
@@ -114,6 +114,7 @@ def self_register():
 
         try:
             db.session.add(new_emp)
+            notice_hub.publish_on_commit()
             db.session.commit()
             return render_template('hr/register_success.html')
         except Exception as e:
@@ -173,6 +174,8 @@ def approve_pending(id):
     else:
         user_created_msg = '（账号已存在，无需重复创建）'
 
+    notice_hub.publish_on_commit()
+
     # 记录审计日志
     log_action(
         action_type='审批入职',
@@ -217,7 +220,9 @@ def delete_pending(id):
             db.session.delete(user_account)
             user_deleted_msg = "及关联登录账号"
         
+        AssetHolding.query.filter_by(cycle_id=emp.id).delete()
         db.session.delete(emp)
+        notice_hub.publish_on_commit()
         db.session.commit()
         flash(f"已成功彻底删除记录：{old_name}{user_deleted_msg}", "success")
     except Exception as e:
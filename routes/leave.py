@@ -15,7 +15,9 @@ def notify_expiring_leaves():
         expiring = LeaveRecord.query.filter_by(end_date=today, status='请假中').all()
         
         if expiring:
+            from utils import add_unread_counts
             admins = User.query.filter_by(role='admin').all()
+            receiver_ids = []
             for leave in expiring:
                 msg = f"【到期提醒】{leave.user.name} 的 {leave.leave_type} 预计今日到期，请核实是否销假。"
                 for admin in admins:
@@ -27,6 +29,8 @@ def notify_expiring_leaves():
                         related_id=leave.id
                     )
                     db.session.add(n)
+                    receiver_ids.append(admin.id)
+            add_unread_counts(receiver_ids)
             db.session.commit()
 
 def calculate_continuous_leave_count(user_id):
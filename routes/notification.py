@@ -1,9 +1,12 @@
 #D:\cailu\cailutebao\routes\notification.py
-from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask import Blueprint, render_template, redirect, url_for, request, flash, Response, stream_with_context
 from flask_login import login_required, current_user
 from models import Notification, User, db
-from utils import perm
+from utils import perm, enqueue_notifications, decrease_unread_count, reset_unread_count, get_unread_notice_count, notice_hub
 from datetime import datetime
+import json
+import logging
+import time
 
 notification_bp = Blueprint('notification', __name__, url_prefix='/notification')
 
@@ -13,58 +16,55 @@ POSITIONS = ["队长", "副队长", "领班", "队员"]
 
 def send_operation_notice(title, content, operated_user_id):
     """
-    发送操作通知：
+    发送操作通知（队长、副队长、领班 + 当事人）：只写一条发件箱事件，随调用方事务提交后由后台线程投递
     :param title: 通知标题
     :param content: 通知内容
     :param operated_user_id: 被操作人的用户ID（当事人）
     """
-    # 步骤1：筛选接收人 - 队长、副队长、领班
-    managers = User.query.filter(
-        User.position.in_(["队长", "副队长", "领班"])
-    ).all()
-    # 步骤2：获取被操作人（当事人）
-    operated_user = User.query.get(operated_user_id)
-    
-    # 步骤3：合并接收人（去重，避免重复通知）
-    receiver_ids = set()
-    # 添加管理人员ID
-    for manager in managers:
-        receiver_ids.add(manager.id)
-    # 添加被操作人ID（确保存在）
-    if operated_user:
-        receiver_ids.add(operated_user.id)
-    
-    # 步骤4：为每个接收人生成通知
-    for receiver_id in receiver_ids:
-        new_notice = Notification(
-            user_id=receiver_id,  # 接收人ID
-            title=title,
-            content=content,
-            is_read=False,  # 默认为未读
-            created_at=datetime.now()  # 自动生成当前时间
-        )
-        db.session.add(new_notice)
-    db.session.commit()
+    enqueue_notifications([('notice', {
+        'title': title,
+        'content': content,
+        'user_ids': [operated_user_id],
+        'managers': True,
+    })])
+
+# ==================== 通知表索引迁移 ====================
+def migrate_notification_index():
+    """旧库补建 (user_id, is_read, created_at) 索引（create_all 不会给已存在的表加索引）。幂等"""
+    from models import NOTIFICATION_USER_INDEX
+    inspector = db.inspect(db.engine)
+    if any(ix['name'] == NOTIFICATION_USER_INDEX.name for ix in inspector.get_indexes(Notification.__tablename__)):
+        return False
+    NOTIFICATION_USER_INDEX.create(db.engine, checkfirst=True)
+    logging.info("通知表 (user_id, is_read, created_at) 索引已建立")
+    return True
+
+NOTICE_PAGE_SIZE = 10
 
-# 原有接口保持不变
 @notification_bp.route('/list')
 @login_required
 def notification_list():
-    # 获取页码参数，默认为第 1 页，每页显示 10 条
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
-    
-    # 使用 paginate 进行分页查询
-    pagination = Notification.query.filter_by(user_id=current_user.id)\
-        .order_by(Notification.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
-    
+    # 游标分页（“加载更早的通知”）：before 为上一页最后一条通知的ID，按 (created_at, id) 向前取，不做 OFFSET 和总数统计
+    query = Notification.query.filter_by(user_id=current_user.id)
+    before = request.args.get('before', type=int)
+    if before:
+        anchor = db.session.query(Notification.created_at).filter_by(id=before, user_id=current_user.id).first()
+        if anchor:
+            query = query.filter(db.or_(
+                Notification.created_at < anchor.created_at,
+                db.and_(Notification.created_at == anchor.created_at, Notification.id < before)
+            ))
+    rows = query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(NOTICE_PAGE_SIZE + 1).all()
+    notifications = rows[:NOTICE_PAGE_SIZE]
+    next_before = notifications[-1].id if len(rows) > NOTICE_PAGE_SIZE else None
+
     # 获取当前用户的总未读数（用于顶部显示，不受分页影响）
-    unread_count = Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
-    
-    return render_template('notification/list.html', 
-                           pagination=pagination, 
-                           notifications=pagination.items,
+    unread_count = get_unread_notice_count(current_user.id)
+
+    return render_template('notification/list.html',
+                           notifications=notifications,
+                           next_before=next_before,
+                           is_first_page=not before,
                            unread_count=unread_count)
 
 @notification_bp.route('/read/<int:notify_id>')
@@ -72,7 +72,9 @@ def notification_list():
 def mark_as_read(notify_id):
     """标记通知为已读"""
     notification = Notification.query.filter_by(id=notify_id, user_id=current_user.id).first_or_404()
-    notification.is_read = True
+    if not notification.is_read:
+        notification.is_read = True
+        decrease_unread_count(current_user.id)
     db.session.commit()
     return redirect(url_for('notification.notification_list'))
 
@@ -80,12 +82,11 @@ def mark_as_read(notify_id):
 @notification_bp.route('/read_all', methods=['POST'])
 @login_required
 def read_all():
-    from models import Notification, db
-    # 找到当前用户所有未读的通知
-    unread_notifications = Notification.query.filter_by(user_id=current_user.id, is_read=False).all()
-    
-    for notice in unread_notifications:
-        notice.is_read = True
+    # 一条 UPDATE 完成（走 (user_id, is_read) 索引），不逐条加载
+    Notification.query.filter_by(user_id=current_user.id, is_read=False).update(
+        {Notification.is_read: True}, synchronize_session=False
+    )
+    reset_unread_count(current_user.id)
     
     db.session.commit()
     flash('所有通知已标记为已读', 'success')
@@ -94,23 +95,10 @@ def read_all():
 @notification_bp.route('/unread_count')
 @login_required
 def get_unread_count():
-    from models import Notification, EmploymentCycle
-    # 1. 检查未读通知
-    notice_count = Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
-    
-    # 2. 检查待审核人员 (仅给有权限的管理人员报警)
-    pending_hr_count = 0
-    from utils import perm 
-    if perm.can('hr.view'):
-        pending_hr_count = EmploymentCycle.query.filter(
-            db.or_(
-                EmploymentCycle.status == '待审核',           # 入职待审批
-                EmploymentCycle.pending_status == 'pending'    # 信息变更待审核
-            )
-        ).count()
-    
+    # 未读通知 + 待审核人员 (仅给有权限的管理人员报警)
+    state = _notice_state(current_user.id, perm.can('hr.view'))
     # 返回总和。只要这个数字 > 0，网页就会嘀嘀嘀
-    return {"unread_count": notice_count + pending_hr_count}
+    return {"unread_count": state["count"]}
 
 # 前端告诉后端：我已打开页面，有新消息记得推我
 @notification_bp.route('/client_ready')
@@ -119,19 +107,13 @@ def client_ready():
     # 这里只是标记客户端在线，实际推送用前端轮询替代版
     return {"ok": True}
 
-# 后端告诉前端：你有新消息了
-@notification_bp.route('/has_new_notice')
-@login_required
-def has_new_notice():
-    from models import Notification, EmploymentCycle
-    from utils import perm
-
-    notice_count = Notification.query.filter_by(
-        user_id=current_user.id, is_read=False
-    ).count()
+# 当前用户的提醒状态：未读通知 + 待审核人数（仅有人事查看权限者计入）
+def _notice_state(user_id, can_view_hr):
+    from models import EmploymentCycle
+    notice_count = get_unread_notice_count(user_id)
 
     pending_hr = 0
-    if perm.can('hr.view'):
+    if can_view_hr:
         pending_hr = EmploymentCycle.query.filter(
             db.or_(
                 EmploymentCycle.status == '待审核',           # 入职待审批
@@ -141,5 +123,55 @@ def has_new_notice():
 
     return {
         "has_new": (notice_count + pending_hr) > 0,
-        "count": notice_count + pending_hr
-    }
\ No newline at end of file
+        "count": notice_count + pending_hr,
+        "unread_count": notice_count,
+        "pending_count": pending_hr
+    }
+
+# 后端告诉前端：你有新消息了（SSE 不可用时的轮询接口）
+@notification_bp.route('/has_new_notice')
+@login_required
+def has_new_notice():
+    return _notice_state(current_user.id, perm.can('hr.view'))
+
+# 服务端推送（SSE）：只在数量变化时下发，替代前端轮询
+SSE_MAX_SECONDS = 1800      # 单个连接最长保持时间，到期后浏览器自动重连
+SSE_HEARTBEAT_SECONDS = 20  # 心跳间隔，防止 Nginx 等代理因空闲断开
+SSE_RETRY_MS = 5000         # 断线后浏览器重连间隔
+
+@notification_bp.route('/stream')
+@login_required
+def notice_stream():
+    # 每个 SSE 连接会占用一个 waitress 工作线程，超过上限时返回 204，前端退回轮询
+    if not notice_hub.try_open_stream():
+        return '', 204
+    user_id = current_user.id
+    can_view_hr = perm.can('hr.view')
+
+    @stream_with_context
+    def generate():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        last_state = None
+        seq = -1
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        while time.monotonic() < deadline:
+            new_seq = notice_hub.wait(user_id, seq, SSE_HEARTBEAT_SECONDS)
+            if new_seq == seq:
+                yield ": ping\n\n"
+                continue
+            seq = new_seq
+            try:
+                state = _notice_state(user_id, can_view_hr)
+            finally:
+                # 长连接期间不占用数据库连接
+                db.session.remove()
+            if state != last_state:
+                last_state = state
+                yield f"data: {json.dumps(state)}\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(notice_hub.close_stream)
+    return response
@@ -1,5 +1,6 @@
 #D:\cailu\cailutebao\routes\permission.py
 # 权限管理模块
+import logging
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required,current_user
 from models import db, Permission, UserPermission, EmploymentCycle, User,OperationLog
@@ -116,11 +117,12 @@ def permission_update():
         )
 
         db.session.commit()
+        perm.invalidate()
         flash(f'用户 {target_user.name} 的权限保存成功', 'success')
         
     except Exception as e:
         db.session.rollback()
-        print(f"数据库操作失败，原因: {str(e)}")
+        logging.error(f"数据库操作失败，原因: {str(e)}")
         flash(f'保存失败: {str(e)}', 'danger')
     
     return redirect(url_for('permission.permission_manage'))
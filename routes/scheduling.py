@@ -1,13 +1,18 @@
 # D:\cailu\cailutebao\routes\scheduling.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file, abort
 from flask_login import login_required
 from models import db, EmploymentCycle, ShiftPost, ShiftSchedule, BusinessTrip, LeaveRecord
-from utils import perm
+from utils import perm, record_cache_access
 from datetime import datetime, date, timedelta
 import pandas as pd
+import numpy as np
+import threading
 import io
 import re
-from sqlalchemy import case
+import click
+import logging
+from sqlalchemy import case, event, inspect as sa_inspect
+from sqlalchemy.orm import Session, selectinload
 
 scheduling_bp = Blueprint('scheduling', __name__, url_prefix='/scheduling')
 
@@ -17,6 +22,201 @@ SCHEDULING_PERMISSIONS = [
     ('edit', '管理排班', '拖拽排班、保存排班数据'),
     ('post', '岗位管理', '增删改查排班岗位')
 ]
+
+def _month_bounds(year_month):
+    """'YYYY-MM' -> (月初, 月末)，用于 date BETWEEN 查询（可走索引，替代 LIKE 'YYYY-MM%'）"""
+    from calendar import monthrange
+    year, month = map(int, year_month.split('-'))
+    _, last_day = monthrange(year, month)
+    return date(year, month, 1), date(year, month, last_day)
+
+def _normalize_month(year_month):
+    """'2024-1' -> '2024-01'；格式错误抛 ValueError。缓存键与失效键统一使用该格式"""
+    return _month_bounds(year_month)[0].strftime('%Y-%m')
+
+# ==================== 排班表唯一索引迁移 ====================
+def migrate_shift_schedule_unique():
+    """
+    为 (employee_id, date) 建立唯一索引。建索引前先合并重复记录：
+    保留 id 最小的一条，岗位/加班为空时用同组其他记录补齐，再删除其余记录。
+    幂等，可在每次启动时调用。
+    """
+    from models import SHIFT_UNIQUE_INDEX
+    inspector = db.inspect(db.engine)
+    if any(ix['name'] == SHIFT_UNIQUE_INDEX.name for ix in inspector.get_indexes(ShiftSchedule.__tablename__)):
+        return 0
+
+    dup_keys = db.session.query(ShiftSchedule.employee_id, ShiftSchedule.date)\
+        .group_by(ShiftSchedule.employee_id, ShiftSchedule.date)\
+        .having(db.func.count(ShiftSchedule.id) > 1).all()
+    removed = 0
+    for employee_id, day in dup_keys:
+        rows = ShiftSchedule.query.filter_by(employee_id=employee_id, date=day)\
+            .order_by(ShiftSchedule.id).all()
+        keep = rows[0]
+        for extra in rows[1:]:
+            if keep.post_id is None and extra.post_id is not None:
+                keep.post_id = extra.post_id
+                keep.shift_type = extra.shift_type
+            if keep.hours is None and extra.hours is not None:
+                keep.hours = extra.hours
+            db.session.delete(extra)
+            removed += 1
+    db.session.commit()
+
+    SHIFT_UNIQUE_INDEX.create(db.engine, checkfirst=True)
+    if removed:
+        logging.warning(f"排班表合并重复记录 {removed} 条（{len(dup_keys)} 组）")
+    logging.info("排班表 (employee_id, date) 唯一索引已建立")
+    return removed
+
+@scheduling_bp.cli.command('migrate-unique')
+def migrate_unique_command():
+    """合并重复排班并建立 (employee_id, date) 唯一索引"""
+    removed = migrate_shift_schedule_unique()
+    click.echo(f"完成，合并重复记录 {removed} 条")
+
+# ==================== 考勤统计引擎 ====================
+MONTHLY_HOURS_MODE = '月工时制'
+MONTHLY_FLOOR_HOURS = 174.0  # 月工时制保底工时
+NIGHT_ALLOWANCE = 15  # 夜班补贴（元/次）
+DEFAULT_POST_HOURS = 12.0  # 岗位缺失默认时长时的兜底值
+
+class AttendanceEngine:
+    """
+    按月汇总考勤：一次分组查询 + pandas 向量化计算，结果按月缓存。
+    排班/岗位/员工信息变更在事务提交后失效对应月份（见文件末尾的会话事件）。
+    """
+    COLUMNS = ['employee_id', 'name', 'id_card', 'salary_mode', 'scheduled_days', 'post_hours',
+               'overtime_hours', 'night_count', 'actual_hours', 'settled_hours', 'excess_hours', 'night_allowance']
+
+    def __init__(self):
+        self._cache = {}  # 'YYYY-MM' -> DataFrame
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self, months=None):
+        """months 为 None 时清空全部缓存"""
+        with self._lock:
+            self._version += 1
+            if months is None:
+                self._cache.clear()
+            else:
+                for ym in months:
+                    self._cache.pop(ym, None)
+
+    def monthly(self, year_month):
+        """返回该月每名员工的考勤汇总（DataFrame 副本，调用方可随意修改）；月份格式错误抛 ValueError"""
+        year_month = _normalize_month(year_month)
+        with self._lock:
+            cached = self._cache.get(year_month)
+            version = self._version
+        record_cache_access('attendance_monthly', cached is not None)
+        if cached is None:
+            cached = self._compute(year_month)
+            with self._lock:
+                # 计算期间有失效发生则不写缓存，避免缓存旧数据
+                if self._version == version:
+                    self._cache[year_month] = cached
+        return cached.copy()
+
+    def _compute(self, year_month):
+        month_start, month_end = _month_bounds(year_month)
+        rows = db.session.query(
+            ShiftSchedule.employee_id, ShiftSchedule.post_id, ShiftSchedule.shift_type,
+            ShiftSchedule.hours, ShiftPost.default_hours
+        ).outerjoin(ShiftPost, ShiftSchedule.post_id == ShiftPost.id)\
+         .filter(ShiftSchedule.date.between(month_start, month_end)).all()
+        if not rows:
+            return pd.DataFrame(columns=self.COLUMNS)
+
+        df = pd.DataFrame(rows, columns=['employee_id', 'post_id', 'shift_type', 'hours', 'default_hours'])
+        has_post = df['post_id'].notna()
+        df['scheduled'] = has_post
+        df['post_hours'] = np.where(has_post, df['default_hours'].astype(float).fillna(DEFAULT_POST_HOURS), 0.0)
+        df['overtime'] = df['hours'].astype(float).fillna(0.0)
+        df['night'] = df['shift_type'].eq('夜')
+        result = df.groupby('employee_id').agg(
+            scheduled_days=('scheduled', 'sum'),
+            post_hours=('post_hours', 'sum'),
+            overtime_hours=('overtime', 'sum'),
+            night_count=('night', 'sum')
+        )
+
+        emps = db.session.query(
+            EmploymentCycle.id, EmploymentCycle.name, EmploymentCycle.id_card, EmploymentCycle.salary_mode
+        ).filter(EmploymentCycle.id.in_(result.index.tolist())).all()
+        emp_df = pd.DataFrame(emps, columns=['employee_id', 'name', 'id_card', 'salary_mode']).set_index('employee_id')
+        result = emp_df.join(result, how='inner')
+
+        result['actual_hours'] = result['post_hours'] + result['overtime_hours']
+        is_monthly = result['salary_mode'].eq(MONTHLY_HOURS_MODE)
+        result['settled_hours'] = np.where(is_monthly, np.maximum(result['actual_hours'], MONTHLY_FLOOR_HOURS), result['actual_hours'])
+        result['excess_hours'] = np.where(is_monthly, np.maximum(result['actual_hours'] - MONTHLY_FLOOR_HOURS, 0.0), 0.0)
+        result['night_allowance'] = result['night_count'] * NIGHT_ALLOWANCE
+        result[['scheduled_days', 'night_count']] = result[['scheduled_days', 'night_count']].astype(int)
+        return result.reset_index()[self.COLUMNS]
+
+    def export_frame(self, year_month, table_type):
+        """A表：月工时制员工工时结算；B表：其他薪资模式夜班补贴"""
+        df = self.monthly(year_month)
+        if table_type == 'A':
+            df = df[df['salary_mode'].eq(MONTHLY_HOURS_MODE)]
+            return pd.DataFrame({
+                "姓名": df['name'], "身份证": df['id_card'], "实际工时": df['actual_hours'],
+                "结算工时(保底174)": df['settled_hours'], "超额加班": df['excess_hours']
+            })
+        df = df[df['salary_mode'].notna() & df['salary_mode'].ne(MONTHLY_HOURS_MODE)]
+        return pd.DataFrame({
+            "姓名": df['name'], "身份证": df['id_card'], "夜班次": df['night_count'], "夜补金额": df['night_allowance']
+        })
+
+attendance_engine = AttendanceEngine()
+
+def _mark_attendance_dirty(session, months):
+    """登记待失效月份（None 表示全部），提交后才生效"""
+    pending = session.info.setdefault('attendance_dirty', set())
+    if months is None:
+        session.info['attendance_dirty_all'] = True
+    else:
+        pending.update(months)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_attendance_changes(session, flush_context):
+    months = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ShiftSchedule):
+            history = sa_inspect(obj).attrs.date.history
+            for d in [obj.date, *(history.deleted or ())]:
+                if d:
+                    months.add(d.strftime('%Y-%m'))
+        elif isinstance(obj, (ShiftPost, EmploymentCycle)):
+            _mark_attendance_dirty(session, None)
+    if months:
+        _mark_attendance_dirty(session, months)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_attendance_bulk(orm_execute_state):
+    # query.delete()/update() 不经过 flush，直接整体失效
+    if (orm_execute_state.is_delete or orm_execute_state.is_update) and orm_execute_state.bind_mapper is not None:
+        if orm_execute_state.bind_mapper.class_ in (ShiftSchedule, ShiftPost, EmploymentCycle):
+            _mark_attendance_dirty(orm_execute_state.session, None)
+
+@event.listens_for(Session, 'after_commit')
+def _apply_attendance_invalidation(session):
+    months = session.info.pop('attendance_dirty', None)
+    if session.info.pop('attendance_dirty_all', False):
+        attendance_engine.invalidate()
+    elif months:
+        attendance_engine.invalidate(months)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_attendance_invalidation(session, previous_transaction):
+    # SAVEPOINT 回滚不丢弃，只在最外层事务回滚时丢弃
+    if previous_transaction.parent is None:
+        session.info.pop('attendance_dirty', None)
+        session.info.pop('attendance_dirty_all', None)
+
 # --- 路由 1：重构后的排班主页 ---
 @scheduling_bp.route('/list')
 @login_required
@@ -103,46 +303,58 @@ def get_matrix_data():
     # 第三优先级：班组 (对应数据库中的 post 字段)
     GROUP_MAP = {"机动": 1, "监控": 2, "窗口": 3, "外口": 4}
 
-    # 2. 基础数据查询
+    # 2. 计算月份的开始和结束日期
+    try:
+        month_start, month_end = _month_bounds(month_str)
+    except ValueError:
+        abort(400, '月份格式应为 YYYY-MM')
+    last_day = month_end.day
+    today = date.today()
+
+    # 3. 基础数据查询
     employees_query = EmploymentCycle.query.filter_by(status='在职').all()
 
-    # 3. 执行四级排序逻辑
+    # 4. 岗位信息缓存 (包含默认工时)
+    posts = {p.id: {'name': p.name, 'color': p.color, 'default_hours': p.default_hours} for p in ShiftPost.query.all()}
+
+    # 5. 获取当月排班：一次日期区间查询（可走 date 索引），联表带出岗位名
+    schedules = db.session.query(
+        ShiftSchedule.id,
+        ShiftSchedule.employee_id,
+        ShiftSchedule.date,
+        ShiftSchedule.post_id,
+        ShiftSchedule.shift_type,
+        ShiftSchedule.hours,
+        ShiftPost.name.label('post_name')
+    ).outerjoin(
+        ShiftPost, ShiftSchedule.post_id == ShiftPost.id
+    ).filter(
+        ShiftSchedule.date.between(month_start, month_end)
+    ).order_by(ShiftSchedule.date, ShiftSchedule.id).all()
+
+    sched_map = {}
+    first_shift_night = {}  # 员工当月第一条排班是否为夜班岗位
+    for s in schedules:
+        sched_map[(s.employee_id, s.date.day)] = s
+        if s.employee_id not in first_shift_night:
+            first_shift_night[s.employee_id] = bool(s.post_name and "夜班" in s.post_name)
+
+    # 6. 执行四级排序逻辑
     def sort_key(emp):
 
         p1 = POSITION_MAP.get(emp.position, 99)
         p2 = SALARY_MAP.get(emp.salary_mode, 99)
         p3 = GROUP_MAP.get(emp.post, 99)
         p4 = emp.id  
-        shift_order = 0  # 0=白班，1=夜班
-        if emp.schedules:
-            month_schedules = [s for s in emp.schedules if s.date.strftime("%Y-%m") == month_str]
-            if month_schedules and month_schedules[0].post:
-                post_name = month_schedules[0].post.name
-                if "夜班" in post_name:
-                    shift_order = 1
+        shift_order = 1 if first_shift_night.get(emp.id) else 0  # 0=白班，1=夜班
         
         return (p3, shift_order, p1, p2, p4)
 
     # 应用排序
     employees = sorted(employees_query, key=sort_key)
     
-    # 4. 岗位信息缓存 (包含默认工时)
-    posts = {p.id: {'name': p.name, 'color': p.color, 'default_hours': p.default_hours} for p in ShiftPost.query.all()}
-    
-    # 5. 获取当月排班
-    schedules = ShiftSchedule.query.filter(ShiftSchedule.date.like(f"{month_str}%")).all()
-    sched_map = {(s.employee_id, s.date.day): s for s in schedules}
-    
-    # 6. 计算月份的开始和结束日期
-    from calendar import monthrange
-    year, month = map(int, month_str.split('-'))
-    _, last_day = monthrange(year, month)
-    month_start = date(year, month, 1)
-    month_end = date(year, month, last_day)
-    today = date.today()
-    
-    # 7. 获取当月的出差记录
-    trips = BusinessTrip.query.filter(
+    # 7. 获取当月的出差记录（参与人员一并批量加载）
+    trips = BusinessTrip.query.options(selectinload(BusinessTrip.participants)).filter(
         db.or_(
             db.and_(BusinessTrip.start_date >= month_start, BusinessTrip.start_date <= month_end),
             db.and_(BusinessTrip.end_date >= month_start, BusinessTrip.end_date <= month_end),
@@ -215,7 +427,60 @@ def get_matrix_data():
         'on_trip_dates': list(on_trip_dates),
         'on_leave_dates': list(on_leave_dates)
     })
-# --- 其余函数保持原样 ---
+# --- 单元格操作（单格接口与批量接口共用） ---
+def _discard_shift(shift):
+    """删除记录；同一批次里刚新建、尚未落库的记录直接移出会话"""
+    if shift in db.session.new:
+        db.session.expunge(shift)
+    else:
+        db.session.delete(shift)
+
+def _cell_set_shift(shift, user_id, date_obj, post_id, shift_type):
+    """设置岗位/班次：已有记录只改排班信息，绝不碰加班时长 hours"""
+    if shift:
+        shift.post_id = post_id
+        shift.shift_type = shift_type
+    else:
+        # 新建排班时加班为空，完全独立
+        shift = ShiftSchedule(employee_id=user_id, date=date_obj, post_id=post_id, shift_type=shift_type, hours=None)
+        db.session.add(shift)
+    return shift
+
+def _cell_set_overtime(shift, user_id, date_obj, hours_val):
+    """设置加班时长；hours_val 为 None 表示清空加班"""
+    if hours_val is None:
+        if shift:
+            shift.hours = None
+        return shift
+    if not shift:
+        # 没有排班 → 直接创建一条记录存加班
+        shift = ShiftSchedule(employee_id=user_id, date=date_obj, hours=hours_val)
+        db.session.add(shift)
+    else:
+        shift.hours = hours_val
+    return shift
+
+def _cell_delete_shift(shift):
+    """删除排班：有加班则只清空岗位，否则删除整条记录"""
+    if not shift:
+        return None
+    if shift.hours is not None:
+        shift.post_id = None
+        shift.shift_type = None
+        return shift
+    _discard_shift(shift)
+    return None
+
+def _cell_delete_overtime(shift):
+    """删除加班：有排班则只清空加班，否则删除整条记录"""
+    if not shift:
+        return None
+    if shift.post_id is not None:
+        shift.hours = None
+        return shift
+    _discard_shift(shift)
+    return None
+
 @scheduling_bp.route('/save_shift', methods=['POST'])
 @login_required
 def save_shift():
@@ -228,23 +493,8 @@ def save_shift():
         
         # 1. 查询当天该员工的所有记录（包括纯加班记录）
         shift = ShiftSchedule.query.filter_by(employee_id=user_id, date=date_obj).first()
+        shift = _cell_set_shift(shift, user_id, date_obj, int(data.get('post_id')), data.get('shift_type', '白'))
 
-        if shift:
-            # --- 编辑模式：只更新【排班信息】，绝对不碰加班时长 hours ---
-            shift.post_id = int(data.get('post_id'))
-            shift.shift_type = data.get('shift_type', '白')
-            # ✅ 这里没有任何关于 hours 的代码，加班数据原封不动保留
-        else:
-            # --- 新建模式：只创建【排班记录】，加班字段留空 ---
-            shift = ShiftSchedule(
-                employee_id=user_id,
-                date=date_obj,
-                post_id=int(data.get('post_id')),
-                shift_type=data.get('shift_type', '白'),
-                hours=None  # 新建排班时加班为空，完全独立
-            )
-
-        db.session.add(shift)
         db.session.commit()
         return jsonify({'success': True, 'shift_id': shift.id})
     except Exception as e:
@@ -262,12 +512,7 @@ def delete_shift_by_date():
         user_id = int(data['user_id'])
         
         shift = ShiftSchedule.query.filter_by(employee_id=user_id, date=date_obj).first()
-        if shift:
-            if shift.hours is not None:
-                shift.post_id = None
-                shift.shift_type = None
-            else:
-                db.session.delete(shift)
+        _cell_delete_shift(shift)
         
         db.session.commit()
         return jsonify({'success': True})
@@ -286,12 +531,7 @@ def delete_overtime_by_date():
         user_id = int(data['user_id'])
         
         shift = ShiftSchedule.query.filter_by(employee_id=user_id, date=date_obj).first()
-        
-        if shift:
-            if shift.post_id is not None:
-                shift.hours = None
-            else:
-                db.session.delete(shift)
+        _cell_delete_overtime(shift)
         
         db.session.commit()
         return jsonify({'success': True})
@@ -299,6 +539,119 @@ def delete_overtime_by_date():
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
 
+# --- 批量单元格操作：一次请求、一次事务 ---
+BATCH_MAX_OPS = 2000
+BATCH_OPS = ('set_shift', 'set_type', 'set_overtime', 'clear_overtime', 'delete_shift', 'delete')
+
+def _parse_batch_op(raw):
+    """校验并解析单个操作，失败抛 ValueError（不修改任何数据）"""
+    op = raw.get('op')
+    if op not in BATCH_OPS:
+        raise ValueError(f'未知操作: {op}')
+    parsed = {
+        'op': op,
+        'user_id': int(raw['user_id']),
+        'date': datetime.strptime(raw['date'], '%Y-%m-%d').date()
+    }
+    if op == 'set_shift':
+        parsed['post_id'] = int(raw['post_id'])
+        parsed['shift_type'] = raw.get('shift_type') or '白'
+    elif op == 'set_type':
+        if raw.get('shift_type') not in ('白', '夜'):
+            raise ValueError('班次类型只能为 白/夜')
+        parsed['shift_type'] = raw['shift_type']
+    elif op == 'set_overtime':
+        hours = raw.get('hours')
+        parsed['hours'] = None if hours in (None, '', 'null') else float(hours)
+    return parsed
+
+@scheduling_bp.route('/api/batch', methods=['POST'])
+@login_required
+def batch_shift_ops():
+    """
+    批量编辑排班矩阵。请求体：{"ops": [{"op", "user_id", "date", ...}, ...]}
+    op：set_shift(post_id, shift_type) / set_type(shift_type) / set_overtime(hours，空为清除)
+        / clear_overtime / delete_shift / delete（删除整条记录）
+    按顺序执行、一次提交，返回每个单元格的结果。
+    """
+    if not perm.can('scheduling.edit'):
+        return jsonify({'success': False, 'message': '无权操作'})
+    raw_ops = (request.json or {}).get('ops') or []
+    if not isinstance(raw_ops, list) or not raw_ops:
+        return jsonify({'success': False, 'message': '没有可执行的操作'})
+    if len(raw_ops) > BATCH_MAX_OPS:
+        return jsonify({'success': False, 'message': f'单次最多 {BATCH_MAX_OPS} 个操作'})
+
+    results = [None] * len(raw_ops)
+    parsed_ops = []
+    for i, raw in enumerate(raw_ops):
+        try:
+            parsed_ops.append((i, _parse_batch_op(raw)))
+        except (KeyError, TypeError, ValueError) as e:
+            results[i] = {'index': i, 'success': False, 'message': f'参数错误: {e}'}
+
+    try:
+        # 预加载涉及的所有已有记录：(员工ID, 日期) -> 记录
+        shift_map = {}
+        if parsed_ops:
+            user_ids = {op['user_id'] for _, op in parsed_ops}
+            dates = [op['date'] for _, op in parsed_ops]
+            existing = ShiftSchedule.query.filter(
+                ShiftSchedule.employee_id.in_(user_ids),
+                ShiftSchedule.date.between(min(dates), max(dates))
+            ).order_by(ShiftSchedule.id).all()
+            for s in existing:
+                shift_map.setdefault((s.employee_id, s.date), s)
+            valid_posts = {pid for (pid,) in db.session.query(ShiftPost.id)}
+
+        touched = []
+        deleted_keys = set()
+        for i, op in parsed_ops:
+            key = (op['user_id'], op['date'])
+            shift = shift_map.get(key)
+            kind = op['op']
+            if shift is None and key in deleted_keys and kind in ('set_shift', 'set_overtime'):
+                # 同一批次先删后建：先把删除落库，避免撞上 (employee_id, date) 唯一索引
+                db.session.flush()
+                deleted_keys.clear()
+            if kind == 'set_shift':
+                if op['post_id'] not in valid_posts:
+                    results[i] = {'index': i, 'success': False, 'message': '岗位不存在'}
+                    continue
+                shift = _cell_set_shift(shift, op['user_id'], op['date'], op['post_id'], op['shift_type'])
+            elif kind == 'set_type':
+                if not shift or shift.post_id is None:
+                    results[i] = {'index': i, 'success': False, 'message': '该日期没有排班'}
+                    continue
+                shift.shift_type = op['shift_type']
+            elif kind == 'set_overtime':
+                shift = _cell_set_overtime(shift, op['user_id'], op['date'], op['hours'])
+            elif kind == 'clear_overtime':
+                shift = _cell_delete_overtime(shift)
+            elif kind == 'delete_shift':
+                shift = _cell_delete_shift(shift)
+            else:
+                if shift:
+                    _discard_shift(shift)
+                shift = None
+            if shift is None:
+                if shift_map.pop(key, None) is not None:
+                    deleted_keys.add(key)
+            else:
+                shift_map[key] = shift
+            touched.append((i, shift))
+
+        db.session.flush()
+        for i, shift in touched:
+            results[i] = {'index': i, 'success': True, 'shift_id': shift.id if shift else None}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)})
+
+    applied = sum(1 for r in results if r and r['success'])
+    return jsonify({'success': True, 'applied': applied, 'results': results})
+
 @scheduling_bp.route('/api/get_shifts')
 @login_required
 def get_shifts():
@@ -334,32 +687,75 @@ def delete_shift(id):
 @scheduling_bp.route('/export/<string:table_type>')
 @login_required
 def export_attendance(table_type):
-    target_month = request.args.get('month', datetime.now().strftime("%Y-%m"))
-    if table_type == 'A':
-        emps = EmploymentCycle.query.filter_by(salary_mode='月工时制').all()
-    else:
-        emps = EmploymentCycle.query.filter(EmploymentCycle.salary_mode != '月工时制').all()
-    data_list = []
-    for emp in emps:
-        shifts = ShiftSchedule.query.filter(ShiftSchedule.employee_id == emp.id, ShiftSchedule.date.like(f"{target_month}%")).all()
-        if not shifts: continue 
-        actual_h = sum(s.hours for s in shifts)
-        night_count = sum(1 for s in shifts if s.shift_type == '夜')
-        if table_type == 'A':
-            final_h = max(174.0, actual_h) 
-            data_list.append({"姓名": emp.name, "身份证": emp.id_card, "实际工时": actual_h, "结算工时(保底174)": final_h, "超额加班": max(0, actual_h - 174)})
-        else:
-            data_list.append({"姓名": emp.name, "身份证": emp.id_card, "夜班次": night_count, "夜补金额": night_count*15})
-    if not data_list:
+    try:
+        target_month = _normalize_month(request.args.get('month', datetime.now().strftime("%Y-%m")))
+    except ValueError:
+        abort(400, '月份格式应为 YYYY-MM')
+    df = attendance_engine.export_frame(target_month, table_type)
+    if df.empty:
         flash(f"{target_month} 暂无有效数据", "warning")
         return redirect(url_for('scheduling.schedule_list'))
-    df = pd.DataFrame(data_list)
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False)
     output.seek(0)
     return send_file(output, download_name=f"{table_type}表_{target_month}.xlsx", as_attachment=True)
 
+@scheduling_bp.route('/attendance')
+@login_required
+def attendance_summary():
+    if not perm.can('scheduling.view'):
+        flash("权限不足", "danger")
+        return redirect(url_for('main.index'))
+    try:
+        target_month = _normalize_month(request.args.get('month', datetime.now().strftime("%Y-%m")))
+    except ValueError:
+        abort(400, '月份格式应为 YYYY-MM')
+    df = attendance_engine.monthly(target_month).sort_values(['salary_mode', 'name'], na_position='last')
+    return render_template('scheduling/attendance.html',
+                           month=target_month,
+                           rows=df.to_dict('records'),
+                           floor_hours=MONTHLY_FLOOR_HOURS,
+                           monthly_mode=MONTHLY_HOURS_MODE)
+
+@scheduling_bp.route('/api/attendance')
+@login_required
+def attendance_range_api():
+    """多月考勤汇总：?start=YYYY-MM&end=YYYY-MM（最多24个月），返回逐月明细与区间合计"""
+    if not perm.can('scheduling.view'):
+        return jsonify({'success': False, 'message': '无权操作'})
+    this_month = datetime.now().strftime("%Y-%m")
+    try:
+        start, _ = _month_bounds(request.args.get('start', this_month))
+        end, _ = _month_bounds(request.args.get('end', request.args.get('start', this_month)))
+    except ValueError:
+        return jsonify({'success': False, 'message': '月份格式应为 YYYY-MM'})
+    months = pd.period_range(start, end, freq='M').strftime('%Y-%m').tolist()
+    if not months or len(months) > 24:
+        return jsonify({'success': False, 'message': '月份范围无效（最多24个月）'})
+
+    frames = {ym: attendance_engine.monthly(ym) for ym in months}
+    non_empty = [df for df in frames.values() if not df.empty]
+    totals = []
+    if non_empty:
+        total_df = pd.concat(non_empty).groupby(['employee_id', 'name', 'id_card'], dropna=False).agg(
+            scheduled_days=('scheduled_days', 'sum'), post_hours=('post_hours', 'sum'),
+            overtime_hours=('overtime_hours', 'sum'), night_count=('night_count', 'sum'),
+            actual_hours=('actual_hours', 'sum'), settled_hours=('settled_hours', 'sum'),
+            night_allowance=('night_allowance', 'sum')
+        ).reset_index()
+        totals = _frame_records(total_df)
+    return jsonify({
+        'success': True,
+        'months': {ym: _frame_records(df) for ym, df in frames.items()},
+        'totals': totals
+    })
+
+def _frame_records(df):
+    """DataFrame -> JSON 友好的字典列表（NaN 转 None，numpy 数值转原生类型）"""
+    return [{k: (None if pd.isna(v) else v.item() if hasattr(v, 'item') else v) for k, v in row.items()}
+            for row in df.to_dict('records')]
+
 @scheduling_bp.route('/data/import', methods=['POST'])
 @login_required
 def import_schedule_data():
@@ -414,7 +810,8 @@ def import_schedule_data():
 def clear_month():
     year_month = request.json.get('month', datetime.now().strftime("%Y-%m"))
     try:
-        num_deleted = ShiftSchedule.query.filter(ShiftSchedule.date.like(f"{year_month}%")).delete(synchronize_session=False)
+        month_start, month_end = _month_bounds(year_month)
+        num_deleted = ShiftSchedule.query.filter(ShiftSchedule.date.between(month_start, month_end)).delete(synchronize_session=False)
         db.session.commit()
         return jsonify({'success': True, 'message': f'已成功清空 {year_month} 的 {num_deleted} 条排班记录'})
     except Exception as e:
@@ -450,24 +847,9 @@ def save_overtime():
 
         # 查询当天该员工的排班
         shift = ShiftSchedule.query.filter_by(employee_id=user_id, date=date_obj).first()
-        
-        if hours in (None, '', 'null'):
-            # 清空加班
-            if shift:
-                shift.hours = None
-        else:
-            # 保存加班
-            hours_val = float(hours)
-            if not shift:
-                # 没有排班 → 直接创建一条记录存加班
-                shift = ShiftSchedule(
-                    employee_id=user_id,
-                    date=date_obj,
-                    hours=hours_val
-                )
-                db.session.add(shift)
-            else:
-                shift.hours = hours_val
+        # 空值表示清空加班
+        hours_val = None if hours in (None, '', 'null') else float(hours)
+        _cell_set_overtime(shift, user_id, date_obj, hours_val)
 
         db.session.commit()
         return jsonify({'success': True})
@@ -129,17 +129,15 @@ def trip_add():
         db.session.add(new_trip)
         db.session.flush()  # 【新增：刷新 Session 以生成 new_trip.id 供审计记录使用】
         
-        # ========== 关键修复1：遍历所有参与者，改用 user_id 参数 ==========
+        # 一条审计记录，所有参与者与管理人员各收到一条通知
         if participant_ids:
-            # 遍历每个参与者ID，确保每个人都能收到通知
-            for cycle_id in participant_ids:
-                log_action(
-                    action_type='出差登记',
-                    target_type='BusinessTrip',
-                    target_id=new_trip.id,
-                    description=f"登记了人员出差：{names}，目的地：{new_trip.destination}，出发时间：{start_date}",
-                    user_id=cycle_id  # 改用 user_id 参数，和请假模块保持一致
-                )
+            log_action(
+                action_type='出差登记',
+                target_type='BusinessTrip',
+                target_id=new_trip.id,
+                description=f"登记了人员出差：{names}，目的地：{new_trip.destination}，出发时间：{start_date}",
+                cycle_ids=participant_ids
+            )
         else:
             # 无参与者时的兜底日志
             log_action(
@@ -197,17 +195,15 @@ def trip_edit(id):
         if old_status == '出差中' and trip.status == '已归队':
             action_type = '出差归队确认'
         
-        # ========== 关键修复2：遍历所有参与者，改用 user_id 参数，移除无效循环 ==========
+        # 一条审计记录，所有参与者与管理人员各收到一条通知
         if participant_ids:
-            # 遍历每个参与者ID，确保每个人都能收到通知
-            for cycle_id in participant_ids:
-                log_action(
-                    action_type=action_type,
-                    target_type='BusinessTrip',
-                    target_id=trip.id,
-                    description=f"{names} 的出差记录已更新。目的地：{trip.destination}，当前状态：{trip.status}",
-                    user_id=cycle_id  # 改用 user_id 参数
-                )
+            log_action(
+                action_type=action_type,
+                target_type='BusinessTrip',
+                target_id=trip.id,
+                description=f"{names} 的出差记录已更新。目的地：{trip.destination}，当前状态：{trip.status}",
+                cycle_ids=participant_ids
+            )
         else:
             # 无参与者时的兜底日志
             log_action(
@@ -0,0 +1,213 @@
+#D:\cailu\cailutebao\synthetic.py
+# 合成数据：只在临时库上使用（CAILU_DATABASE_PATH 指向一个 scratch SQLite 文件）
+import os
+import random
+from datetime import date, datetime, timedelta
+from werkzeug.security import generate_password_hash
+from config import DATABASE_PATH, BASE_DIR, POSTS, POSITIONS, SALARY_MODES, ASSET_TYPES
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈'
+GIVEN_CHARS = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华建国志红斌鹏辉俊峰浩宇晨'
+REGIONS = ('110101', '310104', '320106', '330106', '440305', '510107', '420106', '370102', '410105', '430102')
+ID_WEIGHTS = (7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2)
+ID_CHECK_CODES = '10X98765432'
+POST_COLORS = ('#007bff', '#28a745', '#fd7e14', '#6f42c1', '#20c997', '#dc3545', '#17a2b8')
+CHUNK = 5000
+
+def is_scratch_database():
+    """生成器只允许写入通过 CAILU_DATABASE_PATH 显式指定、且不是默认业务库的文件"""
+    default_path = os.path.join(BASE_DIR, 'data', 'database.db')
+    return bool(os.getenv('CAILU_DATABASE_PATH')) and os.path.abspath(DATABASE_PATH) != os.path.abspath(default_path)
+
+def _id_card(rng, used):
+    """生成校验位正确、不重复的 18 位身份证号，返回 (号码, 生日, 性别)"""
+    while True:
+        birthday = date(1965, 1, 1) + timedelta(days=rng.randrange(38 * 365))
+        body = f'{rng.choice(REGIONS)}{birthday:%Y%m%d}{rng.randrange(1000):03d}'
+        if body in used:
+            continue
+        used.add(body)
+        check = ID_CHECK_CODES[sum(int(c) * w for c, w in zip(body, ID_WEIGHTS)) % 11]
+        return body + check, birthday, '男' if int(body[16]) % 2 else '女'
+
+def _insert(table, rows):
+    from models import db
+    for i in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[i:i + CHUNK])
+
+def _daterange(start, end):
+    for n in range((end - start).days + 1):
+        yield start + timedelta(days=n)
+
+def generate_synthetic_data(people=1500, years=2, seed=42):
+    """
+    在空库中生成接近真实规模的数据：多段入职周期、按天排班、资产发放/归还、收支流水、
+    通知与操作日志、请假与出差。全部走 Core 批量插入，派生表（资产持有、未读计数）最后统一重建。
+    返回各表写入行数。需在 app_context 中调用。
+    """
+    from models import (db, User, EmploymentCycle, ShiftPost, ShiftSchedule, Asset, AssetHistory, FundsRecord,
+                        Notification, OperationLog, LeaveRecord, BusinessTrip, trip_participants)
+    from routes.asset.core import rebuild_asset_holdings
+    from utils import rebuild_notification_counters
+
+    if EmploymentCycle.query.first() is not None:
+        raise ValueError('目标库已有员工数据，合成数据只写入空的临时库')
+    admin = User.query.filter_by(role='admin').first()
+    if admin is None:
+        raise ValueError('缺少管理员账号，请先执行应用初始化')
+
+    rng = random.Random(seed)
+    today = date.today()
+    window_start = today - timedelta(days=365 * years)
+    counts = {}
+
+    # 1. 入职周期：约两成人员离职后再入职，形成同一身份证的多段周期
+    used_ids, cycles, users = set(), [], []
+    for _ in range(people):
+        id_card, birthday, gender = _id_card(rng, used_ids)
+        name = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_CHARS) for _ in range(rng.choice((1, 2))))
+        n_cycles = rng.choices((1, 2, 3), weights=(80, 15, 5))[0]
+        hire = window_start - timedelta(days=rng.randrange(3 * 365))
+        for k in range(n_cycles):
+            last = k == n_cycles - 1
+            if last:
+                departure = None if rng.random() < 0.85 else hire + timedelta(days=rng.randrange(30, 400))
+                if departure and departure >= today:
+                    departure = None
+            else:
+                departure = hire + timedelta(days=rng.randrange(60, 500))
+            cycles.append({
+                'id_card': id_card, 'name': name, 'gender': gender, 'birthday': birthday,
+                'phone': f'1{rng.choice("3589")}{rng.randrange(10 ** 9):09d}',
+                'hire_date': hire, 'departure_date': departure, 'status': '离职' if departure else '在职',
+                'salary_mode': rng.choice(SALARY_MODES), 'position': rng.choices(POSITIONS, weights=[85 if p == '队员' else 5 for p in POSITIONS])[0],
+                'post': rng.choice(POSTS), 'pending_status': 'none', 'created_at': datetime.combine(hire, datetime.min.time()),
+            })
+            if departure:
+                hire = departure + timedelta(days=rng.randrange(30, 300))
+                if hire >= today:
+                    break
+        # 初始密码为身份证后 6 位；临时库账号用低迭代 pbkdf2，避免上千次 scrypt（压测按此登录）
+        users.append({'username': id_card, 'name': name, 'role': 'member',
+                      'password_hash': generate_password_hash(id_card[-6:], method='pbkdf2:sha256:1000'),
+                      'created_at': datetime.now(), 'created_by': admin.id})
+    _insert(EmploymentCycle.__table__, cycles)
+    _insert(User.__table__, users)
+    counts['employment_cycles'], counts['users'] = len(cycles), len(users)
+    cycle_rows = db.session.query(EmploymentCycle.id, EmploymentCycle.hire_date, EmploymentCycle.departure_date).all()
+    user_ids = [u for (u,) in db.session.query(User.id).filter(User.role == 'member')]
+
+    # 2. 排班：窗口期内每个在岗日一条（约七成上班，其中三成夜班，其余休息）
+    posts = ShiftPost.query.all()
+    if not posts:
+        _insert(ShiftPost.__table__, [{'name': p, 'color': POST_COLORS[i % len(POST_COLORS)], 'default_hours': 12}
+                                      for i, p in enumerate(POSTS)])
+        posts = ShiftPost.query.all()
+    post_ids = [p.id for p in posts]
+    schedules = []
+    for cycle_id, hire, departure in cycle_rows:
+        first, last = max(hire, window_start), min(departure or today + timedelta(days=30), today + timedelta(days=30))
+        for d in _daterange(first, last) if first <= last else ():
+            if rng.random() < 0.7:
+                schedules.append({'date': d, 'employee_id': cycle_id, 'post_id': rng.choice(post_ids),
+                                  'shift_type': '夜' if rng.random() < 0.3 else '白',
+                                  'hours': rng.choice((None, None, None, 2.0, 4.0))})
+            else:
+                schedules.append({'date': d, 'employee_id': cycle_id, 'post_id': None, 'shift_type': '休', 'hours': None})
+        if len(schedules) >= CHUNK * 10:
+            _insert(ShiftSchedule.__table__, schedules)
+            counts['shift_schedules'] = counts.get('shift_schedules', 0) + len(schedules)
+            schedules = []
+    _insert(ShiftSchedule.__table__, schedules)
+    counts['shift_schedules'] = counts.get('shift_schedules', 0) + len(schedules)
+
+    # 3. 资产与发放/归还历史（离职时自动归还）
+    _insert(Asset.__table__, [{
+        'type': rng.choice(ASSET_TYPES), 'name': f'合成资产{i:03d}', 'number': f'SYN-{i:05d}',
+        'total_quantity': 5000, 'stock_quantity': 5000, 'allocated_quantity': 0, 'status': '库存',
+        'ownership': '特保队', 'unit_price': round(rng.uniform(10, 500), 2), 'bed_capacity': 0,
+        'allocation_mode': 'personal', 'created_at': datetime.now(),
+    } for i in range(40)])
+    asset_ids = [a for (a,) in db.session.query(Asset.id)]
+    history = []
+    for cycle_id, hire, departure in cycle_rows:
+        issued = rng.sample(asset_ids, rng.randrange(2, 7))
+        for asset_id in issued:
+            issue_at = datetime.combine(hire, datetime.min.time()) + timedelta(hours=rng.randrange(8, 18))
+            history.append({'asset_id': asset_id, 'action': '发放', 'user_id': cycle_id, 'operator_id': admin.id,
+                            'quantity': 1, 'action_date': issue_at, 'note': '入职发放', 'created_at': issue_at})
+            if departure:
+                back_at = datetime.combine(departure, datetime.min.time()) + timedelta(hours=10)
+                history.append({'asset_id': asset_id, 'action': '归还（离职自动）', 'user_id': cycle_id, 'operator_id': admin.id,
+                                'quantity': 1, 'action_date': back_at, 'note': '离职自动归还', 'created_at': back_at})
+    _insert(AssetHistory.__table__, history)
+    counts['asset_history'] = len(history)
+
+    # 4. 收支流水：每天 0~4 笔，余额按时间顺序累加（等同 recalculate_balances 的结果）
+    funds, balance = [], 0.0
+    for d in _daterange(window_start, today):
+        for _ in range(rng.randrange(5)):
+            amount = round(rng.uniform(50, 3000), 2) * (1 if rng.random() < 0.45 else -1)
+            at = datetime.combine(d, datetime.min.time()) + timedelta(minutes=rng.randrange(8 * 60, 20 * 60))
+            funds.append({'date': at, 'payer': rng.choice(('特保队', '公司', '个人')), 'item': rng.choice(('伙食', '装备', '水电', '补贴', '维修')),
+                          'amount': amount, 'note': '', 'attachment': [], 'operator_id': admin.id, 'created_at': at})
+    # 同一天内的时间是随机的，先按时间排序再累加余额
+    funds.sort(key=lambda r: r['date'])
+    for row in funds:
+        balance = row['balance'] = round(balance + row['amount'], 2)
+    _insert(FundsRecord.__table__, funds)
+    counts['funds_records'] = len(funds)
+
+    # 5. 通知（人均约 30 条，八成已读）与操作日志（每天约 150 条）
+    notices = []
+    for user_id in user_ids:
+        for _ in range(rng.randrange(10, 50)):
+            at = datetime.combine(window_start, datetime.min.time()) + timedelta(minutes=rng.randrange(365 * years * 24 * 60))
+            notices.append({'user_id': user_id, 'title': '排班变更', 'content': '您的排班已调整，请查看', 'is_read': rng.random() < 0.8,
+                            'related_type': 'shift', 'related_id': None, 'created_at': at})
+    _insert(Notification.__table__, notices)
+    counts['notifications'] = len(notices)
+    logs = []
+    for d in _daterange(window_start, today):
+        for _ in range(rng.randrange(100, 200)):
+            at = datetime.combine(d, datetime.min.time()) + timedelta(seconds=rng.randrange(86400))
+            logs.append({'user_id': admin.id, 'action_type': rng.choice(('排班修改', '员工编辑', '资产发放', '财务新增')),
+                         'target_type': 'ShiftSchedule', 'target_id': rng.randrange(1, 100000),
+                         'description': '合成操作记录', 'ip_address': '127.0.0.1', 'created_at': at})
+        if len(logs) >= CHUNK * 10:
+            _insert(OperationLog.__table__, logs)
+            counts['operation_logs'] = counts.get('operation_logs', 0) + len(logs)
+            logs = []
+    _insert(OperationLog.__table__, logs)
+    counts['operation_logs'] = counts.get('operation_logs', 0) + len(logs)
+
+    # 6. 请假（约半数周期各一条）与出差（每周一次，2~5 人）
+    leaves = []
+    for cycle_id, hire, departure in cycle_rows:
+        if rng.random() < 0.5:
+            start = max(hire, window_start) + timedelta(days=rng.randrange(200))
+            if start > today:
+                continue
+            days = rng.randrange(1, 8)
+            ended = start + timedelta(days=days) < today
+            leaves.append({'user_id': cycle_id, 'leave_type': rng.choice(('事假', '病假', '年假')), 'reason': '合成请假',
+                           'start_date': start, 'end_date': start + timedelta(days=days),
+                           'actual_end_date': start + timedelta(days=days) if ended else None, 'total_days': float(days),
+                           'status': '已销假' if ended else '请假中', 'attachments': [], 'created_at': datetime.combine(start, datetime.min.time()),
+                           'is_reported': ended})
+    _insert(LeaveRecord.__table__, leaves)
+    counts['leave_records'] = len(leaves)
+    trips = [{'destination': rng.choice(('北京', '上海', '广州', '成都', '武汉')), 'start_date': d, 'end_date': d + timedelta(days=3),
+              'total_days': 3, 'status': '已归队' if d + timedelta(days=3) < today else '出差中'}
+             for d in _daterange(window_start, today) if d.weekday() == 0]
+    _insert(BusinessTrip.__table__, trips)
+    counts['business_trips'] = len(trips)
+    cycle_ids = [c[0] for c in cycle_rows]
+    trip_ids = [t for (t,) in db.session.query(BusinessTrip.id)]
+    participants = {(t, e) for t in trip_ids for e in rng.sample(cycle_ids, min(len(cycle_ids), rng.randrange(2, 6)))}
+    _insert(trip_participants, [{'trip_id': t, 'employee_id': e} for t, e in participants])
+
+    db.session.commit()
+    rebuild_asset_holdings()
+    rebuild_notification_counters()
+    return counts
@@ -0,0 +1,76 @@
+#D:\cailu\cailutebao\tests\conftest.py
+# 测试夹具：整个会话使用一个临时 SQLite 库（合成数据），不碰 data/ 下的业务库
+import os
+import sys
+import shutil
+import tempfile
+from datetime import date
+
+# 必须在导入 app 之前设置：数据库、日志、备份、归档、上传目录全部指向临时目录
+_SCRATCH_DIR = tempfile.mkdtemp(prefix='cailu_test_')
+os.environ['CAILU_DATABASE_PATH'] = os.path.join(_SCRATCH_DIR, 'test.db')
+for _key in ('CAILU_LOG_DIR', 'CAILU_BACKUP_DIR', 'CAILU_ARCHIVE_DIR', 'CAILU_UPLOAD_BASE'):
+    os.environ[_key] = _SCRATCH_DIR
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import event
+
+
+@pytest.fixture(scope='session')
+def app():
+    """setup_database（建表、迁移、权限、管理员账号）+ 少量合成数据；不启动备份/清理等后台线程"""
+    from app import app as flask_app, setup_database
+    from models import db
+    from synthetic import generate_synthetic_data
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    setup_database()
+    with flask_app.app_context():
+        generate_synthetic_data(people=40, years=1, seed=7)
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    shutil.rmtree(_SCRATCH_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    resp = client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    assert resp.status_code == 302
+    return client
+
+
+@pytest.fixture
+def this_month():
+    return date.today().strftime('%Y-%m')
+
+
+@pytest.fixture
+def sql_capture(app):
+    """记录期间执行的 (SQL, 参数)，用于断言查询数与 EXPLAIN 执行计划"""
+    from models import db
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', _record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', _record)
+
+
+@pytest.fixture
+def query_plan(app):
+    """query_plan(sql, params) -> SQLite EXPLAIN QUERY PLAN 的 detail 列表"""
+    from models import db
+
+    def _plan(statement, parameters=()):
+        with app.app_context():
+            with db.engine.connect() as conn:
+                rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, tuple(parameters)).all()
+        return [row[-1] for row in rows]
+    return _plan
@@ -0,0 +1,66 @@
+#D:\cailu\cailutebao\tests\test_asset.py
+# 员工持有资产：asset_holdings 的增量维护与按 AssetHistory 全量重放的结果一致（含离职自动归还）
+from datetime import date
+
+from sqlalchemy import func
+
+
+def _holdings():
+    from models import db, AssetHolding
+    db.session.expire_all()
+    return {(h.cycle_id, h.asset_id): (h.quantity, h.departure_quantity, h.last_issue_date)
+            for h in AssetHolding.query if h.quantity or h.departure_quantity}
+
+
+def _replay():
+    """直接按历史记录聚合：净持有 = Σ方向×数量，离职归还 = Σ离职自动归还数量，最近发放 = 发放类动作的最大时间"""
+    from models import db, AssetHistory
+    from routes.asset.core import HOLDING_ACTIONS
+    expected = {}
+    rows = db.session.query(AssetHistory.user_id, AssetHistory.asset_id, AssetHistory.action,
+                            func.coalesce(AssetHistory.quantity, 1), AssetHistory.action_date) \
+        .filter(AssetHistory.user_id.isnot(None), AssetHistory.action.in_(list(HOLDING_ACTIONS)))
+    for cycle_id, asset_id, action, quantity, action_date in rows:
+        sign, on_departure, is_issue = HOLDING_ACTIONS[action]
+        held, departed, last_issue = expected.get((cycle_id, asset_id), (0, 0, None))
+        if on_departure:
+            departed += quantity
+        if is_issue and (last_issue is None or action_date > last_issue):
+            last_issue = action_date
+        expected[(cycle_id, asset_id)] = (held + sign * quantity, departed, last_issue)
+    return {key: value for key, value in expected.items() if value[0] or value[1]}
+
+
+def test_holdings_match_history_replay_through_departure(app, admin_client):
+    from models import db, Asset, EmploymentCycle
+    from routes.asset.core import rebuild_asset_holdings
+    with app.app_context():
+        assert _holdings() == _replay()
+        cycle_id = db.session.query(func.max(EmploymentCycle.id)).filter_by(status='在职').scalar()
+        first, second = [a.id for a in Asset.query.filter(Asset.stock_quantity >= 5).order_by(Asset.id).limit(2)]
+
+    for path, form in [
+        (f'/asset/issue/{first}', {'user_id': cycle_id, 'quantity': 3}),
+        (f'/asset/issue/{second}', {'user_id': cycle_id, 'quantity': 1}),
+        (f'/asset/return/{first}', {'user_id': cycle_id, 'quantity': 1}),
+        (f'/asset/issue/{first}', {'user_id': cycle_id, 'quantity': 2, 'note': '补发'}),
+    ]:
+        assert admin_client.post(path, data=form).status_code == 302
+    with app.app_context():
+        held = _holdings()
+        assert held[(cycle_id, first)][0] >= 4 and held[(cycle_id, second)][0] >= 1
+        assert held == _replay()
+
+    # 离职：未归还的全部自动归还，净持有清零、离职归还数量累加
+    resp = admin_client.post(f'/hr/departure/{cycle_id}', data={
+        'confirm_return': 'on', 'settle_utilities': 'on', 'departure_date': date.today().isoformat()})
+    assert resp.status_code == 302
+    with app.app_context():
+        after = _holdings()
+        for asset_id in (first, second):
+            assert after[(cycle_id, asset_id)][:2] == (0, held[(cycle_id, asset_id)][0])
+        assert after == _replay()
+
+        # 全量重建与增量维护的结果相同
+        rebuild_asset_holdings()
+        assert _holdings() == after
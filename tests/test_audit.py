@@ -0,0 +1,77 @@
+#D:\cailu\cailutebao\tests\test_audit.py
+# 审计日志：随调用方事务提交/回滚，审计写入失败不影响调用方的修改
+import pytest
+from flask_login import login_user
+from sqlalchemy import event, func
+
+import utils
+
+
+@pytest.fixture
+def commit_count(app):
+    from models import db
+    with app.app_context():
+        engine = db.engine
+    counter = {'commits': 0}
+
+    def _on_commit(conn):
+        counter['commits'] += 1
+
+    event.listen(engine, 'commit', _on_commit)
+    yield counter
+    event.remove(engine, 'commit', _on_commit)
+
+
+@pytest.fixture
+def as_admin(app):
+    """带请求上下文并以管理员登录，供直接调用 log_action"""
+    from models import User
+    with app.test_request_context():
+        login_user(User.query.filter_by(username='admin').one())
+        yield
+
+
+def _audit_rows():
+    from models import db, OperationLog, NotificationOutbox
+    return db.session.query(func.count(OperationLog.id)).scalar(), db.session.query(func.count(NotificationOutbox.id)).scalar()
+
+
+def test_operation_commits_once(app, admin_client, commit_count):
+    from models import db, FundsRecord, OperationLog
+    with app.app_context():
+        record_id = db.session.query(func.max(FundsRecord.id)).scalar()
+    resp = admin_client.post(f'/fund/delete/{record_id}')
+    assert resp.status_code == 302
+    # 删除、余额重算、审计日志、通知事件入箱：一次提交
+    assert commit_count['commits'] == 1
+    with app.app_context():
+        assert db.session.get(FundsRecord, record_id) is None
+        assert OperationLog.query.filter_by(target_type='FundsRecord', target_id=record_id, action_type='财务删除').count() == 1
+
+
+def test_audit_rolls_back_with_caller(as_admin):
+    from models import db
+    before = _audit_rows()
+    db.session.commit()
+    # 调用方尚未写入任何数据时写审计，SAVEPOINT 也必须嵌套在调用方事务里
+    utils.log_action('测试', 'Test', 1, '回滚测试')
+    db.session.rollback()
+    assert _audit_rows() == before
+
+
+def test_failed_audit_keeps_caller_changes(as_admin, monkeypatch):
+    from models import db, ShiftPost
+    before = _audit_rows()
+    db.session.add(ShiftPost(name='审计失败测试岗'))
+    db.session.flush()
+    utils.notice_hub.publish_on_commit([1])
+
+    def _broken(*args, **kwargs):
+        raise RuntimeError('outbox unavailable')
+    monkeypatch.setattr(utils, 'enqueue_notifications', _broken)
+    utils.log_action('测试', 'Test', 1, '失败测试')
+    # SAVEPOINT 回滚不能丢掉调用方登记的提交后动作
+    assert db.session.info.get('notice_publish') == [[1]]
+    db.session.commit()
+    assert ShiftPost.query.filter_by(name='审计失败测试岗').count() == 1
+    assert _audit_rows() == before
@@ -0,0 +1,60 @@
+#D:\cailu\cailutebao\tests\test_bench_endpoints.py
+# 热点接口基准（pytest-benchmark）：耗时与保存的基线对比，查询数按预算断言
+#   保存基线：python -m pytest tests/test_bench_endpoints.py --benchmark-save=baseline
+#   对比基线：python -m pytest tests/test_bench_endpoints.py --benchmark-compare --benchmark-compare-fail=median:20%
+from datetime import date
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+ROUNDS = 20
+# 每次请求的 SQL 条数上限（conftest 合成库上的实测值）；超出即视为 N+1 回归，优化后同步调低
+QUERY_BUDGET = {
+    'index': 13, 'hr_list': 3, 'has_new_notice': 3, 'get_matrix_data': 7, 'leave_list': 45,
+    'trip_list': 47, 'fund_add': 9, 'trip_add': 8, 'hr_detail': 13, 'asset_detail': 9,
+}
+
+
+def _bench_targets():
+    """(名称, 方法, 路径, 表单)；路径里的 ID 取自当前库中的真实数据"""
+    from models import EmploymentCycle, Asset
+    cycle = EmploymentCycle.query.filter_by(status='在职').order_by(EmploymentCycle.id).first()
+    asset = Asset.query.order_by(Asset.id).first()
+    trip_ids = [cid for (cid,) in EmploymentCycle.query.with_entities(EmploymentCycle.id)
+                .filter_by(status='在职').order_by(EmploymentCycle.id).limit(3)]
+    today = date.today()
+    return {
+        'index': ('GET', '/', None),
+        'hr_list': ('GET', '/hr/list', None),
+        'has_new_notice': ('GET', '/notification/has_new_notice', None),
+        'get_matrix_data': ('GET', f"/scheduling/api/get_matrix_data?month={today:%Y-%m}", None),
+        'leave_list': ('GET', '/leave/list', None),
+        'trip_list': ('GET', '/trip/list', None),
+        'fund_add': ('POST', '/fund/add', {'date': today.isoformat(), 'payer': '特保队', 'item': '基准测试', 'amount': '1', 'note': ''}),
+        'trip_add': ('POST', '/trip/add', {'destination': '基准测试', 'start_date': today.isoformat(), 'end_date': '', 'user_ids': trip_ids}),
+        'hr_detail': ('GET', f'/hr/detail/{cycle.id_card}', None),
+        'asset_detail': ('GET', f'/asset/detail/{asset.id}', None),
+    }
+
+
+@pytest.fixture(scope='module')
+def bench_targets(app):
+    with app.app_context():
+        return _bench_targets()
+
+
+@pytest.mark.parametrize('name', list(QUERY_BUDGET))
+def test_hot_endpoint(name, benchmark, bench_targets, admin_client, sql_capture):
+    method, path, form = bench_targets[name]
+    benchmark.group = 'hot-endpoints'
+    resp = benchmark.pedantic(admin_client.open, args=(path,), kwargs={'method': method, 'data': form},
+                              rounds=ROUNDS, warmup_rounds=1, iterations=1)
+    assert resp.status_code < 400
+
+    # 查询数不随耗时抖动，单独请求一次计数
+    sql_capture.clear()
+    admin_client.open(path, method=method, data=form)
+    queries = len(sql_capture)
+    benchmark.extra_info['queries'] = queries
+    assert queries <= QUERY_BUDGET[name]
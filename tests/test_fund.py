@@ -0,0 +1,75 @@
+#D:\cailu\cailutebao\tests\test_fund.py
+# 资金流水：新增/编辑/删除后的增量余额重算与 verify_balances 的全量前缀和一致
+import sqlite3
+from datetime import timedelta
+
+import pytest
+
+
+def _verify(app):
+    from routes.fund import verify_balances
+    with app.app_context():
+        return verify_balances()
+
+
+def _middle_date(app):
+    from models import db, FundsRecord
+    with app.app_context():
+        dates = [d for (d,) in db.session.query(FundsRecord.date).order_by(FundsRecord.date)]
+    assert len(dates) > 10
+    return dates[len(dates) // 2]
+
+
+@pytest.fixture(params=['update_from', 'row_by_row'])
+def balance_strategy(request, monkeypatch):
+    """两条重算路径都要覆盖：UPDATE ... FROM（SQLite >= 3.33）与旧版逐行更新"""
+    if request.param == 'row_by_row':
+        monkeypatch.setattr(sqlite3, 'sqlite_version_info', (3, 32, 0))
+    return request.param
+
+
+def test_incremental_recalc_matches_full_replay(app, admin_client, balance_strategy):
+    from models import db, FundsRecord
+    assert _verify(app)['mismatched'] == 0
+    middle = _middle_date(app)
+
+    # 补录一条历史日期的记录：其后的余额全部顺延
+    admin_client.post('/fund/add', data={'date': middle.date().isoformat(), 'payer': '特保队',
+                                          'item': f'补录-{balance_strategy}', 'amount': '-123.45', 'note': ''})
+    with app.app_context():
+        record_id = FundsRecord.query.filter_by(item=f'补录-{balance_strategy}').one().id
+    assert _verify(app)['mismatched'] == 0
+
+    # 编辑：日期提前、金额改变，从较早的日期起重算
+    earlier = (middle - timedelta(days=60)).date().isoformat()
+    admin_client.post(f'/fund/edit/{record_id}', data={'date': earlier, 'payer': '特保队',
+                                                       'item': f'补录-{balance_strategy}', 'amount': '88', 'note': ''})
+    assert _verify(app)['mismatched'] == 0
+
+    admin_client.post(f'/fund/delete/{record_id}')
+    result = _verify(app)
+    assert result['mismatched'] == 0
+    with app.app_context():
+        assert db.session.get(FundsRecord, record_id) is None
+
+
+def test_recalc_only_rewrites_from_affected_date(app, admin_client):
+    from models import db, FundsRecord
+    from routes.fund import verify_balances
+    middle = _middle_date(app)
+    with app.app_context():
+        early = FundsRecord.query.filter(FundsRecord.date < middle).order_by(FundsRecord.date).first()
+        early_id, early_balance = early.id, early.balance
+        early.balance = early_balance + 1000
+        db.session.commit()
+
+    admin_client.post('/fund/add', data={'date': middle.date().isoformat(), 'payer': '特保队',
+                                          'item': '增量重算', 'amount': '10', 'note': ''})
+    # 受影响日期之前的记录不被改写：人为写坏的那条仍是唯一的不一致
+    result = _verify(app)
+    assert result['mismatched'] == 1
+    assert result['first_mismatch'][0] == early_id
+
+    with app.app_context():
+        assert verify_balances(repair=True)['repaired']
+    assert _verify(app)['mismatched'] == 0
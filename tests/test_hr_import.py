@@ -0,0 +1,65 @@
+#D:\cailu\cailutebao\tests\test_hr_import.py
+# 花名册批量导入：新账号在导入时即写入真实密码哈希
+import random
+from datetime import date
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+from synthetic import _id_card
+
+
+@pytest.fixture
+def new_id_cards():
+    used = set()
+    rng = random.Random()
+    return lambda n: [_id_card(rng, used)[0] for _ in range(n)]
+
+
+def import_roster(client, rows):
+    """rows: [{'姓名', '身份证号码', ...}]，上传为 xlsx 并返回响应"""
+    df = pd.DataFrame([dict({'手机号': '13800000000', '入职日期': date.today().isoformat(), '状态': '在职'}, **row)
+                       for row in rows])
+    buf = BytesIO()
+    df.to_excel(buf, index=False)
+    buf.seek(0)
+    return client.post('/hr/import', data={'file': (buf, 'roster.xlsx')}, content_type='multipart/form-data')
+
+
+def test_imported_account_gets_real_hash(app, admin_client, new_id_cards):
+    from models import User
+    id_card, = new_id_cards(1)
+    resp = import_roster(admin_client, [{'姓名': '导入测试', '身份证号码': id_card}])
+    assert resp.status_code == 302
+    with app.app_context():
+        user = User.query.filter_by(username=id_card).one()
+        assert user.password_hash != User.INITIAL_PASSWORD_MARK
+        assert user.check_password(id_card[-6:])
+    resp = app.test_client().post('/login', data={'username': id_card, 'password': id_card[-6:]})
+    assert resp.status_code == 302 and '/login' not in resp.headers['Location']
+
+
+def test_legacy_marker_is_rehashed_not_accepted(app, new_id_cards):
+    from models import db, User
+    from routes.hr.import_export import hash_legacy_initial_passwords
+    id_card, = new_id_cards(1)
+    with app.app_context():
+        db.session.add(User(username=id_card, name='旧导入', role='member', password_hash=User.INITIAL_PASSWORD_MARK))
+        db.session.commit()
+        # 占位值不是哈希，不能再凭身份证后6位明文登录
+        assert not User.query.filter_by(username=id_card).one().check_password(id_card[-6:])
+        assert hash_legacy_initial_passwords() == 1
+        assert User.query.filter_by(username=id_card).one().check_password(id_card[-6:])
+
+
+def test_imported_manager_receives_audit_notices(app, admin_client, new_id_cards):
+    from models import User
+    from utils import get_manager_user_ids
+    id_card, = new_id_cards(1)
+    with app.app_context():
+        get_manager_user_ids()  # 先填充缓存，导入（Core 批量插入）必须使其失效
+    import_roster(admin_client, [{'姓名': '导入领班', '身份证号码': id_card, '职务': '领班'}])
+    with app.app_context():
+        user_id = User.query.filter_by(username=id_card).one().id
+        assert user_id in get_manager_user_ids()
@@ -0,0 +1,124 @@
+#D:\cailu\cailutebao\tests\test_notification.py
+# 通知：未读计数表与通知表保持一致（新增、已读、全部已读、数据保留分批删除）；游标分页
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def member(app):
+    """新建一个普通账号并登录，返回 (用户ID, 客户端)"""
+    from models import db, User
+    username = uuid.uuid4().hex[:18]
+    with app.app_context():
+        user = User(username=username, name='通知测试', role='member')
+        user.set_password('test-pass')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    resp = client.post('/login', data={'username': username, 'password': 'test-pass'})
+    assert resp.status_code == 302
+    return user_id, client
+
+
+def _counts(user_id):
+    """(计数表中的未读数, 通知表实际未读数)"""
+    from models import db, Notification, NotificationCounter
+    db.session.expire_all()
+    counter = db.session.get(NotificationCounter, user_id)
+    actual = Notification.query.filter_by(user_id=user_id, is_read=False).count()
+    return (counter.unread_count if counter else None), actual
+
+
+def _send(user_id, n, title='计数测试'):
+    from models import db
+    utils.enqueue_notifications([('notice', {'title': f'{title}{i}', 'content': title, 'user_ids': [user_id]})
+                                 for i in range(n)])
+    db.session.commit()
+    utils.deliver_notification_outbox()
+
+
+def test_unread_counter_follows_add_read_and_read_all(app, member):
+    from models import Notification
+    user_id, client = member
+    with app.app_context():
+        _send(user_id, 3)
+        assert _counts(user_id) == (3, 3)
+        _send(user_id, 2)
+        assert _counts(user_id) == (5, 5)
+        first = Notification.query.filter_by(user_id=user_id).order_by(Notification.id).first().id
+
+    client.get(f'/notification/read/{first}')
+    with app.app_context():
+        assert _counts(user_id) == (4, 4)
+    # 重复标记已读不再扣减
+    client.get(f'/notification/read/{first}')
+    with app.app_context():
+        assert _counts(user_id) == (4, 4)
+    assert client.get('/notification/unread_count').get_json()['unread_count'] == 4
+
+    client.post('/notification/read_all')
+    with app.app_context():
+        assert _counts(user_id) == (0, 0)
+    assert client.get('/notification/unread_count').get_json()['unread_count'] == 0
+
+
+def test_retention_batches_release_unread_counts(app, member):
+    from models import db, Notification, NotificationCounter
+    user_id, _ = member
+    with app.app_context():
+        _send(user_id, 2, title='未过期')
+        # 过期通知跨多个批次，已读/未读交错
+        old = datetime.now() - timedelta(days=400)
+        db.session.add_all(Notification(user_id=user_id, title=f'过期{i}', content='过期', is_read=bool(i % 2), created_at=old)
+                           for i in range(7))
+        db.session.commit()
+        utils.add_unread_counts([user_id] * 4)
+        db.session.commit()
+        assert _counts(user_id) == (6, 6)
+
+        result = utils.run_retention(['notifications'], batch=2, pause=0, vacuum=False)
+        assert result['notifications']['batches'] >= 4
+        assert _counts(user_id) == (2, 2)
+        # 其他用户的计数同样不受批次删除影响
+        for counter in NotificationCounter.query:
+            assert counter.unread_count == Notification.query.filter_by(user_id=counter.user_id, is_read=False).count()
+
+
+def test_keyset_pages_have_no_gaps_or_duplicates(app, member):
+    from flask import template_rendered
+    from models import db, Notification
+    from routes.notification import NOTICE_PAGE_SIZE
+    user_id, client = member
+    with app.app_context():
+        # 同一时间戳的通知跨页出现，分页必须靠 id 打破平局
+        base = datetime.now() - timedelta(days=1)
+        stamps = [base - timedelta(minutes=i // 4) for i in range(NOTICE_PAGE_SIZE * 2 + 7)]
+        db.session.add_all(Notification(user_id=user_id, title=f'分页{i}', content='分页', created_at=t)
+                           for i, t in enumerate(stamps))
+        db.session.commit()
+        expected = [n.id for n in Notification.query.filter_by(user_id=user_id)
+                    .order_by(Notification.created_at.desc(), Notification.id.desc())]
+
+    pages = []
+    def _record(sender, template, context, **extra):
+        pages.append(([n.id for n in context['notifications']], context['next_before']))
+    template_rendered.connect(_record, app)
+    try:
+        seen, before = [], None
+        while True:
+            client.get('/notification/list', query_string={'before': before} if before else None)
+            ids, before = pages[-1]
+            assert len(ids) <= NOTICE_PAGE_SIZE
+            seen.extend(ids)
+            if before is None:
+                break
+            assert before == ids[-1]
+    finally:
+        template_rendered.disconnect(_record, app)
+    assert seen == expected
+    assert len(pages) == 3
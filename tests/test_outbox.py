@@ -0,0 +1,114 @@
+#D:\cailu\cailutebao\tests\test_outbox.py
+# 通知发件箱：删除即认领、失败计数与死信、投递后写通知并累加未读计数
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+        from models import db
+        db.session.remove()
+
+
+def _enqueue(kind, payload):
+    from models import db, NotificationOutbox
+    utils.enqueue_notifications([(kind, payload)])
+    db.session.commit()
+    return db.session.query(db.func.max(NotificationOutbox.id)).scalar()
+
+
+def _notice(title):
+    from models import User
+    user_id = User.query.filter_by(username='admin').one().id
+    return user_id, {'title': title, 'content': title, 'user_ids': [user_id]}
+
+
+def _unread(user_id):
+    from models import db, NotificationCounter
+    counter = db.session.get(NotificationCounter, user_id)
+    return counter.unread_count if counter else 0
+
+
+def test_delivery_writes_notifications_and_unread_count(ctx):
+    from models import db, Notification, NotificationOutbox
+    user_id, payload = _notice('发件箱投递测试')
+    unread = _unread(user_id)
+    event_id = _enqueue('notice', payload)
+    assert utils.deliver_notification_outbox() >= 1
+    assert db.session.get(NotificationOutbox, event_id) is None
+    assert Notification.query.filter_by(user_id=user_id, title='发件箱投递测试').count() == 1
+    assert _unread(user_id) == unread + 1
+
+
+def test_claim_conflict_abandons_batch(ctx, monkeypatch):
+    from models import db, Notification, NotificationOutbox
+    from sqlalchemy import delete
+    _, payload = _notice('发件箱认领测试')
+    first = _enqueue('notice', payload)
+    second = _enqueue('notice', payload)
+    real_manager_ids = utils.get_manager_user_ids
+
+    def _claimed_elsewhere():
+        # 读到本批之后、认领之前，另一个投递者先删掉了其中一条
+        db.session.execute(delete(NotificationOutbox).where(NotificationOutbox.id == first))
+        return real_manager_ids()
+    monkeypatch.setattr(utils, 'get_manager_user_ids', _claimed_elsewhere)
+    assert utils.deliver_notification_outbox() == 0
+    assert Notification.query.filter_by(title='发件箱认领测试').count() == 0
+    # 整批回滚，事件仍在队列里，下一次正常投递且只投递一次
+    assert db.session.get(NotificationOutbox, second) is not None
+    monkeypatch.setattr(utils, 'get_manager_user_ids', real_manager_ids)
+    utils.deliver_notification_outbox()
+    assert Notification.query.filter_by(title='发件箱认领测试').count() == 2
+    assert NotificationOutbox.query.filter(NotificationOutbox.id.in_([first, second])).count() == 0
+
+
+def test_batch_failure_counts_attempt_and_retries(ctx, monkeypatch):
+    from models import db, Notification, NotificationOutbox
+    _, payload = _notice('发件箱重试测试')
+    event_id = _enqueue('notice', payload)
+
+    def _broken(user_ids):
+        raise RuntimeError('counter unavailable')
+    monkeypatch.setattr(utils, 'add_unread_counts', _broken)
+    assert utils.deliver_notification_outbox() == 0
+    event = db.session.get(NotificationOutbox, event_id)
+    assert (event.attempts, event.dead_at) == (1, None)
+    assert 'counter unavailable' in event.last_error
+    assert Notification.query.filter_by(title='发件箱重试测试').count() == 0
+
+    monkeypatch.undo()
+    utils.deliver_notification_outbox()
+    assert Notification.query.filter_by(title='发件箱重试测试').count() == 1
+
+
+def test_failing_event_becomes_dead_letter_and_is_pruned(ctx):
+    from models import db, NotificationOutbox
+    event_id = _enqueue('bogus', {})
+    for attempt in range(1, utils.OUTBOX_MAX_ATTEMPTS + 1):
+        utils.deliver_notification_outbox()
+        event = db.session.get(NotificationOutbox, event_id)
+        assert event.attempts == attempt
+    assert event.dead_at is not None
+    assert utils._outbox_stats['dead'] >= 1
+    assert 'cailu_notification_outbox_dead_letters' in utils.render_metrics()
+
+    # 死信不再重试
+    utils.deliver_notification_outbox()
+    assert db.session.get(NotificationOutbox, event_id).attempts == utils.OUTBOX_MAX_ATTEMPTS
+
+    # 数据保留只清理过期死信，待投递事件不受影响
+    pending_id = _enqueue('bogus', {})
+    event.dead_at = datetime.now() - timedelta(days=365)
+    db.session.commit()
+    result = utils.run_retention(['notification_outbox'], pause=0, vacuum=False)
+    assert result['notification_outbox']['deleted'] >= 1
+    assert db.session.get(NotificationOutbox, event_id) is None
+    assert db.session.get(NotificationOutbox, pending_id) is not None
+    db.session.delete(db.session.get(NotificationOutbox, pending_id))
+    db.session.commit()
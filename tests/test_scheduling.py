@@ -0,0 +1,106 @@
+#D:\cailu\cailutebao\tests\test_scheduling.py
+# 排班矩阵接口：查询次数不随员工人数/历史排班增长；批量编辑接口逐条返回结果
+from datetime import date
+
+import pytest
+
+from routes.scheduling import _month_bounds
+
+
+def _shift_schedule_queries(statements):
+    return [(sql, params) for sql, params in statements if 'FROM shift_schedules' in sql]
+
+
+def test_matrix_uses_one_month_query(admin_client, sql_capture, this_month):
+    resp = admin_client.get(f'/scheduling/api/get_matrix_data?month={this_month}')
+    assert resp.status_code == 200
+    matrix = resp.get_json()['matrix']
+
+    # 排班只查一次（当月日期区间），不再按员工懒加载全部历史排班
+    schedule_queries = _shift_schedule_queries(sql_capture)
+    assert len(schedule_queries) == 1
+    month_start, month_end = _month_bounds(this_month)
+    assert schedule_queries[0][1] == (month_start.isoformat(), month_end.isoformat())
+    # 当前用户、在职员工、岗位、排班、出差（含参与人）、请假：固定条数，与在职人数无关
+    assert len(matrix) > 7
+    assert len(sql_capture) <= 7
+
+
+@pytest.mark.parametrize('month', ['2024', '2024-13', 'abcd-ef', '2024-01-05', ''])
+def test_matrix_rejects_malformed_month(admin_client, month):
+    resp = admin_client.get(f'/scheduling/api/get_matrix_data?month={month}')
+    assert resp.status_code == 400
+
+
+def test_batch_reports_each_op_result(app, admin_client):
+    from models import db, EmploymentCycle, ShiftPost, ShiftSchedule
+    with app.app_context():
+        a, b, c = [cid for (cid,) in db.session.query(EmploymentCycle.id).filter_by(status='在职').order_by(EmploymentCycle.id).limit(3)]
+        post_id = ShiftPost.query.first().id
+        # 已有记录（只有加班）：set_shift 只改岗位，不碰加班时长
+        db.session.add(ShiftSchedule(employee_id=c, date=date(2099, 3, 3), hours=4.0))
+        db.session.commit()
+
+    ops = [
+        {'op': 'set_shift', 'user_id': a, 'date': '2099-03-01', 'post_id': post_id, 'shift_type': '白'},
+        {'op': 'set_type', 'user_id': a, 'date': '2099-03-01', 'shift_type': '夜'},
+        {'op': 'set_overtime', 'user_id': a, 'date': '2099-03-01', 'hours': '2.5'},
+        {'op': 'delete_shift', 'user_id': a, 'date': '2099-03-01'},    # 有加班：只清空岗位
+        {'op': 'clear_overtime', 'user_id': a, 'date': '2099-03-01'},  # 岗位已空：删除整条
+        {'op': 'set_type', 'user_id': b, 'date': '2099-03-01', 'shift_type': '白'},
+        {'op': 'set_shift', 'user_id': b, 'date': '2099-03-01', 'post_id': 999999},
+        {'op': 'bogus', 'user_id': b, 'date': '2099-03-01'},
+        {'op': 'set_overtime', 'user_id': b, 'date': '2099-03-02', 'hours': 3},
+        {'op': 'delete', 'user_id': b, 'date': '2099-03-02'},
+        {'op': 'set_shift', 'user_id': b, 'date': '2099-03-02', 'post_id': post_id, 'shift_type': '白'},  # 同批先删后建
+        {'op': 'set_shift', 'user_id': b, 'date': '2099-13-40', 'post_id': post_id},
+        {'op': 'set_shift', 'user_id': c, 'date': '2099-03-03', 'post_id': post_id, 'shift_type': '夜'},
+    ]
+    body = admin_client.post('/scheduling/api/batch', json={'ops': ops}).get_json()
+    assert body['success']
+    results = body['results']
+    assert [r['index'] for r in results] == list(range(len(ops)))
+    assert [r['success'] for r in results] == [True] * 5 + [False] * 3 + [True] * 3 + [False, True]
+    assert body['applied'] == 9
+    assert results[5]['message'] == '该日期没有排班'
+    assert results[6]['message'] == '岗位不存在'
+    assert results[7]['message'].startswith('参数错误') and results[11]['message'].startswith('参数错误')
+    # 同一单元格的连续操作落在同一条记录上，删除后 shift_id 为空
+    assert results[0]['shift_id'] == results[1]['shift_id'] == results[2]['shift_id'] == results[3]['shift_id']
+    assert results[4]['shift_id'] is None and results[9]['shift_id'] is None
+    assert results[10]['shift_id'] is not None
+
+    with app.app_context():
+        cells = {(s.employee_id, s.date.isoformat()): (s.id, s.post_id, s.shift_type, s.hours)
+                 for s in ShiftSchedule.query.filter(ShiftSchedule.date.between(date(2099, 3, 1), date(2099, 3, 3)))}
+    assert cells == {
+        (b, '2099-03-02'): (results[10]['shift_id'], post_id, '白', None),
+        (c, '2099-03-03'): (results[12]['shift_id'], post_id, '夜', 4.0),
+    }
+
+
+# ==================== 执行计划回归（ix_shift_schedules_date / uq_shift_schedules_employee_date） ====================
+def _assert_index_search(plan, index_name):
+    assert not any(step.startswith('SCAN shift_schedules') for step in plan), plan
+    assert any(step.startswith(f'SEARCH shift_schedules USING INDEX {index_name}') for step in plan), plan
+
+
+def test_month_filter_searches_date_index(admin_client, sql_capture, query_plan, this_month):
+    admin_client.get(f'/scheduling/api/get_matrix_data?month={this_month}')
+    (sql, params), = _shift_schedule_queries(sql_capture)
+    _assert_index_search(query_plan(sql, params), 'ix_shift_schedules_date')
+
+
+def test_cell_lookup_searches_unique_index(app, admin_client, sql_capture, query_plan):
+    from models import EmploymentCycle, ShiftPost
+    with app.app_context():
+        employee_id = EmploymentCycle.query.filter_by(status='在职').first().id
+        post_id = ShiftPost.query.first().id
+    resp = admin_client.post('/scheduling/save_shift', json={
+        'date': '2099-01-15', 'user_id': employee_id, 'post_id': post_id, 'shift_type': '白'})
+    assert resp.get_json()['success']
+    lookups = [(sql, params) for sql, params in _shift_schedule_queries(sql_capture)
+               if 'shift_schedules.employee_id = ?' in sql and 'shift_schedules.date = ?' in sql]
+    assert lookups
+    for sql, params in lookups:
+        _assert_index_search(query_plan(sql, params), 'uq_shift_schedules_employee_date')
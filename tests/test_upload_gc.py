@@ -0,0 +1,70 @@
+#D:\cailu\cailutebao\tests\test_upload_gc.py
+# 孤立文件清理：磁盘文件 - 登记表 = 孤立文件；保护期内的文件只记入 pending，下次增量运行再检查
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import utils
+
+GRACE = 3600
+
+
+def _touch(base, rel, age=0):
+    path = os.path.join(base, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    if age:
+        ts = time.time() - age
+        os.utime(path, (ts, ts))
+    return path
+
+
+def test_orphans_outside_grace_period_are_recycled(app, monkeypatch):
+    import config
+    from models import db, FileReference
+    monkeypatch.setattr(config, 'UPLOAD_GC_GRACE', GRACE)
+    base = config.UPLOAD_BASE_DIR
+    folder = f'uploads/gc/{uuid.uuid4().hex[:8]}'
+    kept = _touch(base, f'{folder}/registered.jpg', age=2 * GRACE)
+    orphan = _touch(base, f'{folder}/orphan.jpg', age=2 * GRACE)
+    fresh = _touch(base, f'{folder}/fresh.jpg')
+    safe = _touch(base, f'{folder}/default_avatar.jpg', age=2 * GRACE)
+    old = datetime.now() - timedelta(seconds=2 * GRACE)
+    with app.app_context():
+        utils.register_file_reference(f'{folder}/Registered.jpg', 'gc')
+        # 文件已不存在的登记：过了保护期的清除，刚登记的保留（可能是尚未写完的上传）
+        db.session.add_all([FileReference(path=f'{folder}/gone-old.jpg', module='gc', created_at=old),
+                            FileReference(path=f'{folder}/gone-new.jpg', module='gc')])
+        db.session.commit()
+
+    with app.app_context():
+        stats = utils.cleanup_isolated_files(full=True)
+    assert stats['mode'] == 'full'
+    assert os.path.exists(kept) and os.path.exists(fresh) and os.path.exists(safe)
+    assert not os.path.exists(orphan)
+    assert stats['pending'] >= 1 and stats['pruned'] >= 1
+    with app.app_context():
+        paths = {p for (p,) in db.session.query(FileReference.path).filter(FileReference.path.like(f'{folder}/%'))}
+    assert paths == {f'{folder}/registered.jpg', f'{folder}/gone-new.jpg'}
+
+    # 增量运行：目录没有变化，但上次保护期内的文件仍会复查；过期后被回收
+    ts = time.time() - 2 * GRACE
+    os.utime(fresh, (ts, ts))
+    with app.app_context():
+        stats = utils.cleanup_isolated_files()
+    assert stats['mode'] == 'incremental'
+    assert not os.path.exists(fresh)
+    assert os.path.exists(kept)
+
+    # 新目录里的文件：登记的保留，未登记且过期的回收；只检查有变化的目录（新目录及其父目录）
+    late_orphan = _touch(base, f'{folder}/late/orphan.jpg', age=2 * GRACE)
+    late_kept = _touch(base, f'{folder}/late/kept.jpg', age=2 * GRACE)
+    with app.app_context():
+        utils.register_file_reference(f'{folder}/late/kept.jpg', 'gc')
+        db.session.commit()
+        stats = utils.cleanup_isolated_files()
+    assert stats['mode'] == 'incremental'
+    assert stats['checked'] == 3 < stats['files']
+    assert not os.path.exists(late_orphan) and os.path.exists(late_kept)
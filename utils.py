@@ -1,7 +1,8 @@
 #D:\cailu\cailutebao\utils.py
 # 系统通用工具函数
 __all__ = [
-    'validate_id_card', 'validate_phone', 'parse_date', 'format_date', 'today_str',
+    'validate_id_card', 'validate_id_cards', 'validate_phone', 'parse_date', 'parse_dates',
+    'format_date', 'today_str',
     'get_unreturned_assets', 'register_module_permissions', 'PermissionManager'
 ]
 
@@ -11,13 +12,19 @@ import shutil
 import time
 import threading
 import re
+import sys
 import json
+import traceback
+import logging
 from datetime import datetime, timedelta, date,time as dt_time
 from typing import Union, Optional
-from flask import current_app, flash, redirect, url_for
+from flask import current_app, flash, redirect, url_for, g, has_request_context, request, session
 from flask_login import current_user
 from functools import wraps
+import numpy as np
 import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from werkzeug.utils import secure_filename
 
 # ==================== 身份证相关 ====================
@@ -25,7 +32,8 @@ def validate_id_card(id_card: str) -> bool:
     id_card = id_card.strip()  
     if len(id_card) != 18:
         return False
-    if not id_card[:17].isdigit():
+    # isdigit() 也接受全角等 Unicode 数字，这里只认 ASCII 0-9
+    if not re.fullmatch(r'[0-9]{17}', id_card[:17]):
         return False
     weights = [7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2]
     check_codes = '10X98765432'
@@ -33,6 +41,21 @@ def validate_id_card(id_card: str) -> bool:
     check_code = check_codes[total % 11]
     return id_card[-1].upper() == check_code
 
+_ID_WEIGHTS = np.array([7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2])
+_ID_CHECK_CODES = np.array(list('10X98765432'))
+
+def validate_id_cards(id_cards: pd.Series) -> np.ndarray:
+    """validate_id_card 的整列版本：一次性校验长度、数字位与校验码，返回布尔数组"""
+    s = id_cards.fillna('').astype(str).str.strip().str.upper()
+    ok = (s.str.len() == 18) & s.str[:17].str.fullmatch(r'[0-9]{17}').fillna(False).astype(bool)
+    result = np.zeros(len(s), dtype=bool)
+    if ok.any():
+        valid = s[ok]
+        digits = np.frombuffer(''.join(valid.str[:17]).encode('ascii'), dtype=np.uint8).reshape(-1, 17) - ord('0')
+        expected = _ID_CHECK_CODES[(digits.astype(np.int64) @ _ID_WEIGHTS) % 11]
+        result[ok.to_numpy()] = valid.str[17].to_numpy() == expected
+    return result
+
 def get_gender_from_id_card(id_card: str) -> str:
     if len(id_card) != 18:
         return ''
@@ -86,6 +109,33 @@ def parse_date(date_input) -> Optional[date]:
             pass
     return None
 
+def parse_dates(values: pd.Series) -> pd.Series:
+    """
+    parse_date 的整列版本：日期对象、Excel 序列号和常见格式整列解析，
+    只有剩余的少数特殊写法才逐个回退到 parse_date。返回 date/None 组成的 Series。
+    """
+    result = pd.Series([None] * len(values), index=values.index, dtype=object)
+    if values.empty:
+        return result
+    converted = pd.to_datetime(values.where(values.map(lambda v: isinstance(v, (datetime, date)))), errors='coerce')
+    numeric = pd.to_numeric(values.where(values.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool))), errors='coerce')
+    converted = converted.fillna(pd.to_datetime(numeric, unit='D', origin='1899-12-30', errors='coerce'))
+
+    text = values.where(converted.isna()).astype(object).where(lambda s: s.notna(), None)
+    text = text.map(lambda v: str(v).strip() if v is not None else '')
+    for fmt in ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d', '%Y年%m月%d日'):
+        pending = converted.isna() & (text != '')
+        if not pending.any():
+            break
+        converted[pending] = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+
+    parsed = converted.notna()
+    result[parsed] = converted[parsed].dt.date
+    leftover = ~parsed & (text != '')
+    if leftover.any():
+        result[leftover] = values[leftover].map(parse_date)
+    return result
+
 def format_date(date_obj, fmt='%Y-%m-%d') -> str:
     if not date_obj:
         return ''
@@ -137,34 +187,69 @@ def get_unreturned_assets(cycle_id):
 # ==================== 权限管理 ====================
 class PermissionManager:
     ROLE_DEFAULT_PERMISSIONS = {
-        'admin': 'all',    
-        'member': ['base_view'] 
+        'admin': 'all',
+        'member': ['base_view']
     }
+    def __init__(self):
+        # 跨请求缓存：(user_id, version) -> 权限key集合；权限有变动时递增 version 使旧缓存整体失效
+        self._version = 0
+        self._user_keys_cache = {}
+        self._names_cache = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """权限分配或权限字典发生变化后调用，丢弃所有用户的权限缓存"""
+        with self._lock:
+            self._version += 1
+            self._user_keys_cache.clear()
+            self._names_cache = None
+
+    def _load_user_keys(self, user_id):
+        """当前请求内只取一次：g 快照 -> 版本化缓存 -> 一次联表查询"""
+        snapshot = getattr(g, '_perm_snapshot', None) if has_request_context() else None
+        if snapshot is not None and snapshot[0] == user_id:
+            return snapshot[1]
+        version = self._version
+        keys = self._user_keys_cache.get((user_id, version))
+        record_cache_access('permission_keys', keys is not None)
+        if keys is None:
+            from models import db, Permission, UserPermission
+            rows = db.session.query(Permission.key).join(
+                UserPermission, UserPermission.permission_id == Permission.id
+            ).filter(UserPermission.user_id == user_id).all()
+            keys = frozenset(r[0] for r in rows)
+            with self._lock:
+                # 查询期间版本已变则不回写，避免把旧数据写进新版本
+                if version == self._version:
+                    self._user_keys_cache[(user_id, version)] = keys
+        if has_request_context():
+            g._perm_snapshot = (user_id, keys)
+        return keys
+
+    def get_display_name(self, permission_key):
+        names = self._names_cache
+        if names is None:
+            from models import Permission
+            names = {p.key: p.name for p in Permission.query.all()}
+            self._names_cache = names
+        return names.get(permission_key, permission_key)
+
     def can(self, permission_key):
-        from models import Permission, UserPermission
         if not current_user or not current_user.is_authenticated:
             return False
         if current_user.role == 'admin':
             return True
-        perm_obj = Permission.query.filter_by(key=permission_key).first()
-        if perm_obj:
-            has_assigned = UserPermission.query.filter_by(
-                user_id=current_user.id,
-                permission_id=perm_obj.id
-            ).first()
-            if has_assigned:
-                return True
+        if permission_key in self._load_user_keys(current_user.id):
+            return True
         allowed_perms = self.ROLE_DEFAULT_PERMISSIONS.get(current_user.role, [])
         return 'all' in allowed_perms or permission_key in allowed_perms
-    
+
     def require(self, permission_key):
         def decorator(f):
             @wraps(f)
             def decorated_function(*args, **kwargs):
                 if not self.can(permission_key):
-                    from models import Permission
-                    perm_obj = Permission.query.filter_by(key=permission_key).first()
-                    display_name = perm_obj.name if perm_obj else permission_key
+                    display_name = self.get_display_name(permission_key)
                     flash(f'权限不足，缺少: {display_name}', 'danger')
                     return redirect(url_for('main.index'))
                 return f(*args, **kwargs)
@@ -175,81 +260,486 @@ perm = PermissionManager()
 def register_module_permissions(module, permissions):
     from models import Permission, db
     try:
+        existing_keys = {k for (k,) in db.session.query(Permission.key).filter(Permission.module == module)}
+        added = 0
         for action, name, description in permissions:
             key = f"{module}.{action}"
-            if not Permission.query.filter_by(key=key).first():
+            if key not in existing_keys:
                 new_p = Permission(
                     key=key, module=module, action=action,
                     name=name, description=description
                 )
                 db.session.add(new_p)
+                added += 1
         db.session.commit()
+        if added:
+            perm.invalidate()
     except Exception as e:
         db.session.rollback()
-        print(f"权限注册失败: {e}")
+        logging.error(f"权限注册失败: {e}")
+
+# ==================== 通知推送（SSE 广播） ====================
+class NoticeBroadcaster:
+    """
+    进程内广播：通知/待审核数量变化时递增版本号并唤醒等待中的 SSE 连接。
+    user_ids=None 表示全局变化（待审核人数、证件待审批），所有连接都需要重新计算。
+    """
+    def __init__(self, max_streams=8):
+        self.max_streams = max_streams
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._global_seq = 0
+        self._user_seq = {}
+        self._streams = 0
+
+    def publish(self, user_ids=None):
+        with self._cond:
+            self._seq += 1
+            if user_ids is None:
+                self._global_seq = self._seq
+            else:
+                for uid in user_ids:
+                    self._user_seq[uid] = self._seq
+            self._cond.notify_all()
+
+    def publish_on_commit(self, user_ids=None):
+        """登记到当前会话，事务提交成功后才真正广播，回滚则丢弃"""
+        from models import db
+        pending = db.session.info.setdefault('notice_publish', [])
+        pending.append(None if user_ids is None else list(user_ids))
+
+    def stamp(self, user_id):
+        return max(self._global_seq, self._user_seq.get(user_id, 0))
+
+    def wait(self, user_id, since, timeout):
+        """阻塞至该用户有新变化或超时，返回最新版本号"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.stamp(user_id) > since, timeout)
+            return self.stamp(user_id)
+
+    def try_open_stream(self):
+        with self._cond:
+            if self._streams >= self.max_streams:
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self):
+        with self._cond:
+            self._streams = max(0, self._streams - 1)
+
+notice_hub = NoticeBroadcaster(max_streams=int(os.getenv('CAILU_SSE_MAX_STREAMS', '8')))
+
+def _flush_notice_publish(session):
+    for user_ids in session.info.pop('notice_publish', []):
+        notice_hub.publish(user_ids)
+
+def _drop_notice_publish(session, previous_transaction):
+    # 只在最外层事务回滚时丢弃；SAVEPOINT（审计写入失败）回滚不影响调用方登记的提交后动作
+    if previous_transaction.parent is None:
+        session.info.pop('notice_publish', None)
+
+event.listen(Session, 'after_commit', _flush_notice_publish)
+event.listen(Session, 'after_soft_rollback', _drop_notice_publish)
+
+# ==================== 未读通知计数 ====================
+def add_unread_counts(receiver_ids):
+    """写入新通知后调用，receiver_ids 中每出现一次计数 +1；不提交，随调用方事务一起提交"""
+    from collections import Counter
+    from models import db, Notification, NotificationCounter
+    deltas = Counter(receiver_ids)
+    if not deltas:
+        return
+    db.session.flush()
+    existing = {uid for (uid,) in db.session.query(NotificationCounter.user_id)
+                .filter(NotificationCounter.user_id.in_(list(deltas)))}
+    by_delta = {}
+    for uid in existing:
+        by_delta.setdefault(deltas[uid], []).append(uid)
+    for delta, uids in by_delta.items():
+        NotificationCounter.query.filter(NotificationCounter.user_id.in_(uids)).update(
+            {NotificationCounter.unread_count: NotificationCounter.unread_count + delta},
+            synchronize_session=False
+        )
+    for uid in set(deltas) - existing:
+        # 首次出现的用户按实际未读数初始化（已包含刚 flush 的新通知）
+        count = Notification.query.filter_by(user_id=uid, is_read=False).count()
+        db.session.add(NotificationCounter(user_id=uid, unread_count=count))
+    notice_hub.publish_on_commit(deltas)
+
+def decrease_unread_count(user_id, delta=1):
+    from models import NotificationCounter
+    from sqlalchemy import func
+    NotificationCounter.query.filter_by(user_id=user_id).update(
+        {NotificationCounter.unread_count: func.max(NotificationCounter.unread_count - delta, 0)},
+        synchronize_session=False
+    )
+    notice_hub.publish_on_commit([user_id])
+
+def reset_unread_count(user_id):
+    from models import NotificationCounter
+    NotificationCounter.query.filter_by(user_id=user_id).update(
+        {NotificationCounter.unread_count: 0}, synchronize_session=False
+    )
+    notice_hub.publish_on_commit([user_id])
+
+def get_unread_notice_count(user_id):
+    """导航栏徽章、轮询接口使用：主键读取，计数行不存在时退回 COUNT"""
+    from models import db, Notification, NotificationCounter
+    counter = db.session.get(NotificationCounter, user_id)
+    if counter is not None:
+        return counter.unread_count
+    return Notification.query.filter_by(user_id=user_id, is_read=False).count()
+
+def rebuild_notification_counters():
+    """按通知表重新统计所有用户的未读数（启动时、批量生成通知后调用）"""
+    from models import db, Notification, NotificationCounter, User
+    from sqlalchemy import func
+    try:
+        counts = dict(db.session.query(Notification.user_id, func.count(Notification.id))
+                      .filter(Notification.is_read == False).group_by(Notification.user_id).all())
+        NotificationCounter.query.delete(synchronize_session=False)
+        for (uid,) in db.session.query(User.id).all():
+            db.session.add(NotificationCounter(user_id=uid, unread_count=counts.get(uid, 0)))
+        notice_hub.publish_on_commit()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"未读通知计数重建失败: {e}")
 
 # ==================== 审计日志（Audit Log）+通知 ====================
-def log_action(action_type, target_type, target_id, description, **kwargs):
+MANAGER_POSITIONS = ("队长", "副队长", "领班")
+_manager_cache = {'version': 0, 'ids': None}
+_manager_cache_lock = threading.Lock()
+
+def invalidate_manager_cache():
+    with _manager_cache_lock:
+        _manager_cache['version'] += 1
+        _manager_cache['ids'] = None
+
+def get_manager_user_ids():
+    """在职队长/副队长/领班对应的账号ID（审计通知的固定接收人），职位/状态/账号变化后失效"""
+    version, ids = _manager_cache['version'], _manager_cache['ids']
+    record_cache_access('manager_ids', ids is not None)
+    if ids is None:
+        from models import db, User, EmploymentCycle
+        ids = frozenset(uid for (uid,) in db.session.query(User.id).join(
+            EmploymentCycle, User.username == EmploymentCycle.id_card).filter(
+            EmploymentCycle.status == '在职', EmploymentCycle.position.in_(MANAGER_POSITIONS)))
+        with _manager_cache_lock:
+            if version == _manager_cache['version']:
+                _manager_cache['ids'] = ids
+    return ids
+
+def _collect_manager_changes(session, flush_context):
+    from models import User, EmploymentCycle
+    from sqlalchemy import inspect as sa_inspect
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, (User, EmploymentCycle)):
+            session.info['manager_cache_dirty'] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, EmploymentCycle):
+            attrs = ('position', 'status', 'id_card')
+        elif isinstance(obj, User):
+            attrs = ('username',)
+        else:
+            continue
+        state = sa_inspect(obj)
+        if any(state.attrs[a].history.has_changes() for a in attrs):
+            session.info['manager_cache_dirty'] = True
+            return
+
+def _collect_manager_bulk(orm_execute_state):
+    # query.update()/delete() 与 Core 的 __table__.insert()（花名册批量导入）都不经过 flush，按目标表判断
+    from models import User, EmploymentCycle
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and table.name in (User.__tablename__, EmploymentCycle.__tablename__):
+            orm_execute_state.session.info['manager_cache_dirty'] = True
+
+def _apply_manager_invalidation(session):
+    if session.info.pop('manager_cache_dirty', False):
+        invalidate_manager_cache()
+
+def _drop_manager_invalidation(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('manager_cache_dirty', None)
+
+event.listen(Session, 'after_flush', _collect_manager_changes)
+event.listen(Session, 'do_orm_execute', _collect_manager_bulk)
+event.listen(Session, 'after_commit', _apply_manager_invalidation)
+event.listen(Session, 'after_soft_rollback', _drop_manager_invalidation)
+
+def log_action(action_type, target_type, target_id, description, flush=True, **kwargs):
+    """
+    写审计日志，并把通知事件放入发件箱（后台线程投递给队长/副队长/领班及被操作人）。
+    不提交：随调用方事务一起提交（一次操作一次提交）。
+    被操作人（员工周期ID）：user_id / cycle_id 单个，cycle_ids 多个（一条日志，每个接收人一条通知）。
+    flush=True 时立即在 SAVEPOINT 中写入，失败只回滚审计部分，不影响调用方未提交的修改；
+    flush=False 时只登记，在调用方 commit 前统一写入（循环中多次调用时只查一次接收人）。
+    """
+    from models import db
+    from flask_login import current_user
+    if 'cycle_ids' in kwargs:
+        operated_ids = [int(cid) for cid in kwargs['cycle_ids'] if cid]
+    elif 'user_id' in kwargs:
+        operated_ids = [kwargs['user_id']]
+    elif 'cycle_id' in kwargs:
+        operated_ids = [kwargs['cycle_id']]
+    elif target_type == 'Employee':
+        operated_ids = [target_id]
+    else:
+        operated_ids = []
+    entry = {
+        'operator_id': current_user.id, 'operator_name': current_user.name,
+        'action_type': action_type, 'target_type': target_type, 'target_id': target_id,
+        'description': description, 'operated_ids': [cid for cid in operated_ids if cid], 'time': datetime.now(),
+    }
+    if flush:
+        _write_audit_entries(db.session, [entry])
+    else:
+        db.session.info.setdefault('audit_pending', []).append(entry)
+
+def _write_audit_entries(session, entries):
+    """审计行随调用方事务写入；通知只入发件箱一条事件，由后台线程展开投递"""
+    from models import OperationLog
+    from sqlalchemy import insert
+    # SAVEPOINT 依赖引擎显式 BEGIN（install_sqlite_savepoint_support），审计失败只回滚审计部分
     try:
-        from models import db, OperationLog, Notification, User, EmploymentCycle
-        from flask_login import current_user
-        new_log = OperationLog(
-            user_id=current_user.id,
-            action_type=action_type,
-            target_type=target_type,
-            target_id=target_id,
-            description=description
-        )
-        db.session.add(new_log)
-        operated_user_id = None
-        if 'user_id' in kwargs:
-            operated_user_id = kwargs['user_id']
-        elif 'cycle_id' in kwargs:
-            operated_user_id = kwargs['cycle_id']
-        elif target_type == 'Employee':
-            operated_user_id = target_id
-        receiver_ids = set()
-        managers = EmploymentCycle.query.filter(
-            EmploymentCycle.status == '在职',
-            EmploymentCycle.position.in_(["队长", "副队长", "领班"])
-        ).all()
-        for manager in managers:
-            manager_user = User.query.filter_by(username=manager.id_card).first()
-            if manager_user:
-                receiver_ids.add(manager_user.id)
-        operated_user_name = "未知用户"
-        if operated_user_id:
-            operated_emp = EmploymentCycle.query.get(operated_user_id)
-            if operated_emp:
-                operated_user_name = operated_emp.name
-                operated_user = User.query.filter_by(username=operated_emp.id_card).first()
-                if operated_user:
-                    receiver_ids.add(operated_user.id)
-        if receiver_ids:
-            notify_title = f"系统操作通知：{action_type}"
-            notify_content = f"""
-            <p>操作人：{current_user.name}</p>
-            <p>操作类型：{action_type}</p>
-            <p>被操作人：{operated_user_name}</p>
-            <p>操作详情：{description}</p>
-            <p>操作时间：{format_datetime(datetime.now())}</p>
-            """
-            for receiver_id in receiver_ids:
-                notification = Notification(
-                    user_id=receiver_id,
-                    title=notify_title,
-                    content=notify_content,
-                    related_type=target_type,
-                    related_id=target_id
-                )
-                db.session.add(notification)
+        with session.begin_nested():
+            session.execute(insert(OperationLog), [{
+                'user_id': entry['operator_id'],
+                'action_type': entry['action_type'],
+                'target_type': entry['target_type'],
+                'target_id': entry['target_id'],
+                'description': entry['description'],
+                'created_at': entry['time'],
+            } for entry in entries])
+            enqueue_notifications([('audit', dict(entry, time=entry['time'].isoformat(timespec='seconds')))
+                                   for entry in entries], session)
+    except Exception as e:
+        logging.error(f"日志记录/通知发送失败: {str(e)}")
+
+def _flush_audit_pending(session):
+    entries = session.info.pop('audit_pending', None)
+    if entries:
+        _write_audit_entries(session, entries)
+
+def _drop_audit_pending(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('audit_pending', None)
+
+event.listen(Session, 'before_commit', _flush_audit_pending)
+event.listen(Session, 'after_soft_rollback', _drop_audit_pending)
+
+# ==================== 通知发件箱（异步投递） ====================
+OUTBOX_BATCH = 200
+OUTBOX_MAX_ATTEMPTS = 5
+_outbox_wakeup = threading.Event()
+_outbox_lock = threading.Lock()
+_outbox_stats = {'events': 0, 'notices': 0, 'failures': 0, 'pending': 0, 'dead': 0, 'lag': 0.0, 'max_lag': 0.0}
+
+def enqueue_notifications(events, session=None):
+    """
+    events: [(kind, payload), ...]，随当前事务写入发件箱，提交后唤醒投递线程。
+    audit：log_action 的审计条目（接收人 = 管理人员 + 被操作人，内容在投递时生成）；
+    notice：{'title', 'content', 'user_ids', 'managers', 'related_type', 'related_id'}。
+    """
+    from models import db, NotificationOutbox
+    from sqlalchemy import insert
+    session = session or db.session
+    now = datetime.now()
+    session.execute(insert(NotificationOutbox), [{'kind': kind, 'payload': payload, 'created_at': now}
+                                                 for kind, payload in events])
+    session.info['outbox_wakeup'] = True
+
+def _wake_outbox_worker(session):
+    if session.info.pop('outbox_wakeup', False):
+        _outbox_wakeup.set()
+
+def _drop_outbox_wakeup(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('outbox_wakeup', None)
+
+event.listen(Session, 'after_commit', _wake_outbox_worker)
+event.listen(Session, 'after_soft_rollback', _drop_outbox_wakeup)
+
+def migrate_notification_outbox():
+    """旧库补加 dead_at 列，并把已达失败上限的事件转入死信。幂等"""
+    from models import db, NotificationOutbox
+    from sqlalchemy import update
+    inspector = db.inspect(db.engine)
+    if any(col['name'] == 'dead_at' for col in inspector.get_columns(NotificationOutbox.__tablename__)):
+        return False
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(f"ALTER TABLE {NotificationOutbox.__tablename__} ADD COLUMN dead_at DATETIME")
+        conn.execute(update(NotificationOutbox).where(NotificationOutbox.attempts >= OUTBOX_MAX_ATTEMPTS).values(dead_at=datetime.now()))
+    logging.info("通知发件箱 dead_at 列已补加")
+    return True
+
+def _refresh_outbox_backlog():
+    """重新统计待投递与死信事件数（一次查询）"""
+    from models import db, NotificationOutbox
+    from sqlalchemy import func
+    total, dead = db.session.query(func.count(NotificationOutbox.id), func.count(NotificationOutbox.dead_at)).one()
+    with _outbox_lock:
+        _outbox_stats['pending'] = total - dead
+        _outbox_stats['dead'] = dead
+
+def _expand_outbox_event(kind, payload, manager_ids, operated):
+    """把一条事件展开为通知行（不含 user_id 的模板）与接收人集合"""
+    receiver_ids = set(manager_ids) if kind == 'audit' or payload.get('managers') else set()
+    if kind == 'audit':
+        names = []
+        for cid in payload['operated_ids']:
+            name, uid = operated.get(int(cid), (None, None))
+            if name:
+                names.append(name)
+            if uid:
+                receiver_ids.add(uid)
+        created_at = datetime.fromisoformat(payload['time'])
+        row = {
+            'title': f"系统操作通知：{payload['action_type']}",
+            'content': f"""
+            <p>操作人：{payload['operator_name']}</p>
+            <p>操作类型：{payload['action_type']}</p>
+            <p>被操作人：{'、'.join(names) or '未知用户'}</p>
+            <p>操作详情：{payload['description']}</p>
+            <p>操作时间：{format_datetime(created_at)}</p>
+            """,
+            'related_type': payload['target_type'],
+            'related_id': payload['target_id'],
+            'created_at': created_at,
+        }
+    elif kind == 'notice':
+        receiver_ids.update(uid for uid in payload.get('user_ids') or () if uid)
+        row = {'title': payload['title'], 'content': payload['content'], 'related_type': payload.get('related_type'),
+               'related_id': payload.get('related_id'), 'created_at': datetime.now()}
+    else:
+        raise ValueError(f'未知事件类型: {kind}')
+    return row, receiver_ids
+
+def deliver_notification_outbox(batch=OUTBOX_BATCH):
+    """投递一批发件箱事件：删除（认领）事件、批量写通知、更新未读计数，一次提交。返回投递的事件数"""
+    from models import db, NotificationOutbox, Notification, User, EmploymentCycle
+    from sqlalchemy import insert, delete, update, case
+    event_ids = []
+    try:
+        events = NotificationOutbox.query.filter(NotificationOutbox.dead_at.is_(None)) \
+            .order_by(NotificationOutbox.id).limit(batch).all()
+        if not events:
+            _refresh_outbox_backlog()
+            return 0
+        event_ids = [ev.id for ev in events]
+        manager_ids = get_manager_user_ids()
+        # 本批所有审计事件的被操作人一次查出：周期ID -> (姓名, 账号ID)
+        cycle_ids = {int(cid) for ev in events if ev.kind == 'audit' for cid in ev.payload.get('operated_ids') or ()}
+        operated = {}
+        if cycle_ids:
+            operated = {cid: (name, uid) for cid, name, uid in db.session.query(
+                EmploymentCycle.id, EmploymentCycle.name, User.id
+            ).outerjoin(User, User.username == EmploymentCycle.id_card).filter(EmploymentCycle.id.in_(cycle_ids))}
+        notice_rows, receivers_all, delivered = [], [], []
+        for ev in events:
+            try:
+                row, receiver_ids = _expand_outbox_event(ev.kind, ev.payload, manager_ids, operated)
+            except Exception as e:
+                ev.attempts += 1
+                ev.last_error = str(e)[:500]
+                if ev.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    ev.dead_at = datetime.now()
+                logging.error(f"通知事件 {ev.id} 展开失败（第 {ev.attempts} 次{'，转入死信' if ev.dead_at else ''}）: {e}")
+                continue
+            notice_rows.extend(dict(row, user_id=uid, is_read=False) for uid in receiver_ids)
+            receivers_all.extend(receiver_ids)
+            delivered.append(ev)
+        # 先删除再写通知：删除即认领，另一个投递者读到同一批事件时删除行数对不上，整批放弃，避免重复通知
+        delivered_ids = [ev.id for ev in delivered]
+        enqueued_at = [ev.created_at for ev in delivered if ev.created_at]
+        if delivered_ids:
+            claimed = db.session.execute(delete(NotificationOutbox).where(
+                NotificationOutbox.id.in_(delivered_ids)).execution_options(synchronize_session=False)).rowcount
+            if claimed != len(delivered_ids):
+                db.session.rollback()
+                logging.warning(f"通知发件箱事件已被其他投递者处理（认领 {claimed}/{len(delivered_ids)}），本批放弃")
+                return 0
+        if notice_rows:
+            db.session.execute(insert(Notification), notice_rows)
+        add_unread_counts(receivers_all)
         db.session.commit()
     except Exception as e:
-        db.session.rollback()  
-        print(f"日志记录/通知发送失败: {str(e)}")
+        db.session.rollback()
+        with _outbox_lock:
+            _outbox_stats['failures'] += 1
+        logging.error(f"通知发件箱投递失败: {e}")
+        # 整批失败也要计入失败次数（单独事务），否则有问题的事件会一直排在队首反复重试；达到上限转入死信
+        if event_ids:
+            try:
+                db.session.execute(update(NotificationOutbox).where(NotificationOutbox.id.in_(event_ids)).values(
+                    attempts=NotificationOutbox.attempts + 1, last_error=str(e)[:500],
+                    dead_at=case((NotificationOutbox.attempts + 1 >= OUTBOX_MAX_ATTEMPTS, datetime.now()), else_=None)))
+                db.session.commit()
+                _refresh_outbox_backlog()
+            except Exception as e2:
+                db.session.rollback()
+                logging.error(f"通知发件箱失败次数记录失败: {e2}")
+        return 0
+    now = datetime.now()
+    lags = [(now - t).total_seconds() for t in enqueued_at]
+    with _outbox_lock:
+        _outbox_stats['events'] += len(delivered)
+        _outbox_stats['notices'] += len(notice_rows)
+        _outbox_stats['failures'] += len(events) - len(delivered)
+        if lags:
+            _outbox_stats['lag'] = max(lags)
+            _outbox_stats['max_lag'] = max(_outbox_stats['max_lag'], max(lags))
+    _refresh_outbox_backlog()
+    return len(delivered)
+
+def start_notification_outbox_worker(interval=5, batch=OUTBOX_BATCH):
+    """发件箱投递线程：事务提交后立即唤醒，另每 interval 秒兜底检查一次"""
+    def task():
+        while True:
+            _outbox_wakeup.wait(interval)
+            _outbox_wakeup.clear()
+            try:
+                from app import app
+                with app.app_context():
+                    from models import db
+                    while deliver_notification_outbox(batch) == batch:
+                        pass
+                    db.session.remove()
+            except Exception as e:
+                logging.error(f"通知投递线程出错: {e}")
+    threading.Thread(target=task, daemon=True, name='notification-outbox').start()
 
 # ==================== 文件上传 ====================
+# 文件名含这些关键字的视为系统文件，清理与删除时一律跳过
+UPLOAD_SYSTEM_SAFE = ('avatar_default', 'default', 'logo', 'favicon', 'static')
+
+def normalize_upload_path(path):
+    """上传文件的登记键：去掉引号、统一 / 分隔并转小写（Windows 路径不区分大小写）"""
+    if not isinstance(path, str):
+        return None
+    clean = path.strip().replace('"', '').replace("'", '').replace('\\', '/').lstrip('/')
+    if not clean:
+        return None
+    return os.path.normpath(clean).replace('\\', '/').lower()
+
+def register_file_reference(path, module=None):
+    """
+    登记上传文件。只加入当前会话，随调用方的业务事务一起提交；
+    事务回滚时登记也随之消失，文件过了保护期后会被清理任务回收。
+    """
+    from models import db, FileReference
+    key = normalize_upload_path(path)
+    if key:
+        db.session.merge(FileReference(path=key, module=module))
+    return key
+
 def save_uploaded_file(file, module='misc', sub_folder=None):
+    from config import UPLOAD_BASE_DIR
     if not (file and file.filename):
         return None
     ext = os.path.splitext(file.filename)[1].lower()
@@ -261,182 +751,1123 @@ def save_uploaded_file(file, module='misc', sub_folder=None):
         relative_sub_path = os.path.join('uploads', module, str(sub_folder))
     else:
         relative_sub_path = os.path.join('uploads', module, str(now.year), f"{now.month:02d}")
-    base_physical_dir = r"D:\cailu"
-    physical_upload_dir = os.path.join(base_physical_dir, relative_sub_path)
+    physical_upload_dir = os.path.join(UPLOAD_BASE_DIR, relative_sub_path)
     os.makedirs(physical_upload_dir, exist_ok=True)
     unique_filename = f"{now.strftime('%H%M%S')}_{uuid.uuid4().hex[:8]}{ext}"
     full_save_path = os.path.join(physical_upload_dir, unique_filename)
     try:
         file.save(full_save_path)
     except Exception as e:
-        print(f"文件保存失败: {str(e)}")
+        logging.error(f"文件保存失败: {str(e)}")
         return None
-    return os.path.join(relative_sub_path, unique_filename).replace('\\', '/')
-
-# ==================== 清理孤立文件（安全版） ====================
-def cleanup_isolated_files():
-    import os
-    import json
-    import time
-    import shutil
-    from datetime import datetime
-    from models import db, Asset, FundsRecord, User, EmploymentCycle, LeaveRecord
-
-    base_dir = r"D:\cailu"
-    uploads_dir = os.path.join(base_dir, 'uploads')
-    # 按小时创建回收站子目录，防止同名文件冲突
-    recycle_bin_dir = os.path.join(base_dir, 'recycle_bin', datetime.now().strftime('%Y%m%d_%H'))
-    
-    if not os.path.exists(uploads_dir):
-        return
-
+    rel_path = os.path.join(relative_sub_path, unique_filename).replace('\\', '/')
     try:
-        used_files = set()
+        register_file_reference(rel_path, module)
+    except Exception as e:
+        # 未登记的文件会被孤立文件清理移走（回填只在首次清理时执行），因此登记失败必须让调用方事务失败
+        logging.error(f"上传文件登记失败 {rel_path}: {e}")
+        try:
+            os.remove(full_save_path)
+        except OSError:
+            pass
+        raise
+    return rel_path
 
-        # 核心修复：递归处理函数，确保无论是字符串还是列表都能正确提取路径
-        def add_to_used(path):
-            if not path:
-                return
-            # 如果 path 是列表或元组（例如 LeaveRecord.attachments 字段解析后的结果）
-            if isinstance(path, (list, tuple)):
-                for item in path:
-                    add_to_used(item)  # 递归拆解
-                return
-            # 只有是字符串时才执行 lower() 和标准化操作
-            if isinstance(path, str):
+# ==================== 孤立文件清理（登记表 + 目录清单缓存） ====================
+def _scan_legacy_references():
+    """旧版全库扫描：遍历所有模型的所有字段，提取包含 uploads 的路径（支持 JSON 列表/字典）。仅用于回填登记表"""
+    from models import db, FileReference
+    used_files = set()
+
+    def scan_value(val):
+        if not val:
+            return
+        if isinstance(val, str):
+            if 'uploads' in val.lower():
+                key = normalize_upload_path(val)
+                if key and key.startswith('uploads/'):
+                    used_files.add(key)
+            if val.strip().startswith('[') or val.strip().startswith('{'):
                 try:
-                    # 移除可能的 JSON 转义引号
-                    path_clean = path.strip().replace('"', '').replace("'", "")
-                    norm = os.path.normpath(path_clean).lower().strip().lstrip('\\').lstrip('/')
-                    used_files.add(norm)
-                except Exception:
+                    scan_value(json.loads(val))
+                except ValueError:
                     pass
+        elif isinstance(val, (list, tuple)):
+            for item in val:
+                scan_value(item)
+        elif isinstance(val, dict):
+            for v in val.values():
+                scan_value(v)
+
+    for model_cls in db.Model.__subclasses__():
+        for col in model_cls.__table__.columns:
+            # 只有字符串（含 Text）与 JSON 列可能存放附件路径
+            if model_cls is FileReference or not isinstance(col.type, (db.String, db.JSON)):
+                continue
+            for (val,) in db.session.query(col).filter(col.isnot(None)).yield_per(1000):
+                scan_value(val)
+    return used_files
+
+def rebuild_file_references():
+    """一次性回填：把数据库中现有的附件路径补登记到 file_references（已有的不重复插入）。返回新增条数"""
+    from models import db, FileReference
+    used_files = _scan_legacy_references()
+    existing = {p for (p,) in db.session.query(FileReference.path)}
+    missing = sorted(used_files - existing)
+    now = datetime.now()
+    for i in range(0, len(missing), 500):
+        db.session.execute(FileReference.__table__.insert(),
+                           [{'path': p, 'module': p.split('/')[1] if p.count('/') > 1 else None, 'created_at': now}
+                            for p in missing[i:i + 500]])
+    db.session.commit()
+    logging.info(f"文件登记回填完成：扫描到 {len(used_files)} 个引用，新增 {len(missing)} 条")
+    return len(missing)
+
+def _load_gc_index(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_gc_index(path, index):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _scan_upload_dirs(base_dir, cached_dirs, incremental):
+    """
+    遍历 uploads 目录树，返回 (目录清单, {登记键: (绝对路径, mtime)}, 本次有变化目录中的文件键)。
+    增量模式下目录 mtime 未变（没有新增、删除、改名）就直接复用缓存清单，只对变化的目录重新 scandir。
+    """
+    dirs, files, changed = {}, {}, set()
+    stack = ['uploads']
+    while stack:
+        rel_dir = stack.pop()
+        abs_dir = os.path.join(base_dir, rel_dir)
+        try:
+            dir_mtime = os.stat(abs_dir).st_mtime
+        except OSError:
+            continue
+        cached = cached_dirs.get(rel_dir)
+        if incremental and cached and cached.get('mtime') == dir_mtime:
+            entry, fresh = cached, False
+        else:
+            entry, fresh = {'mtime': dir_mtime, 'files': {}, 'subdirs': []}, True
+            try:
+                with os.scandir(abs_dir) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False):
+                            entry['subdirs'].append(f'{rel_dir}/{e.name}')
+                        elif e.is_file(follow_symlinks=False):
+                            entry['files'][e.name] = e.stat().st_mtime
+            except OSError:
+                continue
+        dirs[rel_dir] = entry
+        stack.extend(entry['subdirs'])
+        for name, mtime in entry['files'].items():
+            key = normalize_upload_path(f'{rel_dir}/{name}')
+            files[key] = (os.path.join(abs_dir, name), mtime)
+            if fresh:
+                changed.add(key)
+    return dirs, files, changed
+
+def cleanup_isolated_files(full=False, dry_run=False):
+    """
+    孤立文件清理：磁盘文件 - 登记表 = 孤立文件，超过保护期的移入回收站。
+    增量模式（默认）只检查上次运行后有变化的目录里的文件以及上次仍在保护期内的文件；
+    full=True 时检查全部文件，并清除文件已不存在的过期登记。返回统计字典。
+    """
+    from config import UPLOAD_BASE_DIR, UPLOAD_GC_GRACE, UPLOAD_GC_INDEX
+    from models import db, FileReference
+
+    uploads_dir = os.path.join(UPLOAD_BASE_DIR, 'uploads')
+    if not os.path.exists(uploads_dir):
+        return None
+    # 按小时创建回收站子目录，防止同名文件冲突
+    recycle_bin_dir = os.path.join(UPLOAD_BASE_DIR, 'recycle_bin', datetime.now().strftime('%Y%m%d_%H'))
+
+    try:
+        index = _load_gc_index(UPLOAD_GC_INDEX)
+        if not index.get('backfilled'):
+            # 首次运行：登记表上线前的附件先从业务表回填
+            rebuild_file_references()
+            full = True
+        incremental = not full and bool(index.get('dirs'))
+        dirs, files, changed = _scan_upload_dirs(UPLOAD_BASE_DIR, index.get('dirs', {}), incremental)
+
+        if incremental:
+            candidates = changed | {k for k in index.get('pending', ()) if k in files}
+        else:
+            candidates = set(files)
+        candidates = {k for k in candidates if not any(kw in k.rsplit('/', 1)[-1] for kw in UPLOAD_SYSTEM_SAFE)}
 
-        # 自动扫描：遍历所有模型的所有字段，识别包含 uploads 路径的文件
-        # 支持字符串、列表、JSON 嵌套等多种格式
-        def scan_value(val):
-            if not val:
-                return
-            if isinstance(val, str):
-                if 'uploads' in val.lower():
-                    add_to_used(val)
-                # 尝试解析 JSON
-                if val.strip().startswith('[') or val.strip().startswith('{'):
-                    try:
-                        parsed = json.loads(val)
-                        scan_value(parsed)
-                    except:
-                        pass
-            elif isinstance(val, (list, tuple)):
-                for item in val:
-                    scan_value(item)
-            elif isinstance(val, dict):
-                for k, v in val.items():
-                    scan_value(v)
-
-        for model_cls in db.Model.__subclasses__():
-            for col in model_cls.__table__.columns:
-                for (val,) in db.session.query(col).filter(col.isnot(None)).all():
-                    scan_value(val)
-
-        # 5. 执行物理扫描与清理
-        SYSTEM_SAFE = ['avatar_default', 'default', 'logo', 'favicon', 'static']
-        count = 0
         now_ts = time.time()
-        
-        for root, dirs, files in os.walk(uploads_dir):
-            for file in files:
-                # 排除系统保留关键字文件
-                if any(kw in file.lower() for kw in SYSTEM_SAFE):
-                    continue
-                    
-                full_path = os.path.join(root, file)
-                # 计算相对路径，例如: uploads/leave/xxx.jpg
-                rel_path = os.path.relpath(full_path, base_dir)
-                rel_path_norm = os.path.normpath(rel_path).lower().strip()
-                
-                # 如果文件不在数据库记录中
-                if rel_path_norm not in used_files:
-                    # 安全机制：仅处理创建时间超过 2 小时的文件，防止误删正在上传的文件
-                    if now_ts - os.path.getmtime(full_path) > 7200:
-                        if not os.path.exists(recycle_bin_dir):
-                            os.makedirs(recycle_bin_dir)
-                            
-                        # 移动到回收站
-                        target_name = f"{datetime.now().strftime('%M%S')}_{file}"
-                        target_path = os.path.join(recycle_bin_dir, target_name)
-                        try:
-                            shutil.move(full_path, target_path)
-                            count += 1
-                        except:
-                            pass 
-
-        if count > 0:
-            print(f"[{datetime.now()}] 维护完成：{count}个孤立文件已安全移至回收站")
-            
+        pruned = 0
+        if incremental:
+            registered = set()
+            ordered = list(candidates)
+            for i in range(0, len(ordered), 500):
+                registered.update(p for (p,) in db.session.query(FileReference.path)
+                                  .filter(FileReference.path.in_(ordered[i:i + 500])))
+        else:
+            registered = {p for (p,) in db.session.query(FileReference.path)}
+            # 文件已不存在的登记（只清理保护期之前登记的，避免与刚提交的上传竞争）
+            stale = list(registered - set(files))
+            if stale and not dry_run:
+                cutoff = datetime.now() - timedelta(seconds=UPLOAD_GC_GRACE)
+                for i in range(0, len(stale), 500):
+                    pruned += FileReference.query.filter(FileReference.path.in_(stale[i:i + 500]),
+                                                         FileReference.created_at < cutoff).delete(synchronize_session=False)
+                db.session.commit()
+
+        pending, moved = [], 0
+        orphans = candidates - registered
+        for key in orphans:
+            full_path, mtime = files[key]
+            # 安全机制：仅处理超过保护期的文件，防止误删正在上传、事务尚未提交的文件
+            if now_ts - mtime <= UPLOAD_GC_GRACE:
+                pending.append(key)
+                continue
+            if dry_run:
+                continue
+            os.makedirs(recycle_bin_dir, exist_ok=True)
+            target_path = os.path.join(recycle_bin_dir, f"{datetime.now().strftime('%M%S')}_{os.path.basename(full_path)}")
+            try:
+                shutil.move(full_path, target_path)
+                moved += 1
+            except OSError as e:
+                logging.warning(f"孤立文件移动失败 {full_path}: {e}")
+
+        stats = {
+            'mode': 'incremental' if incremental else 'full',
+            'files': len(files), 'checked': len(candidates), 'orphans': len(orphans),
+            'moved': moved, 'pending': len(pending), 'pruned': pruned, 'dry_run': dry_run,
+        }
+        if not dry_run:
+            _save_gc_index(UPLOAD_GC_INDEX, {
+                'backfilled': True, 'last_run': datetime.now().isoformat(timespec='seconds'),
+                'dirs': dirs, 'pending': sorted(pending),
+            })
+        if moved > 0:
+            logging.info(f"维护完成：{moved}个孤立文件已安全移至回收站")
+        logging.info(f"孤立文件清理统计: {stats}")
+        return stats
     except Exception as e:
         db.session.rollback()
-        # 打印错误详情方便排查
-        import traceback
-        traceback.print_exc()
-        print(f"维护逻辑出错并已回滚: {str(e)}")
+        logging.exception(f"维护逻辑出错并已回滚: {str(e)}")
+        return None
     finally:
         db.session.remove()
 
 # ==================== 删除物理文件（安全版） ====================
 def delete_physical_file(file_relative_path):
+    """移入回收站并在当前会话中删除登记（随调用方事务提交）"""
+    from config import UPLOAD_BASE_DIR
     if not file_relative_path:
         return False
-    PROTECTED_SYSTEM_FILES = ['default', 'avatar_default', 'logo', 'favicon', 'static']
-    if any(word in file_relative_path.lower() for word in PROTECTED_SYSTEM_FILES):
-        print(f"安全拦截：系统保护文件，拒绝物理删除: {file_relative_path}")
+    if any(word in file_relative_path.lower() for word in UPLOAD_SYSTEM_SAFE):
+        logging.warning(f"安全拦截：系统保护文件，拒绝物理删除: {file_relative_path}")
         return False
-    base_dir = r"D:\cailu"
+    base_dir = UPLOAD_BASE_DIR
     abs_path = os.path.normpath(os.path.join(base_dir, file_relative_path))
     if not abs_path.lower().startswith(os.path.join(base_dir, 'uploads').lower()):
-        print(f"安全拦截：禁止删除非uploads目录文件: {abs_path}")
+        logging.warning(f"安全拦截：禁止删除非uploads目录文件: {abs_path}")
         return False
+    try:
+        from models import FileReference
+        FileReference.query.filter_by(path=normalize_upload_path(file_relative_path)).delete(synchronize_session=False)
+    except Exception as e:
+        logging.warning(f"删除文件登记失败 {file_relative_path}: {e}")
     try:
         if os.path.exists(abs_path):
             recycle_base = os.path.join(base_dir, 'recycle_bin', 'manual_delete')
             os.makedirs(recycle_base, exist_ok=True)
             target_path = os.path.join(recycle_base, f"{datetime.now().strftime('%H%M%S')}_{os.path.basename(abs_path)}")
-            import shutil
             shutil.move(abs_path, target_path)
-            print(f"成功将文件移至备份区（替代删除）: {target_path}")
+            logging.info(f"成功将文件移至备份区（替代删除）: {target_path}")
             return True
         return False
     except Exception as e:
-        print(f"处理文件失败: {str(e)}")
+        logging.error(f"处理文件失败: {str(e)}")
         return False
 
-# ==================== 数据库自动备份 ====================
-def auto_backup_database():
-    from config import DATABASE_PATH
-    BACKUP_DIR = r"D:\cailu\backups"
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
-    filename = f'db_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db'
+# ==================== SQLite 存储配置 ====================
+# busy_timeout 最先设置，后续切换 journal_mode 时遇锁也会等待而不是直接失败
+_PRAGMA_ORDER = ('busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'wal_autocheckpoint')
+
+def get_storage_profile(name=None):
+    """按名称取存储配置，未知名称回退到 wal 并告警"""
+    from config import STORAGE_PROFILES, STORAGE_PROFILE
+    name = name or STORAGE_PROFILE
+    if name not in STORAGE_PROFILES:
+        logging.warning(f"未知的数据库存储配置 {name}，使用 wal")
+        name = 'wal'
+    return name, STORAGE_PROFILES[name]
+
+def apply_sqlite_pragmas(dbapi_conn, pragmas):
+    """在一个原生 sqlite3 连接上执行存储配置 PRAGMA"""
+    cursor = dbapi_conn.cursor()
     try:
-        shutil.copy2(DATABASE_PATH, os.path.join(BACKUP_DIR, filename))
-        print(f"[{datetime.now()}] 数据库备份成功: {filename}")
+        for key in _PRAGMA_ORDER:
+            if key in pragmas:
+                cursor.execute(f"PRAGMA {key}={pragmas[key]}")
+    finally:
+        cursor.close()
+
+def install_sqlite_profile(engine, name=None):
+    """为引擎注册 connect 钩子：每个新连接都应用所选存储配置"""
+    if engine.dialect.name != 'sqlite':
+        return None
+    name, pragmas = get_storage_profile(name)
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_conn, connection_record):
+        apply_sqlite_pragmas(dbapi_conn, pragmas)
+
+    logging.info(f"数据库存储配置: {name} {pragmas}")
+    return name
+
+def install_sqlite_savepoint_support(engine):
+    """
+    pysqlite 只在 DML 前隐式 BEGIN，SAVEPOINT（session.begin_nested）之前没有写入时会成为最外层事务，
+    RELEASE 即单独提交。为引擎注册 savepoint 钩子：驱动尚未开启事务时先显式 BEGIN，SAVEPOINT 始终嵌套在调用方事务内。
+    不采用“关闭驱动事务管理 + 每次 begin 都 BEGIN”的做法：读操作也会进入事务并持有 WAL 读快照，
+    先读后写的请求在并发写入后升级写锁会直接报 database is locked（busy_timeout 无效）。
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'savepoint')
+    def _begin_before_savepoint(conn, name):
+        if not conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql('BEGIN')
+
+def sqlite_checkpoint(mode='PASSIVE'):
+    """WAL checkpoint，返回 (是否被阻塞, WAL 总页数, 已写回页数)"""
+    from models import db
+    with db.engine.connect() as conn:
+        row = conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return tuple(row) if row else None
+
+def sqlite_optimize():
+    from models import db
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+
+def start_sqlite_maintenance_scheduler(checkpoint_interval=300, optimize_interval=6 * 3600):
+    """
+    后台定期维护：被动 checkpoint 防止 WAL 文件在持续读负载下无限增长；
+    PRAGMA optimize 按需更新统计信息。非 WAL 模式下只做 optimize。
+    """
+    def task():
+        time.sleep(60)
+        last_optimize = time.monotonic()
+        while True:
+            try:
+                from app import app
+                with app.app_context():
+                    from models import db
+                    wal = db.session.execute(db.text("PRAGMA journal_mode")).scalar() == 'wal'
+                    db.session.remove()
+                    if wal:
+                        result = sqlite_checkpoint('PASSIVE')
+                        if result and result[0]:
+                            logging.warning(f"WAL checkpoint 被阻塞: {result}")
+                    if time.monotonic() - last_optimize >= optimize_interval:
+                        sqlite_optimize()
+                        last_optimize = time.monotonic()
+                        logging.info("PRAGMA optimize 完成")
+            except Exception as e:
+                logging.error(f"数据库维护任务出错: {e}")
+            time.sleep(checkpoint_interval)
+    threading.Thread(target=task, daemon=True).start()
+
+def benchmark_storage_profile(name, readers=24, seconds=5.0, write_interval=0.05, write_batch=2000, rows=50000):
+    """
+    并发基准：在临时库上用所选配置跑 readers 个读线程 + 1 个写线程，
+    模拟 waitress 24 线程读 + 导入/保存写入。返回读吞吐、读写延迟分位与锁冲突次数。
+    """
+    import sqlite3
+    import tempfile
+    name, pragmas = get_storage_profile(name)
+    tmpdir = tempfile.mkdtemp(prefix='cailu_bench_')
+    path = os.path.join(tmpdir, 'bench.db')
+
+    def connect():
+        conn = sqlite3.connect(path, timeout=0, check_same_thread=False)
+        apply_sqlite_pragmas(conn, pragmas)
+        return conn
+
+    setup = connect()
+    setup.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, k INTEGER, v TEXT)")
+    setup.execute("CREATE INDEX ix_t_k ON t (k)")
+    setup.executemany("INSERT INTO t (k, v) VALUES (?, ?)", ((i % 500, 'x' * 64) for i in range(rows)))
+    setup.commit()
+    setup.close()
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'reads': 0, 'writes': 0, 'locked': 0, 'read_ms': [], 'write_ms': []}
+
+    def reader(seed):
+        conn = connect()
+        k = seed
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                lo = k % 480
+                conn.execute("SELECT k, COUNT(*), MAX(id) FROM t WHERE k BETWEEN ? AND ? GROUP BY k",
+                             (lo, lo + 20)).fetchall()
+                with lock:
+                    stats['reads'] += 1
+                    stats['read_ms'].append((time.perf_counter() - t0) * 1000)
+            except sqlite3.OperationalError:
+                with lock:
+                    stats['locked'] += 1
+            k += 7
+        conn.close()
+
+    def writer():
+        conn = connect()
+        i = 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                # 模拟导入/批量保存：一个事务写入一批数据
+                conn.executemany("INSERT INTO t (k, v) VALUES (?, ?)", [(i % 500, 'y' * 64)] * write_batch)
+                conn.commit()
+                with lock:
+                    stats['writes'] += 1
+                    stats['write_ms'].append((time.perf_counter() - t0) * 1000)
+            except sqlite3.OperationalError:
+                conn.rollback()
+                with lock:
+                    stats['locked'] += 1
+            i += 1
+            time.sleep(write_interval)
+        conn.close()
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def pct(values, q):
+        return round(float(np.percentile(values, q)), 2) if values else None
+    return {
+        'profile': name,
+        'reads_per_sec': round(stats['reads'] / seconds, 1),
+        'write_batches_per_sec': round(stats['writes'] / seconds, 1),
+        'read_p50_ms': pct(stats['read_ms'], 50), 'read_p99_ms': pct(stats['read_ms'], 99),
+        'write_p50_ms': pct(stats['write_ms'], 50), 'write_p99_ms': pct(stats['write_ms'], 99),
+        'locked_errors': stats['locked'],
+    }
+
+# ==================== 日志上下文与结构化格式 ====================
+_REQUEST_ID_RE = re.compile(r'[\w.-]{1,64}')
+
+class RequestContextFilter(logging.Filter):
+    """挂在 QueueHandler 上，在产生日志的线程里补齐请求上下文（入队后就拿不到了）"""
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.user_id = g.get('log_user_id')
+            record.endpoint = request.endpoint
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """每行一个 JSON；请求上下文与 extra 中的耗时字段存在时一并输出"""
+    CONTEXT_FIELDS = ('request_id', 'user_id', 'endpoint', 'duration_ms', 'status')
+
+    def format(self, record):
+        entry = {
+            'time': f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')}.{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# ==================== 请求级 SQL 性能分析 ====================
+PERF_WINDOW = 500   # 每个端点保留最近 N 次请求样本用于计算分位数
+_perf_lock = threading.Lock()
+_perf_stats = {}    # endpoint -> {'samples': deque[(总耗时ms, SQL耗时ms, 查询数)], 'count': 累计请求数, 'slowest': (ms, sql)}
+
+# ---------- 慢查询日志 ----------
+SLOW_GROUP_LIMIT = 500   # 最多保留的慢查询指纹数，超出后不再新增分组
+slow_query_logger = logging.getLogger('slow_query')
+_slow_query_cfg = {'ms': float('inf'), 'watch': ()}
+_slow_groups = {}        # 指纹 -> {'count', 'total_ms', 'max_ms', 'scans', 'endpoints', 'sample', 'plan', 'last_seen'}
+_ID_CARD_RE = re.compile(r'(?<![\dXx])(\d{6})\d{8}(\d{3}[\dXx])(?![\dXx])')
+_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+_FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),               # 字符串字面量
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),             # 数字字面量（标识符中的数字不受影响）
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'), # IN (?, ?, ...) 折叠，参数个数不同视为同一语句
+    (re.compile(r'\s+'), ' '),
+)
+
+def mask_id_cards(text):
+    """18 位身份证号只保留前 6 位与后 4 位"""
+    return _ID_CARD_RE.sub(r'\1********\2', text)
+
+def sql_fingerprint(statement):
+    fp = statement
+    for pattern, repl in _FINGERPRINT_RULES:
+        fp = pattern.sub(repl, fp)
+    return fp.strip()
+
+def _explain_query_plan(conn, statement, parameters):
+    """在同一连接上用原生游标执行 EXPLAIN QUERY PLAN（不经过 SQLAlchemy 事件，避免递归计时）"""
+    try:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters or ())
+            return [row[3] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
     except Exception as e:
-        print(f"备份失败: {str(e)}")
+        return [f'EXPLAIN 失败: {e}']
 
-# ==================== 后台调度器 ====================
-def cleanup_old_notifications(days=30):
+def _record_slow_query(conn, statement, parameters, executemany, elapsed_ms):
+    params = parameters[0] if executemany and parameters else parameters
+    plan = _explain_query_plan(conn, statement, params)
+    scans = set()
+    for detail in plan:
+        m = _SCAN_RE.match(detail)
+        if m:
+            table = re.sub(r'_\d+$', '', m.group(1))   # 去掉 SQLAlchemy 别名后缀（notifications_1）
+            if table in _slow_query_cfg['watch']:
+                scans.add(table)
+    endpoint = request.endpoint if has_request_context() else f'thread:{threading.current_thread().name}'
+    fingerprint = sql_fingerprint(statement)
+    slow_query_logger.warning(json.dumps({
+        'time': datetime.now().isoformat(timespec='milliseconds'),
+        'endpoint': endpoint,
+        'ms': round(elapsed_ms, 2),
+        'sql': statement,
+        'params': mask_id_cards(repr(params)),
+        'executemany': executemany,
+        'plan': plan,
+        'scans': sorted(scans),
+        'fingerprint': fingerprint,
+    }, ensure_ascii=False))
+    with _perf_lock:
+        group = _slow_groups.get(fingerprint)
+        if group is None:
+            if len(_slow_groups) >= SLOW_GROUP_LIMIT:
+                return
+            group = _slow_groups[fingerprint] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'scans': set(), 'endpoints': set()}
+        group['count'] += 1
+        group['total_ms'] += elapsed_ms
+        group['max_ms'] = max(group['max_ms'], elapsed_ms)
+        group['scans'] |= scans
+        group['endpoints'].add(endpoint)
+        group['plan'] = plan
+        group['sample'] = statement
+        group['last_seen'] = datetime.now()
+
+def get_slow_query_groups():
+    """慢查询按指纹分组；对关注表做全表 SCAN 的排在前面，其次按出现次数"""
+    with _perf_lock:
+        rows = [{
+            'fingerprint': fp,
+            'count': grp['count'],
+            'avg_ms': round(grp['total_ms'] / grp['count'], 2),
+            'max_ms': round(grp['max_ms'], 2),
+            'scans': sorted(grp['scans']),
+            'endpoints': sorted(grp['endpoints']),
+            'plan': list(grp['plan']),
+            'last_seen': grp['last_seen'].isoformat(timespec='seconds'),
+        } for fp, grp in _slow_groups.items()]
+    rows.sort(key=lambda r: (not r['scans'], -r['count']))
+    return rows
+
+def _request_sql_stats():
+    """当前请求的 SQL 统计；后台线程或无请求上下文时返回 None"""
+    if not has_request_context():
+        return None
+    return g.get('_sql_stats')
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('_query_start')
+    if not starts:
+        return
+    elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+    with _db_totals_lock:
+        _db_totals['queries'] += 1
+        _db_totals['ms'] += elapsed_ms
+    if elapsed_ms >= _slow_query_cfg['ms']:
+        _record_slow_query(conn, statement, parameters, executemany, elapsed_ms)
+    stats = _request_sql_stats()
+    if stats is None:
+        return
+    stats['count'] += 1
+    stats['time'] += elapsed_ms
+    if elapsed_ms > stats['slowest_ms']:
+        stats['slowest_ms'] = elapsed_ms
+        stats['slowest_sql'] = statement
+
+def _after_db_commit(conn):
+    with _db_totals_lock:
+        _db_totals['commits'] += 1
+    stats = _request_sql_stats()
+    if stats is not None:
+        stats['commits'] += 1
+
+def install_sql_profiler(engine, slow_ms=None, watch_tables=None):
+    """在引擎上挂载游标计时钩子（每条语句记入当前请求的统计，超过阈值的写慢查询日志）"""
+    from config import SLOW_QUERY_MS, SLOW_QUERY_WATCH_TABLES
+    _slow_query_cfg['ms'] = SLOW_QUERY_MS if slow_ms is None else slow_ms
+    _slow_query_cfg['watch'] = tuple(SLOW_QUERY_WATCH_TABLES if watch_tables is None else watch_tables)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'commit', _after_db_commit)   # 每次提交对应一次 fsync，单独计数
+
+def begin_request_profile():
+    g._sql_stats = {'count': 0, 'time': 0.0, 'commits': 0, 'slowest_ms': 0.0, 'slowest_sql': None}
+    # 请求ID：沿用 Nginx 传入的 X-Request-ID，否则生成；写入日志并回传给客户端
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if _REQUEST_ID_RE.fullmatch(incoming) else uuid.uuid4().hex[:12]
+    g.log_user_id = session.get('_user_id')   # Flask-Login 写入会话的用户ID，不触发用户加载查询
+    g._inflight = True
+    with _perf_lock:
+        _inflight_requests[threading.get_ident()] = {
+            'started': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'user_id': g.log_user_id,
+            'thread': threading.current_thread().name,
+            'dumped': False,
+        }
+
+def finish_request_profile(endpoint, total_ms, blueprint=None):
+    """把本次请求计入端点滚动统计与耗时直方图，返回本次的 SQL 统计（供请求日志使用）"""
+    from bisect import bisect_left
+    from collections import deque
+    stats = _request_sql_stats() or {'count': 0, 'time': 0.0, 'commits': 0, 'slowest_ms': 0.0, 'slowest_sql': None}
+    with _perf_lock:
+        hist = _request_hist.get((blueprint or '', endpoint))
+        if hist is None:
+            hist = _request_hist[(blueprint or '', endpoint)] = {'buckets': [0] * len(METRIC_BUCKETS_MS), 'sum': 0.0, 'count': 0}
+        idx = bisect_left(METRIC_BUCKETS_MS, total_ms)
+        if idx < len(METRIC_BUCKETS_MS):
+            hist['buckets'][idx] += 1
+        hist['sum'] += total_ms
+        hist['count'] += 1
+        entry = _perf_stats.get(endpoint)
+        if entry is None:
+            entry = _perf_stats[endpoint] = {'samples': deque(maxlen=PERF_WINDOW), 'count': 0, 'slowest': (0.0, None)}
+        entry['samples'].append((total_ms, stats['time'], stats['count'], stats['commits']))
+        entry['count'] += 1
+        if stats['slowest_ms'] > entry['slowest'][0]:
+            entry['slowest'] = (stats['slowest_ms'], (stats['slowest_sql'] or '')[:2000])
+    return stats
+
+def get_perf_summary():
+    """各端点最近窗口内的耗时分位数、平均查询数与 SQL 耗时，按 p95 倒序"""
+    with _perf_lock:
+        snapshot = [(ep, list(e['samples']), e['count'], e['slowest']) for ep, e in _perf_stats.items()]
+    rows = []
+    for endpoint, samples, count, slowest in snapshot:
+        arr = np.array(samples, dtype=float)
+        p50, p95, p99 = np.percentile(arr[:, 0], [50, 95, 99])
+        rows.append({
+            'endpoint': endpoint,
+            'count': count,
+            'window': len(samples),
+            'p50': round(float(p50), 2),
+            'p95': round(float(p95), 2),
+            'p99': round(float(p99), 2),
+            'avg_db_ms': round(float(arr[:, 1].mean()), 2),
+            'db_share': round(float(arr[:, 1].sum() / max(arr[:, 0].sum(), 1e-9)) * 100, 1),
+            'avg_queries': round(float(arr[:, 2].mean()), 1),
+            'max_queries': int(arr[:, 2].max()),
+            'avg_commits': round(float(arr[:, 3].mean()), 2),
+            'slowest_ms': round(slowest[0], 2),
+            'slowest_sql': slowest[1],
+        })
+    rows.sort(key=lambda r: r['p95'], reverse=True)
+    return rows
+
+def reset_perf_stats():
+    with _perf_lock:
+        _perf_stats.clear()
+        _slow_groups.clear()
+
+# ==================== 运行指标（/metrics） ====================
+METRIC_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_request_hist = {}   # (blueprint, endpoint) -> {'buckets': [...], 'sum': 毫秒合计, 'count': 次数}
+_inflight_requests = {}   # 线程 ident -> 在途请求信息（看门狗与 /debug/inflight 使用）
+_db_totals = {'queries': 0, 'ms': 0.0, 'commits': 0}
+_db_totals_lock = threading.Lock()
+_cache_stats = {}    # 缓存名 -> [命中, 未命中]
+_job_runs = {}       # 任务名 -> {'last_run', 'duration', 'ok', 'runs', 'failures'}
+_waitress = {'server': None}
+
+def record_cache_access(name, hit):
+    with _perf_lock:
+        counts = _cache_stats.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+def record_job_run(name, started, ok):
+    """记录后台任务最近一次运行（started 为 time.time() 起始时间）"""
+    with _perf_lock:
+        job = _job_runs.setdefault(name, {'runs': 0, 'failures': 0})
+        job.update(last_run=started, duration=time.time() - started, ok=bool(ok))
+        job['runs'] += 1
+        job['failures'] += 0 if ok else 1
+
+def register_waitress_server(server):
+    """记录 waitress 服务实例，用于读取任务队列深度"""
+    _waitress['server'] = server
+
+def end_request_profile():
+    if g.pop('_inflight', False):
+        with _perf_lock:
+            _inflight_requests.pop(threading.get_ident(), None)
+
+# ---------- 卡死请求看门狗 ----------
+def get_inflight_requests(with_stack=True):
+    """在途请求列表（按已运行时长倒序），可附带所在线程当前调用栈"""
+    now = time.time()
+    with _perf_lock:
+        items = [(tid, dict(info)) for tid, info in _inflight_requests.items()]
+    frames = sys._current_frames() if with_stack else {}
+    rows = []
+    for tid, info in items:
+        started = info.pop('started')
+        info.update(thread_id=tid, age=round(now - started, 3),
+                    started_at=datetime.fromtimestamp(started).isoformat(timespec='seconds'))
+        if with_stack:
+            frame = frames.get(tid)
+            info['stack'] = [line.rstrip() for line in traceback.format_stack(frame)] if frame else []
+        rows.append(info)
+    rows.sort(key=lambda r: r['age'], reverse=True)
+    return rows
+
+def check_stalled_requests(threshold):
+    """超过阈值的请求把所在线程的调用栈写入 error.log（每个请求只转储一次），返回本次转储数"""
+    now = time.time()
+    with _perf_lock:
+        stalled = [(tid, info) for tid, info in _inflight_requests.items()
+                   if not info['dumped'] and now - info['started'] >= threshold]
+        for _, info in stalled:
+            info['dumped'] = True
+        inflight = len(_inflight_requests)
+    if not stalled:
+        return 0
+    frames = sys._current_frames()
+    error_logger = logging.getLogger('error')
+    for tid, info in stalled:
+        frame = frames.get(tid)
+        stack = ''.join(traceback.format_stack(frame)) if frame else '（线程已结束）\n'
+        error_logger.error(
+            "请求疑似卡死 %.1fs（在途 %d）: %s %s endpoint=%s user=%s thread=%s(%s)\n%s",
+            now - info['started'], inflight, info['method'], info['path'],
+            info['endpoint'], info['user_id'], info['thread'], tid, stack
+        )
+    return len(stalled)
+
+def start_request_watchdog(threshold=30, interval=5):
+    def watchdog_task():
+        while True:
+            time.sleep(interval)
+            try:
+                check_stalled_requests(threshold)
+            except Exception as e:
+                logging.error(f"请求看门狗出错: {e}")
+    thread = threading.Thread(target=watchdog_task, name='request-watchdog', daemon=True)
+    thread.start()
+
+def process_rss_bytes():
+    """当前进程常驻内存；优先 psutil（可选依赖），否则按平台读取，取不到返回 None"""
     try:
-        from models import Notification, db
-        cutoff = datetime.now() - timedelta(days=days)
-        Notification.query.filter(Notification.created_at < cutoff).delete(synchronize_session=False)
-        db.session.commit()
-        print(f"[{datetime.now()}] 清理了 {days} 天前的通知")
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        if os.name == 'nt':
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+            return None
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
+
+def _metric_labels(**labels):
+    inner = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+    return '{' + inner + '}' if inner else ''
+
+def render_metrics():
+    """Prometheus 文本格式（0.0.4）"""
+    lines = []
+
+    def metric(name, mtype, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {mtype}')
+        for suffix, labels, value in samples:
+            lines.append(f'{name}{suffix}{_metric_labels(**labels)} {value}')
+
+    with _perf_lock:
+        hist = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']} for k, v in _request_hist.items()}
+        inflight = len(_inflight_requests)
+        caches = {k: list(v) for k, v in _cache_stats.items()}
+        jobs = {k: dict(v) for k, v in _job_runs.items()}
+    with _db_totals_lock:
+        db_totals = dict(_db_totals)
+
+    samples = []
+    for (blueprint, endpoint), h in sorted(hist.items()):
+        cumulative = 0
+        for bound, n in zip(METRIC_BUCKETS_MS, h['buckets']):
+            cumulative += n
+            samples.append(('_bucket', {'blueprint': blueprint, 'endpoint': endpoint, 'le': bound / 1000}, cumulative))
+        samples.append(('_bucket', {'blueprint': blueprint, 'endpoint': endpoint, 'le': '+Inf'}, h['count']))
+        samples.append(('_sum', {'blueprint': blueprint, 'endpoint': endpoint}, round(h['sum'] / 1000, 6)))
+        samples.append(('_count', {'blueprint': blueprint, 'endpoint': endpoint}, h['count']))
+    metric('cailu_request_duration_seconds', 'histogram', '请求耗时', samples)
+    metric('cailu_requests_in_flight', 'gauge', '正在处理的请求数', [('', {}, inflight)])
+
+    dispatcher = getattr(_waitress['server'], 'task_dispatcher', None)
+    if dispatcher is not None:
+        metric('cailu_waitress_queue_depth', 'gauge', 'waitress 等待工作线程的任务数', [('', {}, len(dispatcher.queue))])
+        metric('cailu_waitress_active_threads', 'gauge', 'waitress 正在执行任务的线程数', [('', {}, dispatcher.active_count)])
+
+    metric('cailu_db_queries_total', 'counter', '已执行的 SQL 语句数', [('', {}, db_totals['queries'])])
+    metric('cailu_db_query_seconds_total', 'counter', 'SQL 执行累计耗时', [('', {}, round(db_totals['ms'] / 1000, 6))])
+    metric('cailu_db_commits_total', 'counter', '数据库事务提交次数', [('', {}, db_totals['commits'])])
+
+    metric('cailu_cache_hits_total', 'counter', '进程内缓存命中次数',
+           [('', {'cache': name}, hits) for name, (hits, misses) in sorted(caches.items())])
+    metric('cailu_cache_misses_total', 'counter', '进程内缓存未命中次数',
+           [('', {'cache': name}, misses) for name, (hits, misses) in sorted(caches.items())])
+    metric('cailu_cache_hit_ratio', 'gauge', '进程内缓存命中率',
+           [('', {'cache': name}, round(hits / (hits + misses), 4)) for name, (hits, misses) in sorted(caches.items()) if hits + misses])
+
+    metric('cailu_job_last_run_timestamp_seconds', 'gauge', '后台任务最近一次开始时间',
+           [('', {'job': name}, round(j['last_run'], 3)) for name, j in sorted(jobs.items())])
+    metric('cailu_job_last_duration_seconds', 'gauge', '后台任务最近一次耗时',
+           [('', {'job': name}, round(j['duration'], 3)) for name, j in sorted(jobs.items())])
+    metric('cailu_job_last_success', 'gauge', '后台任务最近一次是否成功',
+           [('', {'job': name}, int(j['ok'])) for name, j in sorted(jobs.items())])
+    metric('cailu_job_failures_total', 'counter', '后台任务失败次数',
+           [('', {'job': name}, j['failures']) for name, j in sorted(jobs.items())])
+
+    with _outbox_lock:
+        outbox = dict(_outbox_stats)
+    metric('cailu_notification_outbox_pending', 'gauge', '发件箱待投递事件数（最近一次投递后）', [('', {}, outbox['pending'])])
+    metric('cailu_notification_outbox_dead_letters', 'gauge', '失败次数达到上限、不再投递的死信事件数', [('', {}, outbox['dead'])])
+    metric('cailu_notification_outbox_events_total', 'counter', '已投递的发件箱事件数', [('', {}, outbox['events'])])
+    metric('cailu_notifications_delivered_total', 'counter', '后台线程写入的通知条数', [('', {}, outbox['notices'])])
+    metric('cailu_notification_outbox_failures_total', 'counter', '发件箱投递失败次数', [('', {}, outbox['failures'])])
+    metric('cailu_notification_outbox_lag_seconds', 'gauge', '最近一批事件从入队到投递的最大延迟', [('', {}, round(outbox['lag'], 3))])
+    metric('cailu_notification_outbox_max_lag_seconds', 'gauge', '进程启动以来的最大投递延迟', [('', {}, round(outbox['max_lag'], 3))])
+
+    rss = process_rss_bytes()
+    if rss is not None:
+        metric('cailu_process_resident_memory_bytes', 'gauge', '进程常驻内存', [('', {}, rss)])
+    metric('cailu_process_threads', 'gauge', '进程线程数', [('', {}, threading.active_count())])
+    return '\n'.join(lines) + '\n'
+
+# ==================== 数据库自动备份 ====================
+BACKUP_PREFIX = 'db_backup_'
+BACKUP_STATUS_FILE = 'last_backup.json'
+_backup_lock = threading.Lock()
+_backup_status = {'status': 'never'}
+
+def _backup_time(filename):
+    """从文件名 db_backup_YYYYmmdd_HHMMSS.db[.gz] 解析备份时间"""
+    try:
+        return datetime.strptime(filename[len(BACKUP_PREFIX):len(BACKUP_PREFIX) + 15], '%Y%m%d_%H%M%S')
+    except ValueError:
+        return None
+
+def apply_backup_retention(backup_dir, retention, now=None):
+    """
+    祖父-父-子保留策略：每天/每周/每月各保留该周期内最新的一份，数量见 retention。
+    返回删除的文件名列表。
+    """
+    now = now or datetime.now()
+    backups = sorted(
+        ((t, f) for f in os.listdir(backup_dir)
+         if f.startswith(BACKUP_PREFIX) and (f.endswith('.db.gz') or f.endswith('.db'))
+         for t in [_backup_time(f)] if t),
+        reverse=True
+    )
+    keep = set()
+    periods = {
+        'daily': lambda t: t.date(),
+        'weekly': lambda t: t.isocalendar()[:2],
+        'monthly': lambda t: (t.year, t.month),
+    }
+    for kind, key_of in periods.items():
+        seen = []
+        for t, f in backups:
+            key = key_of(t)
+            if key in seen:
+                continue
+            if len(seen) >= retention.get(kind, 0):
+                break
+            seen.append(key)
+            keep.add(f)
+    if backups:
+        keep.add(backups[0][1])  # 最新一份始终保留
+    removed = []
+    for t, f in backups:
+        if f not in keep:
+            try:
+                os.remove(os.path.join(backup_dir, f))
+                removed.append(f)
+            except OSError as e:
+                logging.warning(f"删除过期备份失败 {f}: {e}")
+    return removed
+
+def get_backup_status():
+    """最近一次备份的状态（供健康检查/监控读取）；进程重启后从备份目录的状态文件恢复"""
+    if _backup_status.get('status') == 'never':
+        from config import BACKUP_DIR
+        try:
+            with open(os.path.join(BACKUP_DIR, BACKUP_STATUS_FILE), encoding='utf-8') as f:
+                _backup_status.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return dict(_backup_status)
+
+def auto_backup_database():
+    """
+    在线备份：sqlite3 backup API 一步复制全部页（pages=-1），
+    integrity_check 校验后 gzip 压缩，再按保留策略清理旧备份。返回状态字典。
+    """
+    import gzip
+    import sqlite3
+    from config import DATABASE_PATH, BACKUP_DIR, BACKUP_RETENTION
+    if not _backup_lock.acquire(blocking=False):
+        logging.warning("上一次备份仍在进行，跳过本次")
+        return get_backup_status()
+    started = datetime.now()
+    filename = f'{BACKUP_PREFIX}{started.strftime("%Y%m%d_%H%M%S")}.db.gz'
+    tmp_path = os.path.join(BACKUP_DIR, filename[:-3] + '.tmp')
+    status = {'status': 'running', 'file': filename, 'started_at': started.isoformat(timespec='seconds')}
+    _backup_status.clear()
+    _backup_status.update(status)
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        src = sqlite3.connect(DATABASE_PATH, timeout=30)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            # 分步复制时，其他连接的每次写入都会让备份从头重来，写入频繁时可能永远完成不了；
+            # 一步复制在同一个读事务里取快照，WAL 模式下不阻塞写入
+            src.backup(dst, pages=-1)
+            check = dst.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+        if check != 'ok':
+            raise RuntimeError(f"备份完整性校验失败: {check}")
+
+        raw_size = os.path.getsize(tmp_path)
+        with open(tmp_path, 'rb') as f_in, gzip.open(os.path.join(BACKUP_DIR, filename), 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        os.remove(tmp_path)
+
+        removed = apply_backup_retention(BACKUP_DIR, BACKUP_RETENTION)
+        status.update({
+            'status': 'ok',
+            'size_bytes': os.path.getsize(os.path.join(BACKUP_DIR, filename)),
+            'raw_size_bytes': raw_size,
+            'removed': len(removed),
+        })
+        logging.info(f"数据库备份成功: {filename}，原始 {raw_size} 字节，压缩后 {status['size_bytes']} 字节，清理旧备份 {len(removed)} 份")
     except Exception as e:
+        status.update({'status': 'failed', 'error': str(e)})
+        logging.error(f"数据库备份失败: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    finally:
+        finished = datetime.now()
+        status.update({'finished_at': finished.isoformat(timespec='seconds'),
+                       'duration_sec': round((finished - started).total_seconds(), 2)})
+        _backup_status.clear()
+        _backup_status.update(status)
         try:
-            db.session.rollback()
-        except Exception:
+            with open(os.path.join(BACKUP_DIR, BACKUP_STATUS_FILE), 'w', encoding='utf-8') as f:
+                json.dump(status, f, ensure_ascii=False)
+        except OSError:
             pass
-        print(f"[{datetime.now()}] 清理通知时出错: {e}")
+        _backup_lock.release()
+    return dict(status)
+
+# ==================== 后台调度器 ====================
+# ==================== 数据保留（分批删除 / 按月归档） ====================
+def _retention_targets():
+    """表名 -> (模型, 时间列)；ChatMessage 已停用，只做清理；发件箱只清理死信（dead_at 为空的待投递事件不受影响）"""
+    from models import Notification, OperationLog, ChatMessage, NotificationOutbox
+    return {
+        'notifications': (Notification, Notification.created_at),
+        'operation_logs': (OperationLog, OperationLog.created_at),
+        'chat_messages': (ChatMessage, ChatMessage.timestamp),
+        'notification_outbox': (NotificationOutbox, NotificationOutbox.dead_at),
+    }
+
+def _archive_rows(table, ts_key, rows):
+    """按行时间所在月份写入 ARCHIVE_DIR/archive_YYYY-MM.db，主键相同则覆盖（中断后重跑不会重复）"""
+    import sqlite3
+    from sqlalchemy.schema import CreateTable
+    from sqlalchemy.dialects import sqlite as sqlite_dialect
+    from config import ARCHIVE_DIR
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    ddl = str(CreateTable(table, if_not_exists=True).compile(dialect=sqlite_dialect.dialect()))
+    columns = [c.name for c in table.columns]
+    sql = f"INSERT OR REPLACE INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    by_month = {}
+    for row in rows:
+        month = row[ts_key].strftime('%Y-%m') if row[ts_key] else 'unknown'
+        by_month.setdefault(month, []).append(tuple(
+            v.isoformat(sep=' ') if isinstance(v, datetime) else v for v in (row[c] for c in columns)))
+    for month, values in by_month.items():
+        conn = sqlite3.connect(os.path.join(ARCHIVE_DIR, f'archive_{month}.db'))
+        try:
+            conn.execute(ddl)
+            conn.executemany(sql, values)
+            conn.commit()
+        finally:
+            conn.close()
+
+def _release_unread_counts(conn, notification_ids):
+    """删除通知前调用（同一事务）：按用户扣减本批中未读通知的数量，返回受影响的用户ID"""
+    from models import Notification, NotificationCounter
+    from sqlalchemy import select, update, func
+    deltas = conn.execute(select(Notification.user_id, func.count()).where(
+        Notification.id.in_(notification_ids), Notification.is_read == False
+    ).group_by(Notification.user_id)).all()
+    by_delta = {}
+    for uid, delta in deltas:
+        by_delta.setdefault(delta, []).append(uid)
+    for delta, uids in by_delta.items():
+        conn.execute(update(NotificationCounter).where(NotificationCounter.user_id.in_(uids)).values(
+            unread_count=func.max(NotificationCounter.unread_count - delta, 0)))
+    return [uid for uid, _ in deltas]
+
+def run_retention(tables=None, batch=None, pause=None, dry_run=False, vacuum=True):
+    """
+    按 RETENTION_POLICIES 分批清理过期数据：每批一个短事务（先归档再删除），批次之间 sleep，
+    保证夜班编辑等请求能在间隙拿到写锁。结束后在 auto_vacuum=INCREMENTAL 的库上执行 incremental_vacuum。
+    返回 {表名: {'cutoff', 'deleted', 'archived', 'batches'}}
+    """
+    from models import db
+    from sqlalchemy import select, delete, func
+    from config import RETENTION_POLICIES, RETENTION_BATCH, RETENTION_PAUSE
+    batch = batch or RETENTION_BATCH
+    pause = RETENTION_PAUSE if pause is None else pause
+    targets = _retention_targets()
+    results = {}
+    for name in tables or RETENTION_POLICIES:
+        policy = RETENTION_POLICIES[name]
+        model, ts_col = targets[name]
+        table = model.__table__
+        cutoff = datetime.now() - timedelta(days=policy['days'])
+        stats = results[name] = {'cutoff': cutoff.isoformat(timespec='seconds'), 'deleted': 0, 'archived': 0, 'batches': 0}
+        if dry_run:
+            with db.engine.connect() as conn:
+                stats['deleted'] = conn.execute(select(func.count()).select_from(table).where(ts_col < cutoff)).scalar()
+            continue
+        while True:
+            with db.engine.begin() as conn:
+                ids = conn.execute(select(table.c.id).where(ts_col < cutoff).order_by(table.c.id).limit(batch)).scalars().all()
+                if not ids:
+                    break
+                if policy.get('archive'):
+                    rows = conn.execute(select(table).where(table.c.id.in_(ids))).mappings().all()
+                    _archive_rows(table, ts_col.key, rows)
+                    stats['archived'] += len(rows)
+                # 过期通知中可能含未读：同一事务内按用户扣减计数，与投递线程的 +N 互不覆盖
+                unread_users = _release_unread_counts(conn, ids) if name == 'notifications' else []
+                stats['deleted'] += conn.execute(delete(table).where(table.c.id.in_(ids))).rowcount
+            if unread_users:
+                notice_hub.publish(unread_users)
+            stats['batches'] += 1
+            if len(ids) < batch:
+                break
+            time.sleep(pause)
+        if stats['deleted']:
+            logging.info(f"数据保留 {name}: 删除 {stats['deleted']} 行（归档 {stats['archived']}），截止 {stats['cutoff']}，{stats['batches']} 批")
+    if vacuum and not dry_run and any(r['deleted'] for r in results.values()):
+        sqlite_incremental_vacuum()
+    return results
+
+def sqlite_incremental_vacuum(pages_per_step=2000, pause=None):
+    """auto_vacuum=INCREMENTAL 时分步归还空闲页；否则只提示（需一次离线 VACUUM 才能切换，见 flask retention --enable-incremental-vacuum）"""
+    from models import db
+    from config import RETENTION_PAUSE
+    pause = RETENTION_PAUSE if pause is None else pause
+    with db.engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            logging.info("auto_vacuum 未启用 INCREMENTAL，跳过 incremental_vacuum")
+            return None
+        initial = free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        while free:
+            conn.exec_driver_sql(f"PRAGMA incremental_vacuum({pages_per_step})")
+            conn.commit()
+            remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if remaining >= free:
+                break
+            free = remaining
+            time.sleep(pause)
+        freed = initial - free
+    logging.info(f"incremental_vacuum 归还 {freed} 页")
+    return freed
+
+def enable_incremental_vacuum():
+    """把现有库切换为 auto_vacuum=INCREMENTAL（需要完整 VACUUM，会长时间持有写锁，只在停机维护时执行）"""
+    from models import db
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+
+def ensure_incremental_auto_vacuum():
+    """新建的空库在建表前切换为 auto_vacuum=INCREMENTAL（WAL 下需 VACUUM 才生效，空库瞬间完成）；已有表的库跳过"""
+    from models import db
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.connect() as conn:
+        if conn.exec_driver_sql("SELECT count(*) FROM sqlite_master").scalar() == 0:
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
 
 def _next_weekly_run(now, weekday, hour, minute):
     days_ahead = (weekday - now.weekday()) % 7
@@ -446,34 +1877,55 @@ def _next_weekly_run(now, weekday, hour, minute):
         run_dt += timedelta(days=7)
     return run_dt
 
-def start_notification_cleanup_scheduler(weekday=0, hour=3, minute=33, retention_days=30):
+def start_retention_scheduler(weekday=0, hour=3, minute=33):
+    """每周低峰期按 RETENTION_POLICIES 分批清理/归档通知、操作日志、聊天记录与发件箱死信"""
     def task():
         time.sleep(30)
         while True:
             next_run = _next_weekly_run(datetime.now(), weekday, hour, minute)
             sleep_sec = max(1, (next_run - datetime.now()).total_seconds())
             time.sleep(sleep_sec)
+            started = time.time()
             try:
                 from app import app
                 with app.app_context():
-                    cleanup_old_notifications(retention_days)
+                    run_retention()
+                record_job_run('retention', started, True)
             except Exception as e:
-                print(f"[{datetime.now()}] 通知清理线程出错: {e}")
+                record_job_run('retention', started, False)
+                logging.error(f"数据保留任务出错: {e}")
     thread = threading.Thread(target=task, daemon=True)
     thread.start()
 
 def start_backup_scheduler(interval=86400):
-    def maintenance_task():
+    """数据库备份单独调度（不依赖 app 上下文，只读数据库文件）"""
+    def backup_task():
         time.sleep(30) 
         while True:
+            started = time.time()
+            try:
+                status = auto_backup_database()
+                record_job_run('backup', started, status.get('status') == 'ok')
+            except Exception as e:
+                record_job_run('backup', started, False)
+                logging.error(f"备份线程遇到致命错误: {e}")
+            time.sleep(interval)
+    thread = threading.Thread(target=backup_task, daemon=True)
+    thread.start()
+
+def start_file_cleanup_scheduler(weekday=6, hour=4, minute=17):
+    """孤立文件清理与备份分开，每周低峰期执行一次；平时增量，每月第一周做一次全量校对"""
+    def cleanup_task():
+        while True:
+            next_run = _next_weekly_run(datetime.now(), weekday, hour, minute)
+            time.sleep(max(1, (next_run - datetime.now()).total_seconds()))
             try:
                 from app import app
                 with app.app_context():
-                    print(f"[{datetime.now()}] 启动例行维护任务...")
-                    cleanup_isolated_files()
-                    auto_backup_database()
+                    logging.info("启动孤立文件清理任务...")
+                    started = time.time()
+                    record_job_run('file_gc', started, cleanup_isolated_files(full=next_run.day <= 7) is not None)
             except Exception as e:
-                print(f"维护线程遇到致命错误: {e}")
-            time.sleep(interval)
-    thread = threading.Thread(target=maintenance_task, daemon=True)
+                logging.error(f"文件清理线程出错: {e}")
+    thread = threading.Thread(target=cleanup_task, daemon=True)
     thread.start()
\ No newline at end of file